@@ -0,0 +1,155 @@
+"""Runs validations from a single asyncio event loop.
+
+Most validations spend their time waiting on sockets, so forking a process
+for each of them costs more than the validation itself. This engine runs
+every validation in an order tier from one event loop instead. Validations
+whose `perform` is a coroutine function are awaited directly, everything
+else is run on a thread of its own.
+
+Validations that exceed the Alarmageddon timeout are cancelled rather than
+terminated. A cancelled coroutine stops at its next await, and is then
+retried. A validation running on a thread cannot be interrupted, so its
+thread is abandoned (it no longer counts towards the number of validations
+in flight) and its result discarded. It is not retried, since the retry
+would run alongside the abandoned attempt.
+
+This module requires Python 3.7 or newer and is only imported when
+:py:func:`~alarmageddon.run.run_tests` is called with ``engine="async"``.
+
+"""
+
+import asyncio
+import threading
+import time
+
+from alarmageddon.result import Failure
+from alarmageddon.run import _completed_result
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def run_order_set_async(order_set, immutable_group_failures, results,
+                        processes=1, timeout=60, timeout_retries=3,
+                        on_result=None):
+    """Run every validation in a single order tier on an event loop.
+
+    Has the same contract as :py:func:`alarmageddon.run._run_order_set`,
+    except that `processes` is the number of validations that may be in
+    flight at once.
+
+    """
+    asyncio.run(_run_order_set(order_set, immutable_group_failures, results,
+                               max(processes, 1), timeout, timeout_retries,
+                               on_result))
+
+
+async def _run_order_set(order_set, immutable_group_failures, results,
+                         concurrency, timeout, timeout_retries, on_result):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def perform(valid):
+        result = await _perform(valid, immutable_group_failures, semaphore,
+                                timeout, timeout_retries)
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    await asyncio.gather(*[perform(valid) for valid in order_set])
+
+
+async def _perform(validation, immutable_group_failures, semaphore, timeout,
+                   timeout_retries):
+    """Perform a validation, retrying it if it exceeds `timeout`."""
+    async with semaphore:
+        for _ in range(timeout_retries):
+            if asyncio.iscoroutinefunction(validation.perform):
+                start = time.time()
+                task = asyncio.ensure_future(
+                    validation.perform(immutable_group_failures))
+            else:
+                started, task = _start_thread(validation,
+                                              immutable_group_failures)
+                #the timeout only counts down once the validation is running
+                await started
+                start = time.time()
+            done, _ = await asyncio.wait([task], timeout=timeout)
+            if not done:
+                logger.warn("Validation {} ran for longer than {}".format(
+                    validation, timeout))
+                if not await _stop(task, timeout):
+                    #still running, so retrying would run it twice at once
+                    break
+                continue
+            try:
+                task.result()
+            except Exception as e:
+                return Failure(validation.name, validation, str(e),
+                               time=time.time() - start)
+            return _completed_result(validation, start)
+
+    return Failure(validation.name, validation,
+                   "{} failed to terminate (ran for {}s)".format(validation, timeout),
+                   time=timeout)
+
+
+async def _stop(task, timeout):
+    """Cancel a validation that ran too long, returning whether it stopped.
+
+    Validations running on a thread can't be stopped.
+
+    """
+    if isinstance(task, _ThreadFuture):
+        return False
+    task.cancel()
+    #a coroutine may take a while to stop (or not stop at all)
+    await asyncio.wait([task], timeout=timeout)
+    return task.done()
+
+
+class _ThreadFuture(asyncio.Future):
+    """The outcome of a validation performed on its own thread."""
+    pass
+
+
+def _start_thread(validation, immutable_group_failures):
+    """Perform a synchronous validation on a thread of its own.
+
+    Returns a (started, finished) pair of futures. A thread per validation,
+    rather than a pool, means that a thread abandoned by a timeout never
+    holds up the validations after it.
+
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+    finished = _ThreadFuture(loop=loop)
+
+    def resolve(future, exception=None):
+        if future.done():
+            return
+        if exception is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exception)
+
+    def notify(future, exception=None):
+        try:
+            loop.call_soon_threadsafe(resolve, future, exception)
+        except RuntimeError:
+            #the loop is gone; nobody is waiting on an abandoned validation
+            pass
+
+    def run():
+        notify(started)
+        try:
+            validation.perform(immutable_group_failures)
+        except Exception as e:
+            notify(finished, e)
+        else:
+            notify(finished)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return started, finished
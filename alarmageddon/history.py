@@ -0,0 +1,327 @@
+"""A local, append-only store of validation results.
+
+Results are written to a directory as a series of segment files. Each
+segment is a flat array of fixed size binary records, so a segment can be
+memory mapped and searched by timestamp without reading it all. Validation
+names are kept once in a separate name table rather than in every record.
+Each line of the name table holds the index records refer to it by, so
+that an entry lost to a crash can't shift the entries after it.
+
+Every record holds:
+
+* when the result was recorded (seconds since the epoch)
+* which validation it belongs to (an index into the name table)
+* the priority of the result
+* whether the validation failed
+* how long the validation took (NaN if unknown)
+* the first 8 bytes of the md5 of the result's description, so that
+  repeated descriptions can be recognized without storing them
+
+Segments are only ever appended to. Once the segment being written reaches
+`segment_bytes` a new one is started, and the oldest segments are deleted
+once there are more than `max_segments` of them.
+
+"""
+
+import bisect
+import collections
+import hashlib
+import io
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+#timestamp, name index, priority, failed, (padding), duration,
+#description hash
+_RECORD = struct.Struct("<dIBB2xd8s")
+RECORD_SIZE = _RECORD.size
+
+_NAMES_FILE = "names.jsonl"
+_SEGMENT_FORMAT = "segment-{:010d}.bin"
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".bin"
+
+#a hash of "no description"
+_NO_HASH = b"\0" * 8
+
+HistoryRecord = collections.namedtuple(
+    "HistoryRecord", ["timestamp", "validation_id", "name", "priority",
+                      "failed", "duration", "description_hash"])
+
+
+def description_hash(description):
+    """Return the 8 byte hash stored for a result description."""
+    if description is None:
+        return _NO_HASH
+    if not isinstance(description, bytes):
+        description = description.encode("utf-8")
+    return hashlib.md5(description).digest()[:8]
+
+
+class _Timestamps(object):
+    """A read only sequence of the timestamps in a mapped segment.
+
+    Lets bisect find records by time without unpacking the whole segment.
+
+    """
+
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return _RECORD.unpack_from(self.data, i * RECORD_SIZE)[0]
+
+
+class HistoryStore(object):
+    """Appends results to, and reads them back from, a history directory.
+
+    Timestamps never go backwards within a store: a result appended with an
+    earlier timestamp than the last one is recorded at the last one's time.
+    This keeps every segment sorted, so scans can binary search them.
+
+    A store may be appended to from several threads, but only one process
+    should append to a given directory at a time.
+
+    :param directory: The directory to keep the history in. It is created
+      if it doesn't exist.
+    :param segment_bytes: How large a segment may grow before a new one
+      is started.
+    :param max_segments: How many segments to keep. If None, segments are
+      never deleted.
+
+    """
+
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024,
+                 max_segments=None):
+        if segment_bytes < RECORD_SIZE:
+            raise ValueError("segment_bytes must be at least {}".format(
+                RECORD_SIZE))
+        if max_segments is not None and max_segments < 1:
+            raise ValueError("max_segments must be at least 1")
+
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        #the name table, as (validation id, name) pairs, and the index of
+        #each validation id in it
+        self._names = []
+        self._name_indexes = {}
+        self._load_names()
+        self._names_file = io.open(self._path(_NAMES_FILE), "a",
+                                   encoding="utf-8")
+
+        self._segments = self._find_segments()
+        self._last_timestamp = self._find_last_timestamp()
+        self._segment_file = None
+
+    def append(self, result, timestamp=None):
+        """Record a result.
+
+        :param result: The :py:class:`~.result.TestResult` to record.
+        :param timestamp: When the result happened. Defaults to now.
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        duration = result.time
+        if duration is None:
+            duration = float("nan")
+
+        with self._lock:
+            timestamp = max(timestamp, self._last_timestamp)
+            index = self._name_index(result.validation_id,
+                                     result.test_name())
+            record = _RECORD.pack(timestamp, index, result.priority,
+                                  result.is_failure(), duration,
+                                  description_hash(result.description()))
+            self._current_segment().write(record)
+            #flushed straight away so that scans (which map the file) see it
+            self._segment_file.flush()
+            self._last_timestamp = timestamp
+
+    def scan(self, start=None, end=None, validation_id=None):
+        """Iterate over recorded results, oldest first.
+
+        :param start: If given, skip results recorded before this time.
+        :param end: If given, stop at results recorded after this time.
+        :param validation_id: If given, only return results of the
+          validation with this id (see
+          :py:meth:`~.validation.Validation.fingerprint`).
+
+        Returns an iterator of :py:class:`HistoryRecord` tuples.
+
+        """
+        with self._lock:
+            segments = list(self._segments)
+            names = list(self._names)
+            if self._segment_file is not None:
+                self._segment_file.flush()
+
+        index = None
+        if validation_id is not None:
+            index = self._name_indexes.get(validation_id)
+            if index is None:
+                return
+
+        for segment in segments:
+            path = self._path(_SEGMENT_FORMAT.format(segment))
+            try:
+                count = os.path.getsize(path) // RECORD_SIZE
+                if count == 0:
+                    continue
+                with open(path, "rb") as f:
+                    data = mmap.mmap(f.fileno(), count * RECORD_SIZE,
+                                     access=mmap.ACCESS_READ)
+            except EnvironmentError:
+                #deleted by rotation since we looked
+                continue
+            try:
+                timestamps = _Timestamps(data, count)
+                if end is not None and timestamps[0] > end:
+                    return
+                if start is not None and timestamps[count - 1] < start:
+                    continue
+                first = 0
+                if start is not None:
+                    first = bisect.bisect_left(timestamps, start)
+                for i in range(first, count):
+                    (timestamp, name_index, priority, failed, duration,
+                     digest) = _RECORD.unpack_from(data, i * RECORD_SIZE)
+                    if end is not None and timestamp > end:
+                        return
+                    if index is not None and name_index != index:
+                        continue
+                    if math.isnan(duration):
+                        duration = None
+                    if name_index >= len(names):
+                        #appended since the scan started
+                        names = list(self._names)
+                    validation, name = names[name_index]
+                    yield HistoryRecord(timestamp, validation, name,
+                                        priority, bool(failed), duration,
+                                        digest)
+            finally:
+                data.close()
+
+    def close(self):
+        """Close any open files."""
+        with self._lock:
+            if self._segment_file is not None:
+                self._segment_file.close()
+                self._segment_file = None
+            self._names_file.close()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_names(self):
+        path = self._path(_NAMES_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            #a partially written last line, which would otherwise have the
+            #next entry appended onto it
+            logger.warn("Dropping partial name table entry: {}".format(
+                data[complete:]))
+            with open(path, "r+b") as f:
+                f.truncate(complete)
+        for line in data[:complete].decode("utf-8").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warn("Ignoring bad name table entry: {}".format(
+                    line))
+                continue
+            if len(entry) == 2:
+                #written before entries held their index
+                index = len(self._names)
+                validation_id, name = entry
+            else:
+                index, validation_id, name = entry
+            while len(self._names) <= index:
+                self._names.append((None, None))
+            self._names[index] = (validation_id, name)
+            self._name_indexes[validation_id] = index
+
+    def _name_index(self, validation_id, name):
+        index = self._name_indexes.get(validation_id)
+        if index is None:
+            index = len(self._names)
+            #written before any record refers to it
+            self._names_file.write(
+                u"%s\n" % json.dumps([index, validation_id, name]))
+            self._names_file.flush()
+            self._name_indexes[validation_id] = index
+            self._names.append((validation_id, name))
+        return index
+
+    def _find_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if (name.startswith(_SEGMENT_PREFIX) and
+                    name.endswith(_SEGMENT_SUFFIX)):
+                segments.append(int(
+                    name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def _find_last_timestamp(self):
+        for segment in reversed(self._segments):
+            path = self._path(_SEGMENT_FORMAT.format(segment))
+            count = os.path.getsize(path) // RECORD_SIZE
+            if count:
+                with open(path, "rb") as f:
+                    f.seek((count - 1) * RECORD_SIZE)
+                    return _RECORD.unpack(f.read(RECORD_SIZE))[0]
+        return 0
+
+    def _current_segment(self):
+        if self._segment_file is None:
+            if not self._segments:
+                self._start_segment()
+            else:
+                path = self._path(_SEGMENT_FORMAT.format(self._segments[-1]))
+                size = os.path.getsize(path)
+                if size % RECORD_SIZE:
+                    #drop a partially written record
+                    with open(path, "r+b") as f:
+                        f.truncate(size - size % RECORD_SIZE)
+                self._segment_file = open(path, "ab")
+                self._segment_file.seek(0, os.SEEK_END)
+        if self._segment_file.tell() + RECORD_SIZE > self.segment_bytes:
+            self._segment_file.close()
+            self._start_segment()
+        return self._segment_file
+
+    def _start_segment(self):
+        segment = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(segment)
+        self._segment_file = open(self._path(_SEGMENT_FORMAT.format(segment)),
+                                  "ab")
+        if self.max_segments is not None:
+            while len(self._segments) > self.max_segments:
+                oldest = self._segments.pop(0)
+                os.remove(self._path(_SEGMENT_FORMAT.format(oldest)))
+
+    def __repr__(self):
+        return "HistoryStore: {} ({} segments)".format(
+            self.directory, len(self._segments))
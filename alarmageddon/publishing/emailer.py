@@ -104,6 +104,9 @@ class SimpleEmailPublisher(Publisher):
     :param environment: The environment that tests are being run in.
     """
 
+    #each result is published on its own
+    streams_results = True
+
     def __init__(self, sender_address, recipient_addresses,
                  host=None, port=None, name='EmailPublisher',
                  priority_threshold=None, connect_timeout_seconds=10,
@@ -142,7 +145,7 @@ class SimpleEmailPublisher(Publisher):
 
         """
 
-        logger.debug("Checking if we should send {}".format(result))
+        logger.debug("Checking if we should send %s", result)
         if result.is_failure() and self.will_publish(result):
 
             message_body = result.description()
@@ -154,7 +157,7 @@ class SimpleEmailPublisher(Publisher):
                                          message_subject,
                                          message_body)
 
-            logger.debug("Sending {} to {} from server {}:{}".format(result, self.recipient_addresses, self.host, self.port))
+            logger.debug("Sending %s to %s from server %s:%s", result, self.recipient_addresses, self.host, self.port)
 
             """ A note regarding recipient addresses:
 
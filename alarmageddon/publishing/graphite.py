@@ -28,6 +28,9 @@ class GraphitePublisher(Publisher):
 
     """
 
+    #each result is published on its own
+    streams_results = True
+
     def __init__(self, host, port,
                  failed_tests_counter='failed',
                  passed_tests_counter='passed',
@@ -72,7 +75,7 @@ class GraphitePublisher(Publisher):
 
         """
 
-        logger.debug("Checking if we should send {}".format(result))
+        logger.debug("Checking if we should send %s", result)
         if self.will_publish(result):
             if result.is_failure():
                 logger.info("Sending {} to {}".format(result,
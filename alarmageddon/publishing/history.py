@@ -0,0 +1,58 @@
+"""Support for publishing to a local result history."""
+
+from alarmageddon.history import HistoryStore
+from alarmageddon.publishing.publisher import Publisher
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryPublisher(Publisher):
+    """A Publisher that records every result in a
+    :py:class:`~alarmageddon.history.HistoryStore`.
+
+    Successes are recorded as well as failures, so that the history can be
+    used to look at how a validation has behaved over time.
+
+    :param directory: The directory to keep the history in.
+    :param segment_bytes: How large a history segment may grow before a
+      new one is started.
+    :param max_segments: How many history segments to keep. If None,
+      segments are never deleted.
+    :param priority_threshold: Will publish validations of this priority or
+      higher.
+    :param environment: The environment that tests are being run in.
+
+    """
+
+    #each result is published on its own
+    streams_results = True
+
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024,
+                 max_segments=None, priority_threshold=None,
+                 environment=None):
+        if not directory:
+            raise ValueError("directory parameter is required")
+
+        logger.debug("Constructing publisher with directory:{}, "
+                "segment_bytes:{}, max_segments:{}, priority_threshold:{}, "
+                "environment:{}".format(directory, segment_bytes,
+                    max_segments, priority_threshold, environment))
+
+        Publisher.__init__(self, "History",
+                           priority_threshold=priority_threshold,
+                           environment=environment)
+
+        self.store = HistoryStore(directory, segment_bytes=segment_bytes,
+                                  max_segments=max_segments)
+
+    def __repr__(self):
+        return "History, records to {} (threshold: {})".format(
+                self.store.directory, self.priority_threshold)
+
+    def send(self, result):
+        """Record a result in the history."""
+        if self.will_publish(result):
+            logger.debug("Recording %s", result)
+            self.store.append(result)
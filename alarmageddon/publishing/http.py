@@ -52,6 +52,10 @@ class HttpPublisher(Publisher):
       higher.
     :param environment: The environment that tests are being run in.
     """
+
+    #each result is published on its own
+    streams_results = True
+
     def __init__(self, url=None, success_url=None, failure_url=None,
                  method="POST", headers=None, auth=None, attempts=1,
                  retry_after_seconds=2, timeout_seconds=5,
@@ -6,7 +6,6 @@ from alarmageddon.publishing.exceptions import PublishFailure
 import requests
 import json
 import time
-import hashlib
 import warnings
 
 import logging
@@ -30,6 +29,9 @@ class PagerDutyPublisher(Publisher):
     :param environment: The environment that tests are being run in.
      """
 
+    #each result is published on its own
+    streams_results = True
+
     def __init__(self, api_end_point, api_key, priority_threshold=None,
                  environment=None):
         if not api_end_point:
@@ -61,22 +63,15 @@ class PagerDutyPublisher(Publisher):
         By assigning a unique ID for a validation, PagerDuty will not page
         for repeated failures if the original has not been resolved.
 
-        The details of a result may vary, but by using the validation itself,
-        this id should be the same from run to run.
+        The details of a result may vary, but by using the fingerprint of the
+        validation, this id should be the same from run to run.
 
-        :param message: The message to hash into an id.
+        :param result: The result to generate an id for.
 
         """
-        validation = result.validation
-
-        #this is still not optimal - validations may mutate between creation
-        #and here
-        message = str(type(validation)) + str(validation.__dict__)
-        hasher = hashlib.md5()
-        hasher.update(message.encode('utf-8'))
-        pagerduty_id = hasher.hexdigest()
+        pagerduty_id = result.validation_id
 
-        logger.debug("Generated id {} for {}".format(pagerduty_id, result))
+        logger.debug("Generated id %s for %s", pagerduty_id, result)
         return pagerduty_id
 
     def _construct_message(self, result):
@@ -97,7 +92,7 @@ class PagerDutyPublisher(Publisher):
 
         """
 
-        logger.debug("Checking if we should send {}".format(result))
+        logger.debug("Checking if we should send %s", result)
         if result.is_failure() and self.will_publish(result):
             message = self._construct_message(result)
             headers = {
@@ -112,7 +107,7 @@ class PagerDutyPublisher(Publisher):
             })
 
             #exponential backoff
-            logger.debug("Sending send {}".format(result))
+            logger.debug("Sending send %s", result)
             for i in range(4):
                 resp = requests.post(self._api_end_point,
                                      data=data, headers=headers, stream=True)
@@ -12,6 +12,11 @@ class Publisher(object):
     :param environment: The environment that tests are being run in.
     """
 
+    #whether results can be sent one at a time (with send) as they come in,
+    #rather than only as part of the final batch. Only publishers whose
+    #send_batch does nothing more than send each result should set this.
+    streams_results = False
+
     def __init__(self, name=None, priority_threshold=None,
                  environment=None):
         self._name = name
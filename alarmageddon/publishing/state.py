@@ -0,0 +1,67 @@
+"""Support for only publishing changes in the state of validations."""
+
+from alarmageddon.publishing.publisher import Publisher
+from alarmageddon.state import StateTracker
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StateChangePublisher(Publisher):
+    """A Publisher that passes on only the results that change something.
+
+    Wraps another publisher, and only sends it results that a
+    :py:class:`~alarmageddon.state.StateTracker` considers worth publishing:
+    validations that started or stopped failing, and (optionally) periodic
+    reminders of validations that are still failing. Results of flapping
+    validations are held back until they settle down.
+
+    Each StateChangePublisher should have its own tracker, since the
+    tracker records that a result was published.
+
+    :param publisher: The :py:class:`~.publisher.Publisher` to send results
+      to.
+    :param tracker: The :py:class:`~alarmageddon.state.StateTracker` that
+      decides what gets published. If None, a tracker with default settings
+      is used.
+
+    """
+
+    def __init__(self, publisher, tracker=None):
+        if publisher is None:
+            raise ValueError("publisher parameter is required")
+
+        Publisher.__init__(self, publisher.name(),
+                           priority_threshold=publisher.priority_threshold,
+                           environment=publisher.environment)
+
+        self.publisher = publisher
+        self.tracker = tracker or StateTracker()
+        self.streams_results = getattr(publisher, "streams_results", False)
+
+    def __repr__(self):
+        return "State changes of {}".format(self.publisher)
+
+    def will_publish(self, result):
+        """Determine if the wrapped publisher will publish the result."""
+        return self.publisher.will_publish(result)
+
+    def send(self, result):
+        """Send the result to the wrapped publisher if it changes anything."""
+        if self.tracker.should_publish(result):
+            self.publisher.send(result)
+
+    def send_batch(self, results):
+        """Send the results that change anything to the wrapped publisher.
+
+        They are sent together, so publishers that summarize a batch still
+        can.
+
+        """
+        changes = [result for result in results
+                   if self.tracker.should_publish(result)]
+        logger.debug("Publishing %s of %s results", len(changes),
+                     len(results))
+        if changes:
+            self.publisher.send_batch(changes)
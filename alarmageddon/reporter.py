@@ -1,10 +1,16 @@
 """Reports test results to registered publishers."""
 
 from .publishing.exceptions import PublishFailure
+from six.moves import queue
+import threading
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+#queued to tell a stream thread that there are no more results to send
+_FINISHED = object()
+
 class ReportingFailure(Exception):
     """An exception that aggregates multiple PublishFailures.
 
@@ -20,17 +26,85 @@ class ReportingFailure(Exception):
         self.failures = failures
 
 
+class _PublishThread(threading.Thread):
+    """Sends a batch of results to a single publisher."""
+
+    def __init__(self, publisher, results):
+        threading.Thread.__init__(self)
+        #a publisher that never returns shouldn't keep Alarmageddon alive
+        self.daemon = True
+        self.publisher = publisher
+        self.results = results
+        self.errors = []
+        self.elapsed = 0
+
+    def run(self):
+        start = time.time()
+        try:
+            self.publisher.send_batch(self.results)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.elapsed = time.time() - start
+
+
+class _StreamThread(threading.Thread):
+    """Sends results to a single publisher one at a time, as they come in.
+
+    Results are queued so that a slow publisher never holds up whoever is
+    collecting them. Call `finish` once no more results will be queued.
+
+    """
+
+    def __init__(self, publisher):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.publisher = publisher
+        self.queue = queue.Queue()
+        self.errors = []
+        self.elapsed = 0
+
+    def run(self):
+        while True:
+            result = self.queue.get()
+            if result is _FINISHED:
+                return
+            start = time.time()
+            try:
+                self.publisher.send(result)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.elapsed += time.time() - start
+
+    def finish(self):
+        self.queue.put(_FINISHED)
+
+
 class Reporter(object):
     """Class for collecting and sending results to publishers.
 
     :param publishers: List of
         :py:class:`~publisher.Publisher` objects to send results to.
+    :param publish_timeout: How many seconds each publisher is given to
+        publish. A publisher that takes longer is reported as a failure.
+        If None, publishers are waited on indefinitely.
+    :param stream: If True, results are sent to publishers that support it
+        (see :py:attr:`~publisher.Publisher.streams_results`) as soon as
+        they are collected. Other publishers are sent every result at once
+        when :py:meth:`report` is called.
 
     """
 
-    def __init__(self, publishers):
+    def __init__(self, publishers, publish_timeout=None, stream=False):
         self.publishers = publishers
+        self.publish_timeout = publish_timeout
+        self.stream = stream
         self._reports = []
+        self._streams = None
+
+        #how long each publisher took to publish during the last report
+        self.publish_times = {}
 
     def collect(self, result):
         """Construct a result from item and store for publishing.
@@ -38,23 +112,101 @@ class Reporter(object):
         Called by pytest, through the Alarmageddon :py:class:`.plugin`.
 
         """
-        logger.debug("Collecting {}".format(result))
+        logger.debug("Collecting %s", result)
         self._reports.append(result)
+        if self.stream:
+            if self._streams is None:
+                self._start_streams()
+            for thread in self._streams:
+                thread.queue.put(result)
+
+    def _start_streams(self):
+        self._streams = [_StreamThread(publisher)
+                         for publisher in self.publishers
+                         if _streams_results(publisher)]
+        for thread in self._streams:
+            logger.debug("Streaming to %s", thread.publisher)
+            thread.start()
 
     def report(self):
-        """Send reports to all publishers"""
-        errors = []
-        for publisher in self.publishers:
-            logger.debug("Reporting to {}".format(publisher))
-            try:
-                publisher.send_batch(self._reports)
-            except PublishFailure as e:
-                #we don't want to block other publishers from publishing
-                #so just keep going for now
-                errors.append(e)
+        """Send reports to all publishers.
+
+        Publishers are sent their reports at the same time, so a slow
+        publisher doesn't hold up the others. How long each publisher took
+        is recorded in `publish_times`.
+
+        In streaming mode, publishers that have been sent results as they
+        were collected are given the chance to finish sending them, and
+        only the remaining publishers are sent the full batch.
 
+        """
+        streams = self._streams or []
+        self._streams = None
+        streamed = set(id(thread.publisher) for thread in streams)
+        if self.stream:
+            #publishers that haven't seen a result yet (e.g. because
+            #nothing was collected) stream nothing, but shouldn't be sent
+            #the batch either
+            streamed.update(id(publisher) for publisher in self.publishers
+                            if _streams_results(publisher))
+
+        threads = [_PublishThread(publisher, self._reports)
+                   for publisher in self.publishers
+                   if id(publisher) not in streamed]
+        start = time.time()
+        for thread in streams:
+            thread.finish()
+        for thread in threads:
+            logger.debug("Reporting to %s", thread.publisher)
+            thread.start()
+
+        errors = []
+        unexpected = None
+        self.publish_times = {}
+        for thread in streams + threads:
+            if self.publish_timeout is None:
+                thread.join()
+            else:
+                thread.join(max(start + self.publish_timeout - time.time(), 0))
+
+            if thread.is_alive():
+                logger.warn("{} did not finish publishing within {}s".format(
+                    thread.publisher, self.publish_timeout))
+                self.publish_times[thread.publisher] = thread.elapsed + (
+                    time.time() - start)
+                errors.append(PublishFailure(thread.publisher,
+                    "did not finish publishing within {}s".format(
+                        self.publish_timeout)))
+                continue
+
+            self.publish_times[thread.publisher] = thread.elapsed
+            for error in thread.errors:
+                if isinstance(error, PublishFailure):
+                    #we don't want to block other publishers from publishing
+                    #so just keep going for now
+                    errors.append(error)
+                elif unexpected is None:
+                    unexpected = error
+
+        logger.info("Publishing times: {}".format(self.publish_times))
+        if unexpected is not None:
+            raise unexpected
         if errors:
             raise ReportingFailure(errors)
 
+    def reset(self):
+        """Forget every collected result.
+
+        Used when a reporter reports more than once, so that each report
+        only contains the results collected since the last one.
+
+        """
+        self._reports = []
+
     def __repr__(self):
         return "Reporter: {} {}".format(self.publishers, self._reports)
+
+
+def _streams_results(publisher):
+    #publishers that don't say otherwise only get the final batch
+    return getattr(publisher, "streams_results", False)
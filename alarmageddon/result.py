@@ -1,11 +1,21 @@
 """ Classes that represent possible results of running a test."""
 
+import weakref
+
+# Marks a lazily computed field that hasn't been computed yet
+_UNSET = object()
 
 class TestResult(object):
     """Base class representing the result of performing a validation.
 
     Contains the outcome information that Alarmageddon will publish.
 
+    Results use __slots__ to keep their footprint small when many of them
+    are kept around, and only hold a weak reference to their validation, so
+    they don't keep it alive. Their string form is only built when it is first
+    needed and is then reused, so logging a result at a disabled level
+    costs nothing.
+
     :param test_name: Name of the validation this result is associated with.
     :param validation: The :py:class:`~validation.Validation` this result is
       associated with.
@@ -16,6 +26,10 @@ class TestResult(object):
 
     """
 
+    __slots__ = ("_test_name", "_description", "time", "_priority",
+                 "_timer_name", "group", "validation_id", "_validation",
+                 "_str")
+
     def __init__(self, test_name, validation,
                  description=None, time=None):
         self._test_name = test_name
@@ -23,12 +37,54 @@ class TestResult(object):
 
         self.time = time
 
-        # if this is set, it will report the time to graphite and this
-        # will be the label in graphite
-        self.timer_name = validation.timer_name()
-        self.priority = validation.priority
+        # copied rather than read from the validation when needed, since
+        # validations may change their priority while they are performed
+        self._priority = validation.priority
+        self._timer_name = _UNSET
+        self._str = None
+
+        self.group = validation.group
+        #a stable identifier for the validation, that stays the same from
+        #run to run. Only used to tell runs of the same validation apart
+        #from others, since different validations may share it.
+        self.validation_id = validation.fingerprint()
+        self._validation = weakref.ref(validation)
+
+    @property
+    def validation(self):
+        """The :py:class:`~validation.Validation` this result is associated
+        with, or None if it no longer exists.
+
+        """
+        return self._validation()
+
+    @property
+    def priority(self):
+        """The priority of the validation when it was performed."""
+        return self._priority
 
-        self.validation = validation
+    @priority.setter
+    def priority(self, priority):
+        self._priority = priority
+        self._str = None
+
+    @property
+    def timer_name(self):
+        """The name of the timer that records how long the validation took.
+
+        If this is set, publishers that record timings (e.g. Graphite) will
+        use it as the label for this result's time.
+
+        """
+        if self._timer_name is _UNSET:
+            validation = self.validation
+            self._timer_name = (validation.timer_name()
+                                if validation is not None else None)
+        return self._timer_name
+
+    @timer_name.setter
+    def timer_name(self, timer_name):
+        self._timer_name = timer_name
 
     def test_name(self):
         """Returns the name of the test."""
@@ -47,9 +103,11 @@ class TestResult(object):
         pass
 
     def __str__(self):
-        return "Result: '%s', Description: '%s', Failure: %s, Priority: %s" % (
-            self._test_name, self._description,
-            self.is_failure(), self.validation.priority)
+        if self._str is None:
+            self._str = "Result: '%s', Description: '%s', Failure: %s, Priority: %s" % (
+                self._test_name, self._description,
+                self.is_failure(), self._priority)
+        return self._str
 
     def __repr__(self):
         return self.__str__()
@@ -62,6 +120,8 @@ class Failure(TestResult):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, test_name, validation, description, time=None):
         TestResult.__init__(self, test_name, validation, description, time)
 
@@ -73,6 +133,8 @@ class Failure(TestResult):
 class Success(TestResult):
     """The result of a successful validation."""
 
+    __slots__ = ()
+
     def __init__(self, test_name, validation, description=None, time=None):
         TestResult.__init__(self, test_name, validation, description, time)
 
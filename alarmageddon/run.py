@@ -1,5 +1,6 @@
 """Methods that support running tests"""
 
+import sys
 import time
 import collections
 import multiprocessing
@@ -17,6 +18,13 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# How often (in seconds) running validations are checked for completion
+_POLL_INTERVAL = 0.05
+
+# The ways validations can be executed. "process" runs each validation in its
+# own worker process; "async" runs them all on an asyncio event loop.
+ENGINES = ("process", "async")
+
 def load_config(config_path, environment_name):
     """Helper method for loading a :py:class:`~alarmageddon.config.Config`
 
@@ -29,7 +37,8 @@ def load_config(config_path, environment_name):
 
 def run_tests(validations, publishers=None, config_path=None,
               environment_name=None, config=None, dry_run=False,
-              processes=1, print_banner=True, timeout=60, timeout_retries=2):
+              processes=1, print_banner=True, timeout=60, timeout_retries=2,
+              engine=None, publish_timeout=None, stream=False):
     """Main entry point into Alarmageddon.
 
     Run the given validations and report them to given publishers.
@@ -44,10 +53,26 @@ def run_tests(validations, publishers=None, config_path=None,
     :param dry_run: When True, will prevent Alarmageddon from performing
       validations or publishing results, and instead will print which
       validations will be published by which publishers upon failure.
-    :param processes: The number of worker processes to spawn.
+    :param processes: The maximum number of validations to run at the
+      same time. Each validation runs in its own worker process.
     :param print_banner: When True, print the Alarmageddon banner.
     :timeout: If a validation runs for longer than this number of seconds,
       Alarmageddon will kill the process running it.
+    :param engine: How validations are executed. Either "process", which
+      runs each validation in its own worker process, or "async", which runs
+      every validation from a single asyncio event loop. Validations whose
+      `perform` is a coroutine function are awaited directly; all others run
+      in a thread pool. With the "async" engine, `processes` is the number of
+      validations that may be in flight at once. The "async" engine requires
+      Python 3.7 or newer. Open SSH connections are only reused between
+      validations performed in the same process, so if None (the default)
+      the "async" engine is used when there are SSH validations and the
+      interpreter supports it, and the "process" engine otherwise.
+    :param publish_timeout: How many seconds each publisher is given to
+      publish results. Publishers that take longer are reported as failures.
+    :param stream: If True, results are sent to publishers that can publish
+      them one at a time as soon as each validation finishes, rather than
+      once every validation has been performed.
 
     .. deprecated:: 1.0.0
         These parameters are no longer used: *config_path*,
@@ -77,6 +102,12 @@ def run_tests(validations, publishers=None, config_path=None,
         raise ValueError("run_tests expected non-empty list of validations," +
                          "got {} instead".format(validations))
 
+    if engine is None:
+        engine = _default_engine(validations)
+    if engine not in ENGINES:
+        raise ValueError(("run_tests expected engine to be one of {}, " +
+                          "got {} instead").format(ENGINES, engine))
+
     if print_banner:
         banner.print_banner(True)
 
@@ -85,26 +116,43 @@ def run_tests(validations, publishers=None, config_path=None,
 
     if not dry_run:
         # run all of the tests
-        _run_validations(validations, Reporter(publishers), processes,
-                timeout, timeout_retries)
+        reporter = Reporter(publishers, publish_timeout=publish_timeout,
+                            stream=stream)
+        _run_validations(validations, reporter, processes,
+                timeout, timeout_retries, engine)
 
 
-def _run_validations(validations, reporter, processes=1, timeout=60, timeout_retries=3):
+def _default_engine(validations):
+    """Pick the engine for validations when run_tests isn't given one."""
+    #only validations performed from one process share the SSH connections
+    #kept open by their pool
+    if sys.version_info >= (3, 7) and any(
+            getattr(validation, "connection_pool", None) is not None
+            for validation in validations):
+        return "async"
+    return "process"
+
+
+def _run_validations(validations, reporter, processes=1, timeout=60,
+                     timeout_retries=3, engine="process"):
     """ Run the given validations and publish the results
 
-    Sort validations by order and then run them. All results are logged
-    to the given reporter. Once everything has been run, the reporter
-    will publish.
+    Sort validations by order and then run them. Each result is logged
+    to the given reporter as soon as its validation finishes. Once
+    everything has been run, the reporter will publish.
 
     :param validations: List of :py:class:`~.validation.Validation` objects
       that Alarmageddon will perform.
     :param publishers: :py:class:`~.reporter.Reporter` object that will
       collect validation results and then report those results to its
       publishers.
-    :processes: The number of worker processes to spawn. Does not run
-      spawn additional processes if set to 1.
+    :processes: The maximum number of validations (each in its own worker
+      process) to run at the same time within an order tier.
     :timeout: If a validation runs for longer than this number of seconds,
       Alarmageddon will kill the process running it.
+    :timeout_retries: The number of times a validation will be attempted
+      before it is recorded as a failure for exceeding `timeout`.
+    :engine: How validations are executed, one of :py:data:`ENGINES`.
 
     """
     order_dict = collections.defaultdict(list)
@@ -120,57 +168,177 @@ def _run_validations(validations, reporter, processes=1, timeout=60, timeout_ret
             group_failures[validation.group] = []
 
 
-    manager = multiprocessing.Manager()
+    if engine == "async":
+        #imported here so that the process engine keeps working on
+        #interpreters without asyncio
+        from alarmageddon.async_run import run_order_set_async
+        run_order_set = run_order_set_async
+    else:
+        run_order_set = _run_order_set
+
     for order_set in ordered_validations:
+        _prefetch(order_set)
         immutable_group_failures = dict(group_failures)
-        results = manager.list()
-        for valid in order_set:
-            for i in range(timeout_retries):
-                #TODO: parallelize
-                p = multiprocessing.Process(target=_perform, args=(valid, immutable_group_failures, results))
-                p.start()
-                p.join(timeout)
-                if p.is_alive():
-                    #job is taking too long, kill it
-                    #this is messy, but we assume that if something hit the
-                    #general alarmageddon timeout, then it's stuck somewhere
-                    #and we can't stop it nicely
-                    p.terminate()
-                    logger.warn("Validation {} ran for longer than {}".format(valid, timeout))
-                else:
-                    break
-            else:
-                results.append(Failure(valid.name, valid,
-                                       "{} failed to terminate (ran for {}s)".format(valid,timeout),
-                                       time=timeout))
+        results = []
+        run_order_set(order_set, immutable_group_failures, results,
+                       processes, timeout, timeout_retries,
+                       on_result=reporter.collect)
         for result in results:
-            if result.is_failure() and result.validation.group is not None:
-                group_failures[result.validation.group].append(result.description())
-            reporter.collect(result)
+            if result.is_failure() and result.group is not None:
+                group_failures[result.group].append(result.description())
 
     reporter.report()
 
 
-def _parallel_perform(wrapped_info):
-    return _perform(*wrapped_info)
+def _prefetch(validations):
+    """Let each type of validation fetch what its validations need at once.
+
+    See :py:meth:`~.validation.Validation.prefetch`. A failure to prefetch
+    is logged and otherwise ignored, since validations fetch anything that
+    wasn't prefetched themselves.
+
+    """
+    by_type = collections.OrderedDict()
+    for validation in validations:
+        prefetch = getattr(type(validation), "prefetch", None)
+        if prefetch is not None:
+            by_type.setdefault(prefetch, []).append(validation)
+
+    for prefetch, batch in by_type.items():
+        try:
+            prefetch(batch)
+        except Exception as e:
+            logger.warn("Prefetching for {} validations failed: {}".format(
+                len(batch), e))
+
+
+def _run_order_set(order_set, immutable_group_failures, results,
+                   processes=1, timeout=60, timeout_retries=3, on_result=None):
+    """Run every validation in a single order tier.
+
+    At most `processes` validations run at once, each in its own process so
+    that a stuck validation can be killed once it exceeds `timeout`. A killed
+    validation is started again (ahead of validations that have not started
+    yet) until it has been attempted `timeout_retries` times, after which a
+    Failure is recorded for it.
+
+    Results are appended to `results` as validations finish, and are also
+    passed to `on_result` (if given) at that point.
+
+    """
+    pending = collections.deque((valid, 1) for valid in order_set)
+    running = []
+    workers = max(processes, 1)
+
+    def finished(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    while pending or running:
+        while pending and len(running) < workers:
+            valid, attempt = pending.popleft()
+            if attempt > timeout_retries:
+                finished(Failure(valid.name, valid,
+                                 "{} failed to terminate (ran for {}s)".format(valid, timeout),
+                                 time=timeout))
+                continue
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            p = multiprocessing.Process(target=_perform_in_process,
+                                        args=(valid, immutable_group_failures, writer))
+            start = time.time()
+            p.start()
+            #only the child writes; closing our end lets us see the child exit
+            writer.close()
+            running.append((p, reader, valid, attempt, start))
+
+        still_running = []
+        for p, reader, valid, attempt, start in running:
+            alive = p.is_alive()
+            if reader.poll():
+                try:
+                    record = reader.recv()
+                except EOFError:
+                    record = None
+                p.join()
+                reader.close()
+                finished(_from_record(valid, record, p.exitcode, start))
+            elif not alive:
+                p.join()
+                reader.close()
+                finished(_from_record(valid, None, p.exitcode, start))
+            elif time.time() >= start + timeout:
+                #job is taking too long, kill it
+                #this is messy, but we assume that if something hit the
+                #general alarmageddon timeout, then it's stuck somewhere
+                #and we can't stop it nicely
+                p.terminate()
+                p.join()
+                reader.close()
+                logger.warn("Validation {} ran for longer than {}".format(valid, timeout))
+                pending.appendleft((valid, attempt + 1))
+            else:
+                still_running.append((p, reader, valid, attempt, start))
+
+        if len(still_running) == len(running):
+            #nothing finished, so there is no free worker to hand work to
+            time.sleep(_POLL_INTERVAL)
+        running = still_running
+
+
+def _perform_in_process(validation, immutable_group_failures, connection):
+    """Perform a validation in a worker process and send its result back.
+
+    Only a compact record of the result is sent back: the parent already
+    holds the validation, so there is no need to pickle it (along with its
+    expectations and enriched data) for every result.
+
+    """
+    results = []
+    _perform(validation, immutable_group_failures, results)
+    connection.send(_to_record(results[0]))
+    connection.close()
+
+
+def _to_record(result):
+    """Reduce a result to the fields needed to rebuild it in the parent.
+
+    The priority is included because validations (e.g. GroupValidations)
+    may change their priority while they are performed.
+
+    """
+    return (result.is_failure(), result.description(), result.time,
+            result.priority)
+
+
+def _from_record(validation, record, exitcode, start):
+    """Rebuild the result sent back by a worker process.
+
+    :param validation: The validation the worker performed.
+    :param record: The record the worker sent, or None if it sent nothing.
+    :param exitcode: The worker's exit code.
+    :param start: When the worker was started.
+
+    """
+    if record is None:
+        return Failure(validation.name, validation,
+                       "{} exited without reporting a result (exit code {})"
+                       .format(validation, exitcode),
+                       time=time.time() - start)
+    is_failure, description, runtime, priority = record
+    if is_failure:
+        result = Failure(validation.name, validation, description, time=runtime)
+    else:
+        result = Success(validation.name, validation, description, time=runtime)
+    result.priority = priority
+    return result
 
 
 def _perform(validation, immutable_group_failures, results):
     start = time.time()
     try:
         validation.perform(immutable_group_failures)
-        try:
-            runtime = validation.get_elapsed_time()
-        except NotImplementedError:
-            runtime = time.time() - start
-        if validation.timeout is not None and runtime > validation.timeout:
-            result = Failure(validation.name, validation,
-                    "{} ran for {} (exceeded timeout of {})".format(
-                        validation, runtime, validation.timeout),
-                             time=runtime)
-        else:
-            result = Success(validation.name, validation,
-                             time=runtime)
+        result = _completed_result(validation, start)
     except Exception as e:
         result = Failure(validation.name, validation, str(e),
                          time=time.time() - start)
@@ -179,6 +347,25 @@ def _perform(validation, immutable_group_failures, results):
     results.append(result)
 
 
+def _completed_result(validation, start):
+    """Build the result of a validation whose perform returned normally.
+
+    :param validation: The validation that was performed.
+    :param start: The time at which the validation was started.
+
+    """
+    try:
+        runtime = validation.get_elapsed_time()
+    except NotImplementedError:
+        runtime = time.time() - start
+    if validation.timeout is not None and runtime > validation.timeout:
+        return Failure(validation.name, validation,
+                "{} ran for {} (exceeded timeout of {})".format(
+                    validation, runtime, validation.timeout),
+                       time=runtime)
+    return Success(validation.name, validation, time=runtime)
+
+
 def do_dry_run(validations, publishers):
     """Print which validations will be published by which publishers.
 
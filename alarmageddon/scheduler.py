@@ -0,0 +1,442 @@
+"""Performs validations continuously from a single long-running process.
+
+:py:func:`~alarmageddon.run.run_tests` performs every validation once and
+then exits, so it is typically run from cron or a CI server, paying for
+interpreter startup, imports and publisher construction every time. The
+:py:class:`Scheduler` instead stays resident and performs each validation
+every :py:attr:`~alarmageddon.validations.validation.Validation.interval`
+seconds, publishing results as they arrive.
+
+Validations are performed on a pool of threads in the scheduler's process,
+so connections kept by shared pools (e.g. for HTTP and SSH) stay warm from
+one run to the next.
+
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from six.moves import queue
+
+from alarmageddon.reporter import Reporter
+from alarmageddon.result import Failure
+from alarmageddon.run import _perform, _prefetch
+from alarmageddon.validations.validation import Priority
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+#queued to tell a worker thread to exit
+_STOP = object()
+
+
+class _Run(object):
+    """A single run of a validation, from when it is handed to a worker."""
+
+    def __init__(self, validation, start):
+        self.validation = validation
+        self.start = start
+        #set by the worker once the validation has been performed
+        self.done = False
+        #set by the scheduler once the run has been given up on
+        self.abandoned = False
+
+    def __repr__(self):
+        return "Run of {} started at {}".format(self.validation, self.start)
+
+
+class AdaptiveIntervals(object):
+    """Adjusts how often a validation is performed based on its results.
+
+    A validation that keeps passing is performed less and less often, while
+    one that is failing, or has only just started passing again, is
+    performed again quickly to confirm or clear the failure.
+
+    Intervals are kept within a band that depends on the validation's
+    priority, so that critical validations are never left unchecked for
+    long. Bands map each :py:class:`~.validation.Priority` to the shortest
+    and longest interval (in seconds) allowed for it.
+
+    :param bands: Dictionary mapping priorities to (min, max) intervals.
+      Priorities that aren't given use the defaults in `DEFAULT_BANDS`.
+    :param backoff: How much longer the interval gets with each further
+      success.
+    :param backoff_after: How many successes in a row a validation needs
+      before its interval starts to grow.
+
+    """
+
+    DEFAULT_BANDS = {
+        Priority.LOW: (30, 900),
+        Priority.NORMAL: (15, 300),
+        Priority.CRITICAL: (5, 60),
+    }
+
+    def __init__(self, bands=None, backoff=2, backoff_after=3):
+        if backoff < 1:
+            raise ValueError("backoff must be at least 1, got {}".format(
+                backoff))
+        self.bands = dict(self.DEFAULT_BANDS)
+        self.bands.update(bands or {})
+        self.backoff = backoff
+        self.backoff_after = backoff_after
+
+        #(successes in a row, whether the last result before them failed)
+        #by validation id
+        self._history = {}
+
+    def observe(self, result):
+        """Record the result of performing a validation."""
+        key = result.validation_id
+        successes, recovered = self._history.get(key, (0, False))
+        if result.is_failure():
+            self._history[key] = (0, True)
+        else:
+            self._history[key] = (successes + 1,
+                                  recovered and successes == 0)
+
+    def interval(self, validation, base):
+        """Return how long to wait before performing `validation` again.
+
+        :param validation: The validation to schedule.
+        :param base: The interval the validation would otherwise use.
+
+        """
+        low, high = self.bands.get(validation.priority,
+                                   self.bands[Priority.NORMAL])
+        successes, recovered = self._history.get(validation.fingerprint(),
+                                                 (0, False))
+        if successes == 0 or recovered:
+            #failing, or has only just stopped failing
+            return low
+        extra = max(successes - self.backoff_after, 0)
+        #cap the exponent so that long runs of successes don't overflow
+        grown = base * self.backoff ** min(extra, 64)
+        return min(max(grown, low), high)
+
+    def __repr__(self):
+        return "AdaptiveIntervals: {} (backoff {} after {})".format(
+            self.bands, self.backoff, self.backoff_after)
+
+
+class Scheduler(object):
+    """Performs validations over and over, each on its own interval.
+
+    A validation is started again `interval` seconds after its previous run
+    started (or as soon as that run finishes, if it took longer). Results
+    are streamed to publishers that support it as each validation finishes;
+    every other publisher is sent the results collected so far every
+    `flush_interval` seconds.
+
+    Validation order is not used: a
+    :py:class:`~alarmageddon.validations.validation.GroupValidation` sees the
+    most recent result of every validation in its group.
+
+    Validations can't be killed from a thread, so a validation that runs for
+    longer than `timeout` is reported as a failure and then left to finish
+    on a thread of its own, while a new worker takes its place. It is not
+    started again until it does.
+
+    Validations that are due at the same time are prefetched together (see
+    :py:meth:`~.validation.Validation.prefetch`), and batch publishing
+    happens on a thread of its own, so neither holds up the scheduling of
+    other validations.
+
+    :param validations: List of :py:class:`~.validation.Validation` objects
+      to perform.
+    :param publishers: List of :py:class:`~.publisher.Publisher` objects to
+      publish results to.
+    :param workers: The number of validations that may be performed at once.
+    :param default_interval: The interval (in seconds) of validations whose
+      `interval` is None.
+    :param timeout: How long (in seconds) a validation may run before it is
+      reported as a failure.
+    :param flush_interval: How often (in seconds) the results collected so
+      far are sent to publishers that can't have results streamed to them.
+    :param publish_timeout: How many seconds each publisher is given to
+      publish. See :py:class:`~.reporter.Reporter`.
+    :param jitter: Every interval (and the first start of each validation)
+      is randomly lengthened or shortened by up to this fraction of itself,
+      so that validations with the same interval don't all hit the same
+      host at the same moment.
+    :param adaptive: An :py:class:`AdaptiveIntervals` used to adjust each
+      validation's interval to its recent results. If None, intervals are
+      fixed.
+
+    """
+
+    def __init__(self, validations, publishers=None, workers=4,
+                 default_interval=60, timeout=60, flush_interval=300,
+                 publish_timeout=None, jitter=0, adaptive=None):
+        if not validations:
+            raise ValueError("Scheduler expected non-empty list of " +
+                             "validations, got {} instead".format(validations))
+        if workers < 1:
+            raise ValueError("Scheduler needs at least one worker")
+
+        #results are matched to their validation's history by fingerprint,
+        #so validations that share one would mix their histories together
+        fingerprints = {}
+        for validation in validations:
+            other = fingerprints.setdefault(validation.fingerprint(),
+                                            validation)
+            if other is not validation:
+                raise ValueError(
+                    "{} and {} have the same fingerprint; give them "
+                    "different names or extend _identity".format(
+                        other, validation))
+
+        self.validations = validations
+        self.publishers = publishers or []
+        self.publish_timeout = publish_timeout
+        self.reporter = self._new_reporter()
+        self.workers = workers
+        self.default_interval = default_interval
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.jitter = jitter
+        self.adaptive = adaptive
+
+        #the most recent failure of each validation, by group
+        self._group_failures = {}
+        for validation in validations:
+            for group in (validation.group,
+                          getattr(validation, "checked_group", None)):
+                if group is not None:
+                    self._group_failures[group] = {}
+
+        #(when the validation is next due, tie breaker, validation)
+        self._due = []
+        self._sequence = itertools.count()
+        #runs currently counting towards the number of workers, by the id
+        #of their validation
+        self._running = {}
+        #runs that timed out and are still being performed, by the id of
+        #their validation
+        self._abandoned = {}
+        #guards the done and abandoned flags of runs
+        self._lock = threading.Lock()
+        #the thread publishing the last batch of results, if any
+        self._publishing = None
+
+        self._work = queue.Queue()
+        self._finished = queue.Queue()
+        #set whenever the scheduler has something to do before its next
+        #scheduled wakeup
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def run(self, duration=None):
+        """Perform validations until :py:meth:`stop` is called.
+
+        Every validation is started as soon as a worker is free, and then
+        again every interval after that. Before returning, results that have
+        not been published yet are published.
+
+        :param duration: If given, stop after this many seconds.
+
+        """
+        self._stopping.clear()
+        now = time.time()
+        end = None if duration is None else now + duration
+        for validation in self.validations:
+            #spread the first runs out rather than starting them all at once
+            self._schedule(validation, now + random.uniform(
+                0, self.jitter * self._interval(validation)))
+
+        for _ in range(self.workers):
+            self._start_worker()
+
+        next_flush = now + self.flush_interval
+        try:
+            while not self._stopping.is_set():
+                now = time.time()
+                if end is not None and now >= end:
+                    break
+                self._collect_finished(now)
+                self._expire_running(now)
+                self._start_due(now)
+                if now >= next_flush:
+                    self._flush()
+                    next_flush = now + self.flush_interval
+
+                wakeups = [next_flush]
+                if end is not None:
+                    wakeups.append(end)
+                if self._due and len(self._running) < self.workers:
+                    wakeups.append(self._due[0][0])
+                wakeups.extend(run.start + self.timeout
+                               for run in self._running.values())
+                self._wake.wait(max(min(wakeups) - time.time(), 0))
+                self._wake.clear()
+        finally:
+            for _ in range(self.workers):
+                self._work.put(_STOP)
+            self._collect_finished(time.time())
+            self._flush(wait=True)
+            self._due = []
+
+    def stop(self):
+        """Ask a running scheduler to stop.
+
+        Safe to call from any thread. Validations that are being performed
+        are not waited for.
+
+        """
+        self._stopping.set()
+        self._wake.set()
+
+    def _schedule(self, validation, when):
+        heapq.heappush(self._due, (when, next(self._sequence), validation))
+
+    def _interval(self, validation):
+        interval = getattr(validation, "interval", None)
+        if interval is None:
+            return self.default_interval
+        return interval
+
+    def _next_interval(self, validation):
+        interval = self._interval(validation)
+        if self.adaptive is not None:
+            interval = self.adaptive.interval(validation, interval)
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _start_due(self, now):
+        runs = []
+        while (self._due and self._due[0][0] <= now and
+               len(self._running) < self.workers):
+            _, _, validation = heapq.heappop(self._due)
+            run = _Run(validation, now)
+            self._running[id(validation)] = run
+            runs.append(run)
+        if runs:
+            #copied for each batch, since validations may be performed while
+            #the failures of their group are being updated
+            group_failures = dict((group, list(failures.values()))
+                                  for group, failures
+                                  in self._group_failures.items())
+            self._work.put((runs, group_failures))
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._work_loop)
+        thread.daemon = True
+        thread.start()
+
+    def _work_loop(self):
+        while True:
+            work = self._work.get()
+            if work is _STOP:
+                return
+            runs, group_failures = work
+            if len(runs) > 1:
+                #prefetched here rather than on the scheduling loop, and the
+                #rest of the batch handed on to the other workers afterwards
+                _prefetch([run.validation for run in runs])
+                for run in runs[1:]:
+                    self._work.put(([run], group_failures))
+            run = runs[0]
+            results = []
+            _perform(run.validation, group_failures, results)
+            self._finished.put((run, results[0]))
+            self._wake.set()
+            with self._lock:
+                run.done = True
+                if run.abandoned:
+                    #another worker has already taken this one's place
+                    return
+
+    def _collect_finished(self, now):
+        while True:
+            try:
+                run, result = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            key = id(run.validation)
+            if self._abandoned.get(key) is run:
+                #a failure was already reported for this run
+                del self._abandoned[key]
+                logger.debug("Discarding late result %s", result)
+            else:
+                del self._running[key]
+                self._record(result)
+            self._schedule(run.validation,
+                           run.start + self._next_interval(run.validation))
+
+    def _expire_running(self, now):
+        for key, run in list(self._running.items()):
+            if now < run.start + self.timeout:
+                continue
+            with self._lock:
+                if run.done:
+                    #finished, but not collected yet
+                    continue
+                run.abandoned = True
+            #the worker stays stuck with the validation, so its slot is
+            #freed and a new worker takes its place
+            del self._running[key]
+            self._abandoned[key] = run
+            self._start_worker()
+            validation = run.validation
+            logger.warn("Validation {} ran for longer than {}".format(
+                validation, self.timeout))
+            self._record(Failure(validation.name, validation,
+                                 "{} did not finish within {}s".format(
+                                     validation, self.timeout),
+                                 time=now - run.start))
+
+    def _record(self, result):
+        if self.adaptive is not None:
+            self.adaptive.observe(result)
+        group = result.group
+        if group is not None:
+            if result.is_failure():
+                self._group_failures[group][result.validation_id] = \
+                    result.description()
+            else:
+                self._group_failures[group].pop(result.validation_id, None)
+        self.reporter.collect(result)
+
+    def _new_reporter(self):
+        return Reporter(self.publishers, publish_timeout=self.publish_timeout,
+                        stream=True)
+
+    def _flush(self, wait=False):
+        """Publish the results collected so far on a thread of its own.
+
+        The results are handed over with the reporter that collected them,
+        and a new reporter collects results from then on. If the previous
+        batch is still being published the results are kept for the next
+        flush, unless `wait` is True, in which case this waits for the
+        previous batch and for this one.
+
+        """
+        if self._publishing is not None:
+            if wait:
+                self._publishing.join()
+            elif self._publishing.is_alive():
+                logger.warn("Still publishing the previous results; "
+                            "keeping the new ones until the next flush")
+                return
+        reporter, self.reporter = self.reporter, self._new_reporter()
+        self._publishing = threading.Thread(target=_publish,
+                                            args=(reporter,))
+        self._publishing.daemon = True
+        self._publishing.start()
+        if wait:
+            self._publishing.join()
+
+    def __repr__(self):
+        return "Scheduler: {} validations, {} workers".format(
+            len(self.validations), self.workers)
+
+
+def _publish(reporter):
+    try:
+        reporter.report()
+    except Exception as e:
+        #a publisher failing shouldn't stop validations from running
+        logger.warn("Failed to publish results: {}".format(e))
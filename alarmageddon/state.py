@@ -0,0 +1,136 @@
+"""Tracks the state of validations across results.
+
+Most publishers send every failure they are given, so a validation that
+keeps failing is re-sent on every run, and one that flaps between passing
+and failing is sent every time it changes. A :py:class:`StateTracker`
+remembers the last state of each validation and decides which results are
+worth publishing:
+
+* a result whose state differs from the last state that was published
+  (i.e. the validation started or stopped failing)
+* optionally, a reminder that a validation is still failing, at most once
+  every `digest_interval` seconds
+
+A validation that has changed state `flap_threshold` or more times within
+the last `flap_window` seconds is considered to be flapping, and nothing is
+published for it until it settles down. Once it does, its settled state is
+published if it differs from the last one that was.
+
+"""
+
+import collections
+import threading
+import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _ValidationState(object):
+    """What a tracker knows about a single validation."""
+
+    __slots__ = ("failed", "published_failed", "last_published",
+                 "transitions")
+
+    def __init__(self):
+        #validations are assumed to be passing until we hear otherwise
+        self.failed = False
+        self.published_failed = False
+        self.last_published = None
+        #when the validation changed state, oldest first
+        self.transitions = collections.deque()
+
+
+class StateTracker(object):
+    """Decides which results represent a change worth publishing.
+
+    Validations are told apart by their
+    :py:meth:`~.validation.Validation.fingerprint`, so a tracker keeps
+    working when the validations are constructed again (e.g. by a new run).
+
+    :param flap_window: How far back (in seconds) state changes are counted
+      when deciding whether a validation is flapping.
+    :param flap_threshold: How many state changes within `flap_window` make
+      a validation count as flapping. If None, flapping validations are not
+      suppressed.
+    :param digest_interval: If given, a validation that is still failing is
+      published again once this many seconds have passed since it was last
+      published.
+    :param history: A :py:class:`~alarmageddon.history.HistoryStore` to
+      learn the recent state of validations from, so that a tracker in a
+      new process carries on where the last one stopped.
+
+    """
+
+    def __init__(self, flap_window=3600, flap_threshold=4,
+                 digest_interval=None, history=None):
+        if flap_threshold is not None and flap_threshold < 2:
+            raise ValueError("flap_threshold must be at least 2, got {}"
+                             .format(flap_threshold))
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self.digest_interval = digest_interval
+        self._states = {}
+        self._lock = threading.Lock()
+
+        if history is not None:
+            lookback = max(flap_window, digest_interval or 0)
+            for record in history.scan(start=time.time() - lookback):
+                self._observe(record.validation_id, record.failed,
+                              record.timestamp)
+
+    def should_publish(self, result, now=None):
+        """Record a result and return whether it should be published.
+
+        :param result: The :py:class:`~.result.TestResult` to record.
+        :param now: When the result happened. Defaults to now.
+
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return self._observe(result.validation_id, result.is_failure(),
+                                 now)
+
+    def is_flapping(self, validation_id, now=None):
+        """Return whether the validation with the given id is flapping."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            state = self._states.get(validation_id)
+            return state is not None and self._flapping(state, now)
+
+    def _observe(self, validation_id, failed, now):
+        state = self._states.get(validation_id)
+        if state is None:
+            state = self._states[validation_id] = _ValidationState()
+
+        if failed != state.failed:
+            state.failed = failed
+            state.transitions.append(now)
+
+        if self._flapping(state, now):
+            logger.debug("Not publishing %s, it is flapping", validation_id)
+            return False
+
+        if failed != state.published_failed:
+            publish = True
+        else:
+            publish = (failed and self.digest_interval is not None and
+                       now - state.last_published >= self.digest_interval)
+        if publish:
+            state.published_failed = failed
+            state.last_published = now
+        return publish
+
+    def _flapping(self, state, now):
+        transitions = state.transitions
+        while transitions and transitions[0] < now - self.flap_window:
+            transitions.popleft()
+        return (self.flap_threshold is not None and
+                len(transitions) >= self.flap_threshold)
+
+    def __repr__(self):
+        return "StateTracker: {} validations (flap window {}s, threshold {})"\
+            .format(len(self._states), self.flap_window, self.flap_threshold)
@@ -5,7 +5,6 @@ from alarmageddon.validations.ssh import SshValidation
 
 from alarmageddon.validations.utilities import format_node, format_cluster
 
-import os
 import re
 
 import logging
@@ -21,7 +20,8 @@ logger = logging.getLogger(__name__)
 # Assumptions:
 #   1) There is a header line that lists all of the field names
 #   2) The header line begins with a '--  '
-#   3) All lines after the header describe nodes
+#   3) All lines after the header describe nodes, until a blank line or
+#      the next 'Datacenter: ' line
 #   4) All lines before the header can be ignored
 #   5) Other assumptions I am even aware that I have made
 #
@@ -64,7 +64,8 @@ logger = logging.getLogger(__name__)
 #   |-- |Address      |Load      |Tokens |Owns  |Host ID                              |Rack|
 #
 # we can use those boundaries to start chopping up the remaining lines
-# in the output and creating Nodes from them.
+# in the output and creating Nodes from them.  The boundaries are worked
+# out once per header line, and each line is sliced once per field.
 #
 #   +---+-------------+----------+-------+------+-------------------------------------+----+
 #   |-- |Address      |Load      |Tokens |Owns  |Host ID                              |Rack|
@@ -192,7 +193,7 @@ class Node(object):
     """
     def __init__(self, ip_address, status=Status.UNKNOWN,
                  state=State.UNKNOWN, load=None, tokens=None,
-                 owns=None, host_id=None, rack=None):
+                 owns=None, host_id=None, rack=None, datacenter=None):
         self.ip_address = ip_address
         self.status = status
         self.state = state
@@ -201,141 +202,165 @@ class Node(object):
         self.owns = owns
         self.host_id = host_id
         self.rack = rack
+        self.datacenter = datacenter
 
     def __str__(self):
         return ("Address: %s, Status: %s, State: %s, Load: %s, " +
-                "Tokens: %d, Owns: %s, Host ID: %s, Rack: %s") % (
+                "Tokens: %s, Owns: %s, Host ID: %s, Rack: %s, " +
+                "Datacenter: %s") % (
                     self.ip_address, Status.to_text(self.status),
                     State.to_text(self.state), self.load, self.tokens,
-                    self.owns, self.host_id, self.rack)
+                    self.owns, self.host_id, self.rack, self.datacenter)
 
 
-class _Header(object):
-    """Information about a field header."""
-    def __init__(self, name, start_pos, length, last_header=False):
-        self.name = name
-        self.start_pos = start_pos
-        self.length = length
-        self.last_header = last_header
+#header names are delimited by 2 or more spaces, so that 'Host ID' is one
+#header rather than two
+_HEADER_DELIMITER = re.compile(r"\s{2,}")
 
-    def __str__(self):
-        return "%s (%s,%s)" % (self.name, self.start_pos, self.length)
 
+def _iter_lines(text):
+    """Iterate over the lines of text without splitting it all up first."""
+    start = 0
+    while start <= len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end].rstrip('\r')
+        start = end + 1
 
-class NodetoolStatusParser(object):
-    """Parses the output of the Cassandra nodetool status command and
-    tries to make sense of it despite changes made to the format.
-    """
-    def __init__(self):
-        self.__headers = []
 
-    def parse(self, status_output):
-        found_header = False
-        nodes = []
-        for line in status_output.split(os.linesep):
-            if _is_data_center_line(line):
-                found_header = False
-                self.__headers = None
-            elif _is_header_line(line):
-                found_header = True
-                self.__headers = self.__parse_headers(line)
-            elif found_header:
-                # If we've already parsed one node and we find a blank line, ignore the rest of the
-                # output because it's not information about nodes; it's some other text output that
-                # we won't parse at the moment.
-                if nodes and not line.strip():
-                    break
-                nodes.append(self.__parse_node(line))
-        logger.info("Found these Cassandra nodes:{}".format(nodes))
-        return nodes
+def _parse_tokens(text):
+    if text:
+        return int(text)
+    else:
+        return None
+
+
+def _parse_owns(text):
+    # The following Cassandra issue (https://issues.apache.org/jira/browse/CASSANDRA-10176) causes
+    # question mark characters (?) to appear in the 'Owns' column of nodetool status' output.
+    if text == '?':
+        return None
+    else:
+        return _get_percent(text)
+
+
+def _as_text(text):
+    return text
+
+
+# The Node attribute each header fills in, and how its text is converted.
+# These are broken out because different fields have different types and
+# field names might change in a future release.
+_FIELDS = {
+    'address': ('ip_address', _as_text),
+    'load': ('load', _as_text),
+    'tokens': ('tokens', _parse_tokens),
+    'owns': ('owns', _parse_owns),
+    'host id': ('host_id', _as_text),
+    'rack': ('rack', _as_text),
+}
+
+
+class _HeaderIndex(object):
+    """Where each field is on the lines under a header line.
+
+    Built once per header line, so that each node line only has to be
+    sliced once per field.
 
-    def __parse_headers(self, line):
-        headers = []
-        # All headers are deliminated by 2 or more spaces.  Note the
-        # sentinel added to the end to simplify header processing
-        tokens = re.split(r"(\s{2,})", line) + ['']
-        name = None
+    """
+    def __init__(self, line):
+        #slice of each header, by lowercased name
+        self.slices = {}
         start_pos = 0
-        for token in tokens:
-            if len(token) and not re.match(r'\s+', token):
-                name = token
+        matches = list(_HEADER_DELIMITER.finditer(line))
+        for i, name_end in enumerate([m.start() for m in matches] +
+                                     [len(line)]):
+            name = line[start_pos:name_end]
+            if i < len(matches):
+                end_pos = matches[i].end()
+                self.slices[name.lower()] = slice(start_pos, end_pos)
+                start_pos = end_pos
             else:
-                length = len(name) + len(token)
-                headers.append(_Header(name, start_pos, length,
-                                       len(token) == 0))
-                start_pos = start_pos + length
-        return headers
+                # It's the last header so it gets all the rest of the text
+                # on the line.
+                self.slices[name.lower()] = slice(start_pos, None)
+
+        self.status = self.slices.get('--')
+        self.fields = [(attribute, self.slices[name], convert)
+                       for name, (attribute, convert) in _FIELDS.items()
+                       if name in self.slices]
 
-    def __parse_node(self, line):
+    def parse_node(self, line, datacenter=None):
         """Parses a line and returns a Node object"""
-        node = Node(self.__get_ip_address(line),
-                    self.__get_status(line),
-                    self.__get_state(line),
-                    self.__get_load(line),
-                    self.__get_tokens(line),
-                    self.__get_owns(line),
-                    self.__get_host_id(line),
-                    self.__get_rack(line))
+        node = Node(None, datacenter=datacenter)
+        if self.status is not None:
+            status = line[self.status].strip()
+            node.status = _parse_status(status)
+            node.state = _parse_state(status)
+        for attribute, field, convert in self.fields:
+            text = line[field].strip()
+            setattr(node, attribute, convert(text) if text else None)
         return node
 
-    # These methods are broken out because different fields have different
-    # types and field names might change in a future release.
-
-    def __get_ip_address(self, line):
-        return self.__get_field('address', line)
-
-    def __get_status(self, line):
-        return _parse_status(self.__get_field('--', line))
-
-    def __get_state(self, line):
-        return _parse_state(self.__get_field('--', line))
+    def __str__(self):
+        return ", ".join("%s (%s,%s)" % (name, field.start, field.stop)
+                         for name, field in self.slices.items())
 
-    def __get_load(self, line):
-        return self.__get_field('load', line)
 
-    def __get_tokens(self, line):
-        tokens = self.__get_field('tokens', line)
-        if tokens:
-            return int(tokens)
-        else:
-            return None
-
-    def __get_owns(self, line):
-        # The following Cassandra issue (https://issues.apache.org/jira/browse/CASSANDRA-10176) causes
-        # question mark characters (?) to appear in the 'Owns' column of nodetool status' output.
-        owns = self.__get_field('owns', line)
-        if owns == '?':
-            return None
-        else:
-            return _get_percent(owns)
+class NodetoolStatusParser(object):
+    """Parses the output of the Cassandra nodetool status command and
+    tries to make sense of it despite changes made to the format.
 
-    def __get_host_id(self, line):
-        return self.__get_field('host id', line)
+    The output may describe nodes in several datacenters, each under its
+    own header. A parser keeps no state between outputs, so one parser can
+    be shared (e.g. between the hosts of a validation).
+    """
+    def __init__(self):
+        self.__header_indexes = {}
 
-    def __get_rack(self, line):
-        return self.__get_field('rack', line)
+    def parse(self, status_output):
+        """Returns a list of the Nodes described by status_output"""
+        nodes = list(self.iter_nodes(status_output))
+        logger.info("Found these Cassandra nodes:{}".format(nodes))
+        return nodes
 
-    def __get_field(self, field_name, line):
-        header = self.__find_header(field_name)
-        if header:
-            if header.last_header:
-                # It's the last header so grab all the rest of the
-                # text on the line.
-                return line[header.start_pos:].strip()
-            else:
-                # It's not the last header so just grab as much text
-                # as the header length calls for.
-                return line[header.start_pos:header.start_pos +
-                            header.length].strip()
-        else:
-            return None
+    def iter_nodes(self, status_output):
+        """Iterates over the Nodes described by status_output as they are
+        parsed.
 
-    def __find_header(self, name):
-        """find a header by name case-insensitively"""
-        for header in self.__headers:
-            if header.name.lower() == name.lower():
-                return header
-        return None
+        """
+        header = None
+        datacenter = None
+        found_node = False
+        for line in _iter_lines(status_output):
+            if _is_data_center_line(line):
+                header = None
+                datacenter = line[len('Datacenter: '):].strip()
+            elif _is_header_line(line):
+                header = self.__header_index(line)
+                found_node = False
+            elif header is not None:
+                # Once we've parsed a node, a blank line ends this header's
+                # nodes; what follows is either another datacenter or some
+                # other text output that we won't parse at the moment.
+                if not line.strip():
+                    if found_node:
+                        header = None
+                    continue
+                found_node = True
+                yield header.parse_node(line, datacenter)
+
+    def __header_index(self, line):
+        #every host (and datacenter) of a ring prints the same header
+        index = self.__header_indexes.get(line)
+        if index is None:
+            index = self.__header_indexes[line] = _HeaderIndex(line)
+        return index
+
+
+# The parser shared by all CassandraStatusValidations.
+_PARSER = NodetoolStatusParser()
 
 
 class CassandraStatusValidation(SshValidation):
@@ -363,15 +388,24 @@ class CassandraStatusValidation(SshValidation):
     :param cluster_name: the name of the cluster (helps when you're monitoring
                          multiple clusters.  Defaults to 'anonymous'.
 
-    .. note:
+    :param quorum: If given, rather than checking the ring as seen from
+      every host, only this many hosts are asked for their view of the
+      ring (the first hosts that respond, in order, asked at the same time
+      as far as `host_concurrency` allows). The validation fails
+      if their views disagree, and the ring is checked once, so each
+      problem with a node is reported once.
 
-        This is not designed for multi region Cassandra clusters.
+    The nodes of every datacenter in the ring are checked, and
+    `number_nodes` is the number of nodes across all of them.
 
     """
     def __init__(self, ssh_context, service_state="UN",
                  number_nodes=5, owns_threshold=40,
                  priority=Priority.NORMAL, timeout=None,
-                 hosts=None, cluster_name='anonymous'):
+                 hosts=None, cluster_name='anonymous', quorum=None):
+        if quorum is not None and quorum < 1:
+            raise ValueError("quorum must be at least 1, got {}"
+                             .format(quorum))
         SshValidation.__init__(self, ssh_context,
                                "Cassandra nodetool status",
                                priority=priority,
@@ -390,10 +424,103 @@ class CassandraStatusValidation(SshValidation):
         self.number_nodes = number_nodes
         self.owns_threshold = owns_threshold
         self.cluster_name = cluster_name
+        self.quorum = quorum
+
+    def _identity(self):
+        return SshValidation._identity(self) + [
+            self.cluster_name, self.service_status, self.service_state,
+            self.number_nodes, self.owns_threshold]
+
+    def shared_commands(self):
+        #with a quorum, only some of the hosts are asked
+        if self.quorum is None:
+            return [("nodetool status", False)]
+        return []
+
+    def perform(self, group_failures):
+        """Perform the validation against every host or, if a quorum was
+        given, against the ring as seen by a quorum of hosts.
+
+        """
+        if self.quorum is None:
+            return SshValidation.perform(self, group_failures)
+
+        if not self.hosts:
+            self.fail("no hosts specified.")
+
+        #hosts are asked in rounds, each just big enough to reach a quorum
+        #if all of its hosts answer
+        views = {}
+        errors = []
+        remaining = list(self.hosts)
+        while remaining and len(views) < self.quorum:
+            batch = remaining[:self.quorum - len(views)]
+            remaining = remaining[len(batch):]
+            found = {}
+            outcomes = self._fan_out(batch, self._view_recorder(found))
+            for host, failure in zip(batch, outcomes):
+                #a host that timed out may still record its view later
+                if failure is None:
+                    views[host] = found[host]
+                else:
+                    errors.append(failure)
+        views = [(host, views[host]) for host in self.hosts if host in views]
+
+        if len(views) < self.quorum:
+            self.fail("\n".join(
+                ["Only {0} of {1} hosts of Cassandra cluster {2} reported "
+                 "the state of the ring".format(
+                     len(views), self.quorum,
+                     format_cluster(self.cluster_name))] + errors))
+
+        problems = self._disagreements(views) + \
+            self._problems(views[0][1])
+        if problems:
+            #the same problem may be seen from several views
+            unique = []
+            for problem in problems:
+                if problem not in unique:
+                    unique.append(problem)
+            self.fail("\n".join(unique))
+
+    def _view_recorder(self, views):
+        """Return a perform_on_host that records the host's view of the ring
+        in views, rather than checking it.
+
+        """
+        def record_view(connection):
+            views[connection.host] = self._get_nodes(connection)
+        return record_view
+
+    def _disagreements(self, views):
+        """Describe the nodes that the views of the ring disagree about"""
+        seen = {}
+        for host, nodes in views:
+            for node in nodes:
+                seen.setdefault(node.ip_address, {})[host] = (
+                    Status.to_text(node.status) + "/" +
+                    State.to_text(node.state))
+
+        disagreements = []
+        for ip_address in sorted(seen):
+            by_host = seen[ip_address]
+            if len(by_host) == len(views) and len(set(by_host.values())) == 1:
+                continue
+            disagreements.append(
+                "Cassandra hosts disagree about node {0}: {1}".format(
+                    format_node(self.cluster_name, ip_address),
+                    ", ".join("{0} sees {1}".format(
+                        host, by_host.get(host, "nothing"))
+                              for host, _ in views)))
+        return disagreements
 
     def perform_on_host(self, connection):
         """Runs nodetool status and parses the output."""
-        output = connection.run('nodetool status', warn=True)
+        self.check(connection.host, self._get_nodes(connection))
+
+    def _get_nodes(self, connection):
+        """Runs nodetool status and returns the nodes it describes."""
+        output = self.command_cache.run(connection, 'nodetool status', warn=True)
         host = connection.host
 
         if "Exception" in output:
@@ -403,18 +530,24 @@ class CassandraStatusValidation(SshValidation):
                                              format_node(self.cluster_name, host),
                                              output))
 
-        parsed = NodetoolStatusParser().parse(output)
-        self.check(host, parsed)
+        return _PARSER.parse(output)
 
     def check(self, host, nodes):
         """Compares the results of nodetool status to the expected results."""
+        problems = self._problems(nodes)
+        if problems:
+            self.fail_on_host(host, problems[0])
+
+    def _problems(self, nodes):
+        """Describe every way the nodes differ from the expected results."""
+        problems = []
+
         #Number of nodes check
         if len(nodes) < self.number_nodes:
-            self.fail_on_host(host,
-                              ("Cassandra cluster: {0} has {1} nodes but " +
-                              "should have {2} nodes.").format(
-                                  format_cluster(self.cluster_name),
-                                  len(nodes), self.number_nodes))
+            problems.append(("Cassandra cluster: {0} has {1} nodes but " +
+                             "should have {2} nodes.").format(
+                                 format_cluster(self.cluster_name),
+                                 len(nodes), self.number_nodes))
 
         # Validate each node's properties in nodetool's nodes
         for node in nodes:
@@ -426,27 +559,28 @@ class CassandraStatusValidation(SshValidation):
 
             # check for state
             if node.state != self.service_state:
-                self.fail_on_host(host, ("Cassandra node {0} is in " +
-                                  "state {1} but the expected state is {2}").format(
-                                      format_node(self.cluster_name, node.ip_address),
-                                      State.to_text(node.state),
-                                      State.to_text(self.service_state)))
+                problems.append(("Cassandra node {0} is in " +
+                                 "state {1} but the expected state is {2}").format(
+                                     format_node(self.cluster_name, node.ip_address),
+                                     State.to_text(node.state),
+                                     State.to_text(self.service_state)))
 
             # check for status
             if node.status != self.service_status:
-                self.fail_on_host(host, ("Cassandra node {0} has " +
-                                  "status {1} but the expected status is {2}").format(
-                                      format_node(self.cluster_name, node.ip_address),
-                                      Status.from_text(node.status),
-                                      Status.from_text(self.service_status)))
+                problems.append(("Cassandra node {0} has " +
+                                 "status {1} but the expected status is {2}").format(
+                                     format_node(self.cluster_name, node.ip_address),
+                                     Status.to_text(node.status),
+                                     Status.to_text(self.service_status)))
 
             # check for owns threshold
             if node.owns is not None:
                 if node.owns > self.owns_threshold:
-                    self.fail_on_host(host,
-                                      ("Cassandra node {0} owns {1} " +
-                                      "percent of the ring which exceeds " +
-                                      "threshold of {2}").format(
-                                          format_node(self.cluster_name, node.ip_address),
-                                          node.owns,
-                                          self.owns_threshold))
+                    problems.append(("Cassandra node {0} owns {1} " +
+                                     "percent of the ring which exceeds " +
+                                     "threshold of {2}").format(
+                                         format_node(self.cluster_name, node.ip_address),
+                                         node.owns,
+                                         self.owns_threshold))
+
+        return problems
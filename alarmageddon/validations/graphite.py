@@ -1,45 +1,276 @@
 """Classes that support validation of metrics collected by Graphite"""
 
+from array import array
+import collections
 import datetime
+import threading
+import time
 import requests
 
-from alarmageddon.validations.validation import Validation
+from alarmageddon.validations.validation import Validation, \
+    describe_expectations
+from alarmageddon.validations.graphite_readings import Readings
 
 from alarmageddon.validations.graphite_expectations import \
     LessThanExpectation, \
     GreaterThanExpectation, \
     AverageLessThanExpectation, \
-    AverageGreaterThanExpectation
+    AverageGreaterThanExpectation, \
+    PercentileLessThanExpectation, \
+    PercentileGreaterThanExpectation, \
+    MaxRateOfChangeExpectation, \
+    MissingReadingsExpectation, \
+    BaselineExpectation
 
 import logging
 
-import six
-
 logger = logging.getLogger(__name__)
 
+_NAN = float("nan")
+
+
+def _as_array(readings):
+    if not isinstance(readings, Readings):
+        readings = Readings(readings)
+    return readings.array()
+
+
+def _parse_raw_series(line):
+    """Parse one series of a format=raw Graphite response.
+
+    Returns a (name, start, step, readings) tuple, or None if the line
+    isn't a series.
+
+    """
+    chunks = line.strip().split('|')
+    if len(chunks) != 2:
+        return None
+    #the header is name,start,end,step - the name may contain commas
+    header = chunks[0].rsplit(',', 3)
+    try:
+        start, step = int(header[1]), int(header[3])
+    except (IndexError, ValueError):
+        return None
+    if step <= 0:
+        return None
+    return header[0], start, step, Readings.parse(chunks[1])
+
 
 class GraphiteContext(object):
     """Create one of these and then pass it to all of the
     GraphiteValidation objects you create.
 
+    batch_size - if given, the readings of up to this many
+    GraphiteValidations using this context (and the same time range) are
+    retrieved from Graphite in a single request before the validations are
+    performed. If None, each validation retrieves its own readings.
+
     """
-    def __init__(self, graphite_host):
+    def __init__(self, graphite_host, batch_size=None):
         """Creates a GraphiteContext object"""
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least 1, got {}"
+                             .format(batch_size))
         self._graphite_host = graphite_host
+        self.batch_size = batch_size
 
     def get_graphite_host(self):
         """returns the Graphite host name"""
         return self._graphite_host
 
+    def fetch_readings(self, metric_names, seconds):
+        """Retrieve the readings of several metrics in one request.
+
+        Returns a dictionary mapping each metric Graphite returned readings
+        for to a (start, step, readings) tuple. Metrics without readings are
+        left out.
+
+        """
+        url = "{0}/render/?{1}&format=raw&from=-{2}seconds".format(
+            self._graphite_host,
+            "&".join("target={0}".format(name) for name in metric_names),
+            seconds)
+        logger.debug("Hitting graphite server at {}".format(url))
+        resp = requests.get(url)
+        if resp.status_code < 200 or resp.status_code >= 300:
+            logger.warn(("Could not get data from Graphite. URL: {0}, " +
+                         "Status Code: {1}").format(url, resp.status_code))
+            return {}
+
+        wanted = set(metric_names)
+        series = {}
+        for line in resp.text.splitlines():
+            parsed = _parse_raw_series(line)
+            if parsed is not None and parsed[0] in wanted:
+                series[parsed[0]] = parsed[1:]
+        return series
+
     def __repr__(self):
         return "{}: {}".format(type(self).__name__, self._graphite_host)
 
 
+class _CachedSeries(object):
+    """The readings of a single metric, oldest first, one per `step`
+    seconds starting at `start`.
+
+    Readings are kept in an array('d'), with NaN for missing readings.
+
+    """
+
+    def __init__(self, start, step, readings, window):
+        self.start = start
+        self.step = step
+        self.readings = array("d", _as_array(readings))
+        #how many seconds of readings to keep
+        self.window = window
+        self.fetched_at = time.time()
+        #until when the readings may be used without checking for new ones
+        self.fresh_until = 0
+
+    @property
+    def end(self):
+        """The time just after the newest reading."""
+        return self.start + self.step * len(self.readings)
+
+    def merge(self, start, step, readings):
+        """Add newly fetched readings, replacing any they overlap.
+
+        Returns False if the readings can't be merged, in which case the
+        series is left untouched.
+
+        """
+        if step != self.step or start < self.start:
+            return False
+        #readings that were fetched again replace the old ones, since
+        #Graphite may still have been aggregating the newest of them
+        keep = int((start - self.start) // self.step)
+        del self.readings[keep:]
+        #readings for time we never fetched are unknown
+        missing = keep - len(self.readings)
+        if missing > 0:
+            self.readings.extend(array("d", [_NAN]) * missing)
+        self.readings.extend(_as_array(readings))
+        self.fetched_at = time.time()
+
+        expired = int((self.end - self.window - self.start) // self.step)
+        if expired > 0:
+            del self.readings[:expired]
+            self.start += expired * self.step
+        return True
+
+    def latest(self, seconds):
+        """Return the readings from the last `seconds` seconds."""
+        count = max(int(seconds // self.step), 1)
+        return Readings(self.readings[-count:])
+
+
+class GraphiteReadingsCache(object):
+    """Keeps recent readings of Graphite metrics between validations.
+
+    The first time a metric is asked for, its whole time range is fetched
+    from Graphite. After that only the readings since the last fetch (plus
+    the last `overlap` readings, which Graphite may have revised since) are
+    fetched and added to what was kept, and readings older than the longest
+    time range asked for are dropped. GraphiteValidations of the same metric
+    on the same Graphite host share one cached series.
+
+    Caches are per process: with the "process" engine each validation runs
+    in a fresh process, so this only helps when validations are performed
+    repeatedly from one process (e.g. by the
+    :py:class:`~alarmageddon.scheduler.Scheduler`).
+
+    :param overlap: How many of the newest cached readings to fetch again.
+
+    """
+
+    def __init__(self, overlap=2):
+        self.overlap = overlap
+        self._series = {}
+        self._locks = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def readings(self, host, metric_name, time_range, fetch):
+        """Return the readings of a metric for the last `time_range` seconds.
+
+        :param host: The Graphite host the metric is fetched from.
+        :param metric_name: The metric to get readings of.
+        :param time_range: How many seconds of readings to return.
+        :param fetch: Called as fetch(since) to get readings from Graphite,
+          where `since` is None for the whole time range or else the time
+          (in seconds since the epoch) to fetch from. Must return a
+          (start, step, readings) tuple.
+
+        """
+        key = (host, metric_name)
+        with self._lock:
+            lock = self._locks[key]
+        #held while fetching, so that validations of the same metric wait
+        #for one fetch rather than all fetching the same data
+        with lock:
+            series = self._series.get(key)
+            if (series is None or time_range > series.window or
+                    time.time() - series.fetched_at > series.window):
+                series = None
+            elif series.fresh_until > time.time():
+                return series.latest(time_range)
+            else:
+                since = series.end - self.overlap * series.step
+                logger.debug("Fetching %s since %s", metric_name, since)
+                if not series.merge(*fetch(since)):
+                    series = None
+
+            if series is None:
+                window = time_range
+                old = self._series.get(key)
+                if old is not None:
+                    window = max(window, old.window)
+                start, step, fetched = fetch(None)
+                series = _CachedSeries(start, step, fetched, window)
+                self._series[key] = series
+            return series.latest(time_range)
+
+    def store(self, host, metric_name, start, step, readings, window,
+              fresh_for=60):
+        """Cache readings that were fetched ahead of time.
+
+        The readings are used as they are, without checking Graphite for
+        newer ones, for the next `fresh_for` seconds.
+
+        """
+        key = (host, metric_name)
+        with self._lock:
+            lock = self._locks[key]
+        with lock:
+            old = self._series.get(key)
+            if old is not None:
+                window = max(window, old.window)
+            series = _CachedSeries(start, step, readings, window)
+            series.fresh_until = time.time() + fresh_for
+            self._series[key] = series
+
+    def clear(self):
+        """Forget every cached reading."""
+        with self._lock:
+            self._series.clear()
+
+    def __repr__(self):
+        return "GraphiteReadingsCache: {} metrics".format(len(self._series))
+
+
+# Shared by every GraphiteValidation unless told otherwise.
+DEFAULT_READINGS_CACHE = GraphiteReadingsCache()
+
+
 class GraphiteValidation(Validation):
     """A Validation that queries Graphite for data and then validates any
     defined expecations against that data.
 
     """
+
+    # A class attribute rather than an instance attribute so that it is
+    # never pickled along with the validation.
+    readings_cache = DEFAULT_READINGS_CACHE
+
     def __init__(self, context, name, metric_name,
                  time_range=datetime.timedelta(hours=1),
                  **kwargs):
@@ -50,6 +281,37 @@ class GraphiteValidation(Validation):
         self.metric_name = metric_name
         self._expectations = []
 
+    @classmethod
+    def prefetch(cls, validations):
+        """Retrieve the readings of many validations in a few requests.
+
+        Validations whose context has a batch size are grouped by Graphite
+        host and time range, and each group's metrics are retrieved with
+        as few requests as the batch size allows. The readings are put in
+        each validation's `readings_cache`, where performing the validation
+        will find them.
+
+        """
+        batches = collections.OrderedDict()
+        for validation in validations:
+            context = validation._context
+            if not getattr(context, "batch_size", None):
+                continue
+            key = (context.get_graphite_host(), validation.time_range,
+                   validation.readings_cache)
+            batch = batches.setdefault(key, (context, []))[1]
+            if validation.metric_name not in batch:
+                batch.append(validation.metric_name)
+
+        for (host, time_range, cache), (context, metrics) in batches.items():
+            seconds = time_range.total_seconds()
+            for i in range(0, len(metrics), context.batch_size):
+                fetched = context.fetch_readings(
+                    metrics[i:i + context.batch_size], seconds)
+                for metric_name, (start, step, readings) in fetched.items():
+                    cache.store(host, metric_name, start, step, readings,
+                                seconds)
+
     def perform(self, group_failures):
         """Perform the validation and propagate any failures to reporters"""
         readings = self._get_readings()
@@ -61,6 +323,11 @@ class GraphiteValidation(Validation):
         for expectation in self._expectations:
             expectation.validate(readings, self.time_range)
 
+    def _identity(self):
+        return Validation._identity(self) + [self.metric_name,
+                                             self.time_range] + \
+            describe_expectations(self._expectations)
+
     def fail(self, reason):
         """Causes this GraphiteValidation to fail with the given reason."""
         Validation.fail(self, reason)
@@ -89,6 +356,7 @@ class GraphiteValidation(Validation):
 
         """
         self._expectations.append(LessThanExpectation(self, upper_bound))
+        self._identity_changed()
         return self
 
     def expect_average_less_than(self, upper_bound):
@@ -98,6 +366,7 @@ class GraphiteValidation(Validation):
         """
         self._expectations.append(AverageLessThanExpectation(self,
                                                              upper_bound))
+        self._identity_changed()
         return self
 
     def expect_greater_than(self, lower_bound):
@@ -106,6 +375,7 @@ class GraphiteValidation(Validation):
 
         """
         self._expectations.append(GreaterThanExpectation(self, lower_bound))
+        self._identity_changed()
         return self
 
     def expect_average_greater_than(self, lower_bound):
@@ -116,22 +386,105 @@ class GraphiteValidation(Validation):
         self._expectations.append(
             AverageGreaterThanExpectation(self, lower_bound))
 
+        self._identity_changed()
+        return self
+
+    def expect_percentile_less_than(self, percent, upper_bound):
+        """The given percentile (e.g. 95) of the readings in the specified
+        time range should fall below the upper bound
+
+        """
+        self._expectations.append(
+            PercentileLessThanExpectation(self, percent, upper_bound))
+        self._identity_changed()
+        return self
+
+    def expect_percentile_greater_than(self, percent, lower_bound):
+        """The given percentile (e.g. 5) of the readings in the specified
+        time range should fall above the lower bound
+
+        """
+        self._expectations.append(
+            PercentileGreaterThanExpectation(self, percent, lower_bound))
+        self._identity_changed()
+        return self
+
+    def expect_max_rate_of_change(self, max_rate):
+        """Consecutive readings in the specified time range should change by
+        less than `max_rate` units per second
+
+        """
+        self._expectations.append(MaxRateOfChangeExpectation(self, max_rate))
+        self._identity_changed()
         return self
 
-    def _build_url(self):
-        """Builds the URL for retrieving Graphite data for a metric"""
+    def expect_missing_readings_less_than(self, max_fraction):
+        """Less than `max_fraction` (from 0 to 1) of the readings in the
+        specified time range should be missing
+
+        """
+        self._expectations.append(
+            MissingReadingsExpectation(self, max_fraction))
+        self._identity_changed()
+        return self
+
+    def expect_within_baseline(self, max_deviations=3, alpha=0.1, warmup=10):
+        """Each reading in the specified time range should be within
+        `max_deviations` standard deviations of the moving average of the
+        readings before it
+
+        alpha - how much weight each reading gets in the moving average
+        (from 0 to 1).
+
+        warmup - how many readings build up the moving average before any
+        are checked against it.
+
+        """
+        self._expectations.append(
+            BaselineExpectation(self, max_deviations, alpha, warmup))
+        self._identity_changed()
+        return self
+
+    def _build_url(self, since=None):
+        """Builds the URL for retrieving Graphite data for a metric
+
+        since - if given, only data from this time (in seconds since the
+        epoch) onwards is retrieved, rather than the validation's whole time
+        range.
+
+        """
+        if since is not None:
+            return "{0}/render/?target={1}&format=raw&from={2}"\
+                .format(self._context.get_graphite_host(),
+                        self.metric_name,
+                        int(since))
         return "{0}/render/?target={1}&format=raw&from=-{2}seconds"\
             .format(self._context.get_graphite_host(),
                     self.metric_name,
                     self.time_range.total_seconds())
 
     def _get_readings(self):
-        """Return a list of readings for the metric as a list of floats and/or
-        None values.  A None reading means no data was sent to
-        Graphite for that time period.
+        """Return the readings for the metric as a
+        :py:class:`~.graphite_readings.Readings`, which behaves like a list
+        of floats and/or None values.  A None reading means no data was sent
+        to Graphite for that time period.
+
+        Readings are kept in `readings_cache`, so only new readings are
+        retrieved from Graphite when the validation is performed again.
+
+        """
+        return self.readings_cache.readings(
+            self._context.get_graphite_host(), self.metric_name,
+            self.time_range.total_seconds(), self._fetch_readings)
+
+    def _fetch_readings(self, since=None):
+        """Retrieve readings from Graphite.
+
+        Returns the time of the first reading, the number of seconds between
+        readings, and the readings.
 
         """
-        url = self._build_url()
+        url = self._build_url(since)
         logger.debug("Hitting graphite server at {}".format(url))
         resp = requests.get(url)
         logger.debug("Graphite response: {}".format(resp))
@@ -140,15 +493,8 @@ class GraphiteValidation(Validation):
                        "URL: {0}, Metric: {1}, Status Code: {2}," +
                        "Response: {3}").format(url, self.metric_name,
                                                resp.status_code, resp.text))
-        chunks = resp.text.strip().split('|')
-        if len(chunks) == 2:
-            readings = []
-            for tok in chunks[1].split(','):
-                if tok == six.u('None'):
-                    readings.append(None)
-                else:
-                    readings.append(float(tok))
-            return readings
-        else:
-            self.fail("Unexpected response from Graphite: {0}"
-                      .format(resp.text))
+        parsed = _parse_raw_series(resp.text)
+        if parsed is not None:
+            return parsed[1:]
+        self.fail("Unexpected response from Graphite: {0}"
+                  .format(resp.text))
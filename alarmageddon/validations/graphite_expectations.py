@@ -1,15 +1,20 @@
 """Expectations that can be held against metrics collected in Graphite"""
 
 from abc import abstractmethod
+import math
+
+from alarmageddon.validations.graphite_readings import Readings
 
 SECONDS_PER_MINUTE = 60
 SECONDS_PER_HOUR = SECONDS_PER_MINUTE * 60
 SECONDS_PER_DAY = SECONDS_PER_HOUR * 24
 
 
-def _avg(readings):
-    """Python 2.7 does not have an average function"""
-    return sum(readings, 0.0) / len(readings)
+def _as_readings(readings):
+    """Expectations may be handed plain lists of readings."""
+    if isinstance(readings, Readings):
+        return readings
+    return Readings(readings)
 
 
 def _delta_str(delta):
@@ -33,6 +38,24 @@ def _delta_str(delta):
     return ', '.join(result)
 
 
+def _present(readings):
+    """Iterate over the readings that aren't missing."""
+    for value in _as_readings(readings).array():
+        #NaN (a missing reading) is the only value not equal to itself
+        if value == value:
+            yield value
+
+
+def _check_percent(percent):
+    if not 0 <= percent <= 100:
+        raise ValueError("percent must be between 0 and 100, got {}"
+                         .format(percent))
+
+
+def _percentile(readings, percent):
+    return _as_readings(readings).percentile(percent)
+
+
 class GraphiteExpectation(object):
     """An expectation placed on a list of Graphte readings"""
     def __init__(self, validation, name):
@@ -51,11 +74,11 @@ class GraphiteExpectation(object):
         """
         num_bad_readings = len(bad_readings)
         if num_bad_readings:
-            bad_readings = list(set(bad_readings))
-            bad_readings.sort(reverse=higher_values_are_worse)
+            bad_readings = sorted(set(bad_readings),
+                                  reverse=higher_values_are_worse)
             self._validation.fail(
-                "In the last {0} there were {1} readings that " +
-                "exceeded allowed parameters.  For example: {2}"
+                ("In the last {0} there were {1} readings that " +
+                 "exceeded allowed parameters.  For example: {2}")
                 .format(_delta_str(self._validation.time_range),
                         num_bad_readings,
                         ', '.join([str(x) for x in bad_readings[:20]])))
@@ -66,12 +89,25 @@ class GraphiteExpectation(object):
         parameters
 
         """
+        if average is None:
+            self._fail_without_readings()
         if is_bad_average:
             self._validation.fail(
                 "In the last {0} the average reading was {1}"
                 .format(_delta_str(self._validation.time_range), average))
 
 
+    def _fail_percentile(self, percent, value):
+        self._validation.fail(
+            "In the last {0} the {1}th percentile reading was {2}"
+            .format(_delta_str(self._validation.time_range), percent, value))
+
+    def _fail_without_readings(self):
+        self._validation.fail(
+            "In the last {0} there were no readings to check"
+            .format(_delta_str(self._validation.time_range)))
+
+
 class GreaterThanExpectation(GraphiteExpectation):
     """Expect that a graphite metric is greater than a specified number"""
     def __init__(self, validation, lower_bound):
@@ -80,8 +116,8 @@ class GreaterThanExpectation(GraphiteExpectation):
         self._lower_bound = lower_bound
 
     def validate(self, readings, time_range):
-        self._validate([x for x in readings if x is not None and
-                        x <= self._lower_bound], False)
+        self._validate(_as_readings(readings).at_most(self._lower_bound),
+                       False)
 
     def __repr__(self):
         return "{}: all > {} on {}".format(type(self).__name__, self._lower_bound, self._validation)
@@ -95,8 +131,8 @@ class LessThanExpectation(GraphiteExpectation):
         self._upper_bound = upper_bound
 
     def validate(self, readings, time_range):
-        self._validate([x for x in readings if x is not None and
-                        x >= self._upper_bound], True)
+        self._validate(_as_readings(readings).at_least(self._upper_bound),
+                       True)
 
     def __repr__(self):
         return "{}: all < {} on {}".format(type(self).__name__, self._upper_bound, self._validation)
@@ -114,11 +150,12 @@ class AverageGreaterThanExpectation(GraphiteExpectation):
         self._lower_bound = lower_bound
 
     def validate(self, readings, time_range):
-        average = _avg([x for x in readings if x is not None])
-        self._validate_avg(average, average <= self._lower_bound)
+        average = _as_readings(readings).mean()
+        self._validate_avg(average, average is not None and
+                           average <= self._lower_bound)
 
     def __repr__(self):
-        return "{}: average > {} on {}".format(type(self).__name__, self._upper_bound, self._validation)
+        return "{}: average > {} on {}".format(type(self).__name__, self._lower_bound, self._validation)
 
 
 class AverageLessThanExpectation(GraphiteExpectation):
@@ -133,8 +170,199 @@ class AverageLessThanExpectation(GraphiteExpectation):
         self._upper_bound = upper_bound
 
     def validate(self, readings, time_range):
-        average = _avg([x for x in readings if x is not None])
-        self._validate_avg(average, average >= self._upper_bound)
+        average = _as_readings(readings).mean()
+        self._validate_avg(average, average is not None and
+                           average >= self._upper_bound)
 
     def __repr__(self):
         return "{}: average < {} on {}".format(type(self).__name__, self._upper_bound, self._validation)
+
+
+class PercentileLessThanExpectation(GraphiteExpectation):
+    """Expect that a percentile of a graphite metric is less than a
+    specified number
+
+    The percentile is exact, interpolating between the closest readings.
+
+    """
+    def __init__(self, validation, percent, upper_bound):
+        GraphiteExpectation.__init__(self, validation,
+              "The {0}th percentile of all values must be less than {1}"
+              .format(percent, upper_bound))
+        _check_percent(percent)
+        self._percent = percent
+        self._upper_bound = upper_bound
+
+    def validate(self, readings, time_range):
+        value = _percentile(readings, self._percent)
+        if value is None:
+            self._fail_without_readings()
+        if value >= self._upper_bound:
+            self._fail_percentile(self._percent, value)
+
+    def __repr__(self):
+        return "{}: p{} < {} on {}".format(type(self).__name__, self._percent, self._upper_bound, self._validation)
+
+
+class PercentileGreaterThanExpectation(GraphiteExpectation):
+    """Expect that a percentile of a graphite metric is greater than a
+    specified number
+
+    The percentile is exact, interpolating between the closest readings.
+
+    """
+    def __init__(self, validation, percent, lower_bound):
+        GraphiteExpectation.__init__(self, validation,
+              "The {0}th percentile of all values must be greater than {1}"
+              .format(percent, lower_bound))
+        _check_percent(percent)
+        self._percent = percent
+        self._lower_bound = lower_bound
+
+    def validate(self, readings, time_range):
+        value = _percentile(readings, self._percent)
+        if value is None:
+            self._fail_without_readings()
+        if value <= self._lower_bound:
+            self._fail_percentile(self._percent, value)
+
+    def __repr__(self):
+        return "{}: p{} > {} on {}".format(type(self).__name__, self._percent, self._lower_bound, self._validation)
+
+
+class MaxRateOfChangeExpectation(GraphiteExpectation):
+    """Expect that a graphite metric never changes faster than a specified
+    number of units per second
+
+    The rate is measured between each reading and the previous reading that
+    isn't missing.
+
+    """
+    def __init__(self, validation, max_rate):
+        GraphiteExpectation.__init__(self, validation,
+              "Values must change by less than {0} per second"
+              .format(max_rate))
+        self._max_rate = max_rate
+
+    def validate(self, readings, time_range):
+        values = _as_readings(readings).array()
+        if not len(values):
+            self._fail_without_readings()
+        step = time_range.total_seconds() / len(values)
+
+        fastest = None
+        previous = None
+        previous_index = 0
+        for index, value in enumerate(values):
+            if value != value:
+                continue
+            if previous is not None:
+                rate = abs(value - previous) / ((index - previous_index) * step)
+                if fastest is None or rate > fastest:
+                    fastest = rate
+            previous = value
+            previous_index = index
+
+        if fastest is not None and fastest >= self._max_rate:
+            self._validation.fail(
+                ("In the last {0} the reading changed by as much as {1} " +
+                 "per second")
+                .format(_delta_str(self._validation.time_range), fastest))
+
+    def __repr__(self):
+        return "{}: rate < {}/s on {}".format(type(self).__name__, self._max_rate, self._validation)
+
+
+class MissingReadingsExpectation(GraphiteExpectation):
+    """Expect that less than a specified fraction of the readings of a
+    graphite metric are missing (None)
+
+    """
+    def __init__(self, validation, max_fraction):
+        GraphiteExpectation.__init__(self, validation,
+              "Less than {0} of values may be missing".format(max_fraction))
+        if not 0 <= max_fraction <= 1:
+            raise ValueError("max_fraction must be between 0 and 1, got {}"
+                             .format(max_fraction))
+        self._max_fraction = max_fraction
+
+    def validate(self, readings, time_range):
+        values = _as_readings(readings).array()
+        if not len(values):
+            self._fail_without_readings()
+        missing = 0
+        for value in values:
+            if value != value:
+                missing += 1
+        fraction = missing / float(len(values))
+        if fraction >= self._max_fraction:
+            self._validation.fail(
+                "In the last {0} {1} of {2} readings were missing"
+                .format(_delta_str(self._validation.time_range), missing,
+                        len(values)))
+
+    def __repr__(self):
+        return "{}: missing < {} on {}".format(type(self).__name__, self._max_fraction, self._validation)
+
+
+class BaselineExpectation(GraphiteExpectation):
+    """Expect that a graphite metric stays close to its recent baseline
+
+    The baseline is an exponentially weighted moving average (EWMA) of the
+    readings, along with an exponentially weighted variance. Each reading is
+    compared to the baseline of the readings before it, and fails the
+    expectation if it is more than `max_deviations` standard deviations
+    away.
+
+    :param max_deviations: How many standard deviations from the baseline a
+      reading may be.
+    :param alpha: How much weight each new reading gets in the baseline,
+      from 0 to 1. Higher values follow changes more quickly.
+    :param warmup: How many readings are used to build the baseline before
+      any are checked against it.
+
+    """
+    def __init__(self, validation, max_deviations=3, alpha=0.1, warmup=10):
+        GraphiteExpectation.__init__(self, validation,
+              "Values must be within {0} standard deviations of the baseline"
+              .format(max_deviations))
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be between 0 and 1, got {}"
+                             .format(alpha))
+        self._max_deviations = max_deviations
+        self._alpha = alpha
+        self._warmup = max(warmup, 1)
+
+    def validate(self, readings, time_range):
+        alpha = self._alpha
+        mean = None
+        variance = 0.0
+        seen = 0
+        deviants = 0
+        examples = []
+        for value in _present(readings):
+            if mean is None:
+                mean = value
+            else:
+                difference = value - mean
+                if seen >= self._warmup:
+                    deviation = abs(difference)
+                    if deviation > self._max_deviations * math.sqrt(variance):
+                        deviants += 1
+                        if len(examples) < 20:
+                            examples.append(value)
+                increment = alpha * difference
+                mean += increment
+                variance = (1 - alpha) * (variance + difference * increment)
+            seen += 1
+
+        if deviants:
+            self._validation.fail(
+                ("In the last {0} there were {1} readings more than {2} " +
+                 "standard deviations from the baseline.  For example: {3}")
+                .format(_delta_str(self._validation.time_range), deviants,
+                        self._max_deviations,
+                        ', '.join([str(x) for x in examples])))
+
+    def __repr__(self):
+        return "{}: within {} deviations on {}".format(type(self).__name__, self._max_deviations, self._validation)
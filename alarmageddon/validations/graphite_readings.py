@@ -0,0 +1,164 @@
+"""Compact storage of, and fast calculations on, Graphite readings.
+
+Readings are kept in a flat array of doubles rather than a list of Python
+floats, with NaN standing in for readings Graphite has no data for (which
+Graphite reports as None). Calculations over them use NumPy when it is
+installed, and fall back to plain Python otherwise.
+
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_NAN = float("nan")
+
+
+def _to_float(token):
+    if token == "None":
+        return _NAN
+    return float(token)
+
+
+class Readings(object):
+    """An immutable sequence of Graphite readings.
+
+    Behaves like a list of floats and None values, so code written against
+    the lists Alarmageddon used to hand to expectations keeps working.
+
+    :param values: The readings, as numbers and/or None values, or an
+      array('d') (which is used as is) with NaN for missing readings.
+
+    """
+
+    __slots__ = ("_values",)
+
+    def __init__(self, values=()):
+        if isinstance(values, array) and values.typecode == "d":
+            self._values = values
+        else:
+            self._values = array("d", [_NAN if value is None else value
+                                       for value in values])
+
+    @classmethod
+    def parse(cls, text):
+        """Build readings from the comma separated values of a format=raw
+        Graphite response.
+
+        """
+        if not text:
+            return cls()
+        tokens = text.split(",")
+        if numpy is not None:
+            values = numpy.array([token.replace("None", "nan")
+                                  for token in tokens], dtype=numpy.float64)
+            return cls(array("d", values.tobytes()))
+        return cls(array("d", [_to_float(token) for token in tokens]))
+
+    def array(self):
+        """Return the readings as an array('d'), with NaN for None."""
+        return self._values
+
+    def count(self):
+        """Return how many readings are not None."""
+        if numpy is not None:
+            return int(numpy.count_nonzero(~numpy.isnan(self._numpy())))
+        return sum(1 for value in self._values if value == value)
+
+    def at_least(self, bound):
+        """Return the readings that are greater than or equal to `bound`."""
+        if numpy is not None:
+            values = self._numpy()
+            return values[values >= bound].tolist()
+        #NaN compares false with everything, so missing readings never match
+        return [value for value in self._values if value >= bound]
+
+    def at_most(self, bound):
+        """Return the readings that are less than or equal to `bound`."""
+        if numpy is not None:
+            values = self._numpy()
+            return values[values <= bound].tolist()
+        return [value for value in self._values if value <= bound]
+
+    def mean(self):
+        """Return the average reading, or None if there are none."""
+        if numpy is not None:
+            values = self._present()
+            if not len(values):
+                return None
+            return float(values.mean())
+        total = 0.0
+        count = 0
+        for value in self._values:
+            if value == value:
+                total += value
+                count += 1
+        if not count:
+            return None
+        return total / count
+
+    def percentile(self, percent):
+        """Return the given percentile of the readings, or None if there
+        are none.
+
+        Interpolates linearly between the closest readings, as NumPy does.
+
+        :param percent: The percentile to return, from 0 to 100.
+
+        """
+        if not 0 <= percent <= 100:
+            raise ValueError("percent must be between 0 and 100, got {}"
+                             .format(percent))
+        if numpy is not None:
+            values = self._present()
+            if not len(values):
+                return None
+            return float(numpy.percentile(values, percent))
+        values = sorted(value for value in self._values if value == value)
+        if not values:
+            return None
+        rank = (len(values) - 1) * percent / 100.0
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (rank - low)
+
+    def _numpy(self):
+        #shares memory with the array rather than copying it
+        return numpy.frombuffer(self._values, dtype=numpy.float64)
+
+    def _present(self):
+        values = self._numpy()
+        return values[~numpy.isnan(values)]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        for value in self._values:
+            yield None if value != value else value
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Readings(self._values[index])
+        value = self._values[index]
+        return None if value != value else value
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Readings({})".format(list(self))
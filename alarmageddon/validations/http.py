@@ -3,13 +3,23 @@ import time
 import os
 import requests
 import copy
+import threading
+import six
 import six.moves.urllib.parse as urlparse
+from six.moves import http_cookiejar
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-from alarmageddon.validations.validation import Validation, Priority
+from alarmageddon.validations.validation import Validation, Priority, \
+    describe_expectations
 from alarmageddon.validations.json_expectations import \
+    ExpectedJsonPredicate, \
     ExpectedJsonValueLessThan, \
     ExpectedJsonValueGreaterThan, \
-    ExpectedJsonEquality
+    ExpectedJsonEquality, \
+    parse_json, \
+    find_all
 
 
 from alarmageddon.validations.http_expectations import \
@@ -23,18 +33,179 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Time spent opening connections (TCP and TLS handshakes) by the current
+# thread, so that it can be reported separately from server latency.
+_connect_timer = threading.local()
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _timed_connection(connection_class):
+    """Return a subclass of connection_class that records how long it takes
+    to connect in _connect_timer.
+
+    """
+    class _TimedConnection(connection_class):
+        def connect(self):
+            start = time.time()
+            try:
+                return connection_class.connect(self)
+            finally:
+                _connect_timer.elapsed = (getattr(_connect_timer, "elapsed", 0.0) +
+                                          time.time() - start)
+    return _TimedConnection
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _timed_connection(HTTPConnection)
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _timed_connection(HTTPSConnection)
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter whose connections record their handshake time."""
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool}
+
+
+class HttpSessionPool(object):
+    """Keep-alive HTTP sessions shared by HttpValidations.
+
+    Sessions are keyed by scheme, host, port and certificate verification
+    settings, so every HttpValidation talking to the same server reuses the
+    same pool of open connections instead of paying for a new TCP and TLS
+    handshake on every request and retry. Cookies are never stored, so
+    validations can't affect each other through a shared session.
+
+    Connections are only reused within a process: a pool used from a
+    different process (e.g. one started by the "process" engine) starts
+    over with fresh sessions.
+
+    :param pool_connections: The number of per-host connection pools each
+      session keeps.
+    :param pool_maxsize: The maximum number of connections kept open to any
+      one host.
+    :param pool_block: If True, `pool_maxsize` is also the most connections
+      that may be open to any one host at once, and requests wait for a
+      connection to be free. Otherwise extra connections are opened when
+      needed, and closed rather than kept once they are done with.
+
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pid = os.getpid()
+
+    def session(self, url, verify=True):
+        """Return the session to use for requests to url."""
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        key = (scheme, (parts.hostname or "").lower(),
+               parts.port or DEFAULT_PORTS.get(scheme), verify)
+        with self._lock:
+            if self._pid != os.getpid():
+                #connections opened by another process can't be shared
+                self._sessions = {}
+                self._pid = os.getpid()
+            try:
+                return self._sessions[key]
+            except KeyError:
+                session = self._new_session()
+                self._sessions[key] = session
+                return session
+
+    def request(self, method, url, verify=True, **kwargs):
+        """Make a request through the appropriate pooled session.
+
+        Returns a tuple of the response and the number of seconds spent
+        establishing new connections while making the request.
+
+        """
+        session = self.session(url, verify)
+        _connect_timer.elapsed = 0.0
+        resp = session.request(method, url, verify=verify, **kwargs)
+        return resp, _connect_timer.elapsed
+
+    def close(self):
+        """Close every session and the connections they hold open."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def _new_session(self):
+        session = requests.Session()
+        session.cookies.set_policy(
+            http_cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter_kwargs = {"pool_connections": self.pool_connections,
+                          "pool_maxsize": self.pool_maxsize,
+                          "pool_block": self.pool_block}
+        session.mount("http://", _TimedHTTPAdapter(**adapter_kwargs))
+        session.mount("https://", _TimedHTTPAdapter(**adapter_kwargs))
+        return session
+
+    def __getstate__(self):
+        #open sessions and the lock can't be pickled, and connections
+        #aren't shared between processes anyway
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_sessions"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "{}: {} sessions (connections: {}, maxsize: {}, block: {})"\
+            .format(type(self).__name__, len(self._sessions),
+                    self.pool_connections, self.pool_maxsize, self.pool_block)
+
+
+# The session pool used by HttpValidations that aren't given one.
+DEFAULT_SESSION_POOL = HttpSessionPool()
+
+
+def _finds_json_property(expectation):
+    """Return True if the expectation checks a JSON property found the
+    usual way, so the property can be found along with the others.
+
+    Subclasses that override validate are left to validate themselves.
+
+    """
+    return (isinstance(expectation, ExpectedJsonPredicate) and
+            six.get_unbound_function(type(expectation).validate) is
+            six.get_unbound_function(ExpectedJsonPredicate.validate))
+
+
 class HttpValidation(Validation):
     """A Validation that executes an HTTP request and then performs zero or
     more checks on the response.
 
     """
+
+    #shared between validations, and kept out of their pickled state
+    session_pool = DEFAULT_SESSION_POOL
+
     def __init__(self, method, url, data=None, headers=None,
                  priority=Priority.NORMAL, timeout=None,
                  group=None, retries=1, ignore_ssl_cert_errors=False,
-                 auth=None):
+                 auth=None, session_pool=None):
         """Creates an HttpValidation object that will make an HTTP request to
         the provided URL passing the provided headers.
 
+        session_pool - the :py:class:`HttpSessionPool` to make requests
+        through. Defaults to DEFAULT_SESSION_POOL, which is shared by all
+        HttpValidations.
+
         """
         Validation.__init__(self, "{0} {1}".format(method, url),
                             priority=priority,
@@ -50,7 +221,10 @@ class HttpValidation(Validation):
         self._retries = retries
         self._ignore_ssl_cert_errors = ignore_ssl_cert_errors
         self._auth = auth or ()
+        if session_pool is not None:
+            self.session_pool = session_pool
         self._elapsed_time = -1
+        self._connect_time = 0
 
     @staticmethod
     def get(url, **kwargs):
@@ -151,12 +325,16 @@ class HttpValidation(Validation):
         for i in range(self._retries):
             logger.debug("Attempt {} for {} {}".format(i, self._method, self._url))
             try:
-                resp = requests.request(
+                resp, connect_time = self.session_pool.request(
                     self._method, self._url, data=self._data,
                     headers=self._headers, verify=self._get_verify(),
                     auth=self._auth, timeout=self.timeout)
                 logger.debug("Got response {}".format(resp))
-                self._elapsed_time = resp.elapsed.total_seconds()
+                #resp.elapsed includes any time spent opening a connection,
+                #which we want to keep out of the server's response time
+                self._connect_time = connect_time
+                self._elapsed_time = max(
+                    resp.elapsed.total_seconds() - connect_time, 0)
                 self._check_expectations(resp)
                 break
             except Exception as ex:
@@ -166,9 +344,26 @@ class HttpValidation(Validation):
                     raise ex
                 time.sleep(1)
 
+    def _identity(self):
+        return Validation._identity(self) + [
+            self._data, sorted(self._headers.items())] + describe_expectations(
+                [self._response_code_expectation] + self._expectations)
+
     def get_elapsed_time(self):
+        """Return how long the server took to respond, not counting the
+        time spent establishing a connection.
+
+        """
         return self._elapsed_time
 
+    def get_connect_time(self):
+        """Return how long it took to establish a connection (including any
+        TLS handshake) for the last request. This is 0 when a pooled
+        connection was reused.
+
+        """
+        return self._connect_time
+
     def fail(self, reason):
         """Causes this HttpValidation to fail with the given reason."""
         Validation.fail(self, reason)
@@ -209,7 +404,9 @@ class HttpValidation(Validation):
                 timeout=self.timeout,
                 group=self.group,
                 retries=self._retries,
-                ignore_ssl_cert_errors=self._ignore_ssl_cert_errors)
+                ignore_ssl_cert_errors=self._ignore_ssl_cert_errors,
+                #only a pool given to this validation, not the shared one
+                session_pool=vars(self).get("session_pool"))
             for expectation in self._expectations:
                 result.add_expectation(expectation)
             results.append(result)
@@ -234,12 +431,14 @@ class HttpValidation(Validation):
 
         """
         self._headers[name] = value
+        self._identity_changed()
         return self
 
     def add_expectation(self, expectation):
         """Add a custom expecation to the Validation"""
         if isinstance(expectation, ResponseExpectation):
             self._expectations.append(expectation)
+            self._identity_changed()
             return self
         else:
             raise ValueError("attempt to add expectation that does not" +
@@ -267,6 +466,7 @@ class HttpValidation(Validation):
 
         """
         self._response_code_expectation = _ExpectedStatusCodes(status_codes)
+        self._identity_changed()
         return self
 
     def expect_content_type(self, content_type):
@@ -310,12 +510,25 @@ class HttpValidation(Validation):
         return self
 
     def _check_expectations(self, response):
-        """An HttpValidation without any expectations always fails"""
-        self._expectations.append(self._response_code_expectation)
-        if not self._expectations:
-            self.fail("no expectations set")
-        else:
-            for expectation in self._expectations:
+        """Check the response against the expected status codes and then
+        every other expectation.
+
+        """
+        self._response_code_expectation.validate(self, response)
+        #the JSON properties every JSON expectation needs, found together
+        #once the first of them is reached
+        properties = None
+        for expectation in self._expectations:
+            if _finds_json_property(expectation):
+                if properties is None:
+                    properties = find_all(
+                        parse_json(self, response),
+                        [e.json_property_path for e in self._expectations
+                         if _finds_json_property(e)])
+                expectation.validate_value(
+                    self, expectation.value,
+                    properties[expectation.json_property_path])
+            else:
                 expectation.validate(self, response)
 
     def _get_verify(self):
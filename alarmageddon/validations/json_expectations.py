@@ -2,6 +2,13 @@
 
 import re
 
+try:
+    from functools import lru_cache
+except ImportError:
+    #Python 2 has no lru_cache, so paths are compiled every time there
+    def lru_cache(maxsize):
+        return lambda function: function
+
 from alarmageddon.validations.http_expectations import ResponseExpectation
 
 
@@ -18,6 +25,7 @@ class ExpectedJsonPredicate(ResponseExpectation):
         ResponseExpectation.__init__(self)
         self.json_property_path = json_property_path
         self.value = value
+        self.path = _compile_path(json_property_path)
 
     def validate(self, validation, response):
         """Validates that the HTTP response is JSON and that it contains a
@@ -25,14 +33,8 @@ class ExpectedJsonPredicate(ResponseExpectation):
         self.value
 
         """
-        try:
-            json = response.json()
-        except ValueError:
-            validation.fail(
-                "response body was not JSON: {0}, Status Code: {1}"
-                .format(response.text, response.status_code))
-        actual_value = _JsonQuery.find(json, self.json_property_path)
-        self.validate_value(validation, self.value, actual_value)
+        json = parse_json(validation, response)
+        self.validate_value(validation, self.value, self.path.find(json))
 
     def validate_value(self, validation, expected_value, actual_value):
         """validates a JSON value"""
@@ -116,6 +118,114 @@ class ExpectedJsonValueGreaterThan(ExpectedJsonPredicate):
 INDEXED_ARRAY = re.compile(r"([^[]+)\[(\d+|\*)\]")
 
 
+def parse_json(validation, response):
+    """Return the JSON body of an HTTP response, failing the validation if
+    it isn't JSON.
+
+    """
+    try:
+        return response.json()
+    except ValueError:
+        validation.fail(
+            "response body was not JSON: {0}, Status Code: {1}"
+            .format(response.text, response.status_code))
+
+
+class _JsonPath(object):
+    """A property path, split up into the steps that find the property.
+
+    Each step is a (name, index) pair, where index is None unless the step
+    picks an element out of an array.
+
+    """
+
+    def __init__(self, property_path):
+        steps = []
+        for path_elem in property_path.split('.'):
+            match = INDEXED_ARRAY.search(path_elem)
+            if match:
+                # We have an array property. A wildcard means the whole
+                # array, so it finds the same value as the bare name.
+                if match.group(2) == "*":
+                    steps.append((match.group(1), None))
+                else:
+                    steps.append((match.group(1), int(match.group(2))))
+            else:
+                steps.append((path_elem, None))
+        self.steps = tuple(steps)
+
+    def find(self, json):
+        """Finds the property in json, or returns None if it isn't there"""
+        root = json
+        try:
+            for step in self.steps:
+                root = _take_step(root, step)
+        except Exception:
+            return None
+        return root
+
+    def __repr__(self):
+        return "_JsonPath: {}".format(self.steps)
+
+
+def _take_step(root, step):
+    name, index = step
+    root = root[name]
+    if index is not None:
+        root = root[index]
+    return root
+
+
+#paths are compiled once and shared by every expectation that uses them,
+#up to a limit, since _JsonQuery.find may be given any number of paths
+@lru_cache(maxsize=1024)
+def _compile_path(property_path):
+    return _JsonPath(property_path)
+
+
+def find_all(json, paths):
+    """Find many properties in a single traversal of json.
+
+    Paths that share a prefix (e.g. "a.b.c" and "a.b.d") only traverse it
+    once.
+
+    :param json: The parsed JSON document.
+    :param paths: The property paths to find.
+
+    Returns a dict mapping each path to its property, or None if it isn't
+    there.
+
+    """
+    #a trie of steps: each node maps a step to the (children, paths that
+    #end with that step) that follow it
+    trie = {}
+    found = {}
+    for property_path in paths:
+        found[property_path] = None
+        node = trie
+        steps = _compile_path(property_path).steps
+        for i, step in enumerate(steps):
+            children, ending = node.setdefault(step, ({}, []))
+            if i == len(steps) - 1:
+                ending.append(property_path)
+            node = children
+    _walk(json, trie, found)
+    return found
+
+
+def _walk(root, trie, found):
+    for step, (children, ending) in trie.items():
+        try:
+            value = _take_step(root, step)
+        except Exception:
+            #so every path through this step stays None
+            continue
+        for property_path in ending:
+            found[property_path] = value
+        if children:
+            _walk(value, children, found)
+
+
 class _JsonQuery(object):
     """Simple JSON query executor"""
 
@@ -131,28 +241,10 @@ class _JsonQuery(object):
     #
     #   person.address[0]
     #
-    # This regular expression helps match property paths using this syntax.
+    # Paths are compiled into their steps (see _JsonPath) the first time
+    # they are used.
 
     @staticmethod
     def find(json, property_path):
         """Finds a property by traversing self.json_property_path"""
-        root = json
-        try:
-            for path_elem in property_path.split('.'):
-                match = INDEXED_ARRAY.search(path_elem)
-                if match:
-                    # We have an array property and the caller has specified
-                    # which element of the array to validate against
-                    name = match.group(1)
-                    if match.group(2) == "*":
-                        # caller has supplied a wildcard
-                        # return the list element
-                        root = root[name]
-                    else:
-                        index = int(match.group(2))
-                        root = root[name][index]
-                else:
-                    root = root[path_elem]
-        except Exception:
-            return None
-        return root
+        return _compile_path(property_path).find(json)
@@ -3,8 +3,10 @@
 from alarmageddon.validations.validation import Priority
 from alarmageddon.validations.ssh import SshValidation
 
+import os
 import re
-from collections import Counter
+import threading
+import time
 
 from alarmageddon.validations.utilities import format_node, format_cluster
 
@@ -12,6 +14,131 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+#the first (topic) and third (leader) tab separated fields of each line of
+#the list topic command's output
+_PARTITION_LINE = re.compile(r"^([^\t\r\n]*)\t[^\t\r\n]*\t([^\t\r\n]*)",
+                             re.MULTILINE)
+
+_ERROR_PATTERNS = ['No such file', 'Missing required argument', 'Exception']
+
+
+def iter_topic_leaders(output):
+    """Iterate over the (topic, leader) pair of every partition listed in
+    the output of the list topic command, without splitting it all up
+    first.
+
+    """
+    for match in _PARTITION_LINE.finditer(output):
+        yield match.group(1), match.group(2)
+
+
+def duplicate_leaders(pairs):
+    """Return the (topic, leader) pairs that appear more than once, in the
+    order they first repeat.
+
+    """
+    seen = set()
+    duplicates = []
+    reported = set()
+    for pair in pairs:
+        if pair not in seen:
+            seen.add(pair)
+        elif pair not in reported:
+            reported.add(pair)
+            duplicates.append(pair)
+    return duplicates
+
+
+class _KafkaCommandError(Exception):
+    """The list topic command failed"""
+    pass
+
+
+class _PendingMetadata(object):
+    """The (possibly still pending) metadata of a cluster."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.finished = None
+        self.value = None
+        self.failed = False
+
+
+class KafkaMetadataCache(object):
+    """Shares what is learned about a Kafka cluster's partitions between
+    the hosts (and validations) that check it.
+
+    Every host of a cluster reports the same metadata (it comes from the
+    cluster's zookeeper), so it is fetched from one host and reused by the
+    rest for `max_age` seconds. Hosts that need the metadata while it is
+    being fetched wait for that fetch rather than starting another.
+
+    Failed fetches are not cached or shared: a host that was waiting on a
+    fetch that failed fetches the metadata itself, so one unreachable host
+    doesn't fail the others. Like the SSH command cache, this only shares
+    metadata within a single process.
+
+    :param max_age: How many seconds a cluster's metadata is reused for.
+
+    """
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._clusters = {}
+        self._pid = os.getpid()
+
+    def get(self, cluster, fetch):
+        """Return the metadata of a cluster, calling fetch() to get it only
+        if there isn't any recent metadata.
+
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clusters = {}
+                self._pid = os.getpid()
+            pending = self._clusters.get(cluster)
+            owner = pending is None or self._is_stale(pending)
+            if owner:
+                pending = _PendingMetadata()
+                self._clusters[cluster] = pending
+
+        if not owner:
+            pending.done.wait()
+            if pending.failed:
+                #the error belongs to the host that fetched, so try this one
+                return fetch()
+            return pending.value
+
+        try:
+            pending.value = fetch()
+        except Exception:
+            pending.failed = True
+            with self._lock:
+                if self._clusters.get(cluster) is pending:
+                    del self._clusters[cluster]
+            raise
+        finally:
+            pending.finished = time.time()
+            pending.done.set()
+        return pending.value
+
+    def clear(self):
+        """Forget all cached metadata."""
+        with self._lock:
+            self._clusters = {}
+
+    def _is_stale(self, pending):
+        return (pending.done.is_set() and
+                time.time() - pending.finished > self.max_age)
+
+    def __repr__(self):
+        return "{}: {} clusters".format(type(self).__name__,
+                                        len(self._clusters))
+
+
+# The metadata cache shared by all KafkaStatusValidations.
+DEFAULT_METADATA_CACHE = KafkaMetadataCache()
+
+
 class KafkaStatusValidation(SshValidation):
 
     """Validate that the Kafka cluster has all of it's partitions
@@ -33,8 +160,15 @@ class KafkaStatusValidation(SshValidation):
 
     :param cluster_name: the name of the cluster (helps when you're monitoring
                          multiple clusters.  Defaults to 'anonymous'.
+
+    The partition metadata is the same on every host of a cluster, so it is
+    only fetched from one of them and shared (through `metadata_cache`)
+    with the rest.
     """
 
+    #shared between validations, and kept out of their pickled state
+    metadata_cache = DEFAULT_METADATA_CACHE
+
     def __init__(self, ssh_context,
                  zookeeper_nodes,
                  kafka_list_topic_command="/opt/kafka/bin/kafka-list-topic.sh",
@@ -49,29 +183,24 @@ class KafkaStatusValidation(SshValidation):
         self.zookeeper_nodes = zookeeper_nodes
         self.cluster_name = cluster_name
 
+    def _identity(self):
+        return SshValidation._identity(self) + [self.zookeeper_nodes,
+                                                self.cluster_name]
+
     def perform_on_host(self, connection):
-        """Runs kafka list topic command on host"""
+        """Checks the cluster's partition leaders, as seen from the host"""
         host = connection.host
-        output = connection.run(
-            self.kafka_list_topic_command +
-            " --zookeeper " +
-            self.zookeeper_nodes, warn=True)
-
-        error_patterns = [
-            'No such file', 'Missing required argument', 'Exception']
-        if any(x in output for x in error_patterns):
+        try:
+            duplicates = self.metadata_cache.get(
+                (self.zookeeper_nodes, self.kafka_list_topic_command),
+                lambda: self._fetch_duplicates(connection))
+        except _KafkaCommandError as ex:
             self.fail_on_host(host, ("An exception occurred while " +
                                          "checking Kafka cluster health " +
                                          "on {0} ({1})").format(
                                              format_node(self.cluster_name,
                                                              host),
-                                             output))
-        parsed = re.split(r'\t|\n', output)
-        topics = [parsed[i] for i in range(0, len(parsed), 5)]
-        leaders = [parsed[i] for i in range(2, len(parsed), 5)]
-
-        tuples = list(zip(topics, leaders))
-        duplicates = [x for x, y in list(Counter(tuples).items()) if y > 1]
+                                             ex))
 
         if len(duplicates) != 0:
             duplicates_str =", ".join("%s has %s" %
@@ -82,3 +211,17 @@ class KafkaStatusValidation(SshValidation):
                                       format_cluster(self.cluster_name),
                                       duplicates_str)
 )
+
+    def _fetch_duplicates(self, connection):
+        """Runs kafka list topic command on host, and finds the topics with
+        more than one partition led by the same replica
+
+        """
+        output = connection.run(
+            self.kafka_list_topic_command +
+            " --zookeeper " +
+            self.zookeeper_nodes, warn=True)
+
+        if any(x in output for x in _ERROR_PATTERNS):
+            raise _KafkaCommandError(output)
+        return duplicate_leaders(iter_topic_leaders(output))
@@ -1,5 +1,8 @@
 """Validation for RabbitMQ"""
 
+import collections
+import os
+import threading
 import time
 
 from alarmageddon.validations.validation import Validation, Priority
@@ -45,8 +48,160 @@ class RabbitMqContext(object):
                                  socket_timeout=timeout))
 
 
+def _broker_key(context):
+    return (context.host, context.port, context.user_name, context.password)
+
+
+class RabbitMqConnectionPool(object):
+    """Keeps open connections to RabbitMQ brokers so they can be reused.
+
+    Connections are kept per broker and user. A connection keeps the
+    socket timeout it was opened with, even when it is reused by a
+    validation with a different timeout.
+
+    Pools are per process: a process forked from one that has pooled
+    connections starts with an empty pool, since the connections belong to
+    the parent.
+
+    :param max_idle: How many idle connections to keep per broker.
+
+    """
+
+    def __init__(self, max_idle=2):
+        self.max_idle = max_idle
+        self._pid = os.getpid()
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, context, timeout=None):
+        """Return a (connection, channel) pair for the context's broker.
+
+        An idle pooled connection is used if there is one, otherwise a new
+        connection is opened. Hand the pair back with :py:meth:`release`
+        when done with it.
+
+        """
+        key = _broker_key(context)
+        with self._lock:
+            self._check_pid()
+            idle = self._idle[key]
+            while idle:
+                conn = idle.pop()
+                if conn.is_open:
+                    logger.debug("Reusing connection to %s", context.host)
+                    try:
+                        return (conn, conn.channel())
+                    except AMQPError:
+                        self._close(conn)
+        conn = context.get_connection(timeout)
+        try:
+            return (conn, conn.channel())
+        except AMQPError:
+            self._close(conn)
+            raise
+
+    def release(self, context, conn, chan, broken=False):
+        """Hand back a pair from :py:meth:`acquire`.
+
+        :param broken: If True, the connection is closed rather than kept,
+          e.g. because using it raised an error.
+
+        """
+        if conn is None:
+            return
+        try:
+            if chan is not None and chan.is_open:
+                chan.close()
+        except AMQPError:
+            broken = True
+        with self._lock:
+            self._check_pid()
+            idle = self._idle[_broker_key(context)]
+            if not broken and conn.is_open and len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        self._close(conn)
+
+    def clear(self):
+        """Close every pooled connection."""
+        with self._lock:
+            self._check_pid()
+            idle = self._idle
+            self._idle = collections.defaultdict(list)
+        for conns in idle.values():
+            for conn in conns:
+                self._close(conn)
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            #forked; the parent's connections aren't ours to use or close
+            self._pid = os.getpid()
+            self._idle = collections.defaultdict(list)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except AMQPError as ex:
+            logger.debug("Error closing RabbitMQ connection: %s", ex)
+
+    def __repr__(self):
+        return "RabbitMqConnectionPool: {} idle connections".format(
+            sum(len(conns) for conns in self._idle.values()))
+
+
+class RabbitMqQueueDepths(object):
+    """Keeps the message counts of queues that were fetched in bulk.
+
+    Filled by :py:meth:`RabbitMqValidation.prefetch`, and read by each
+    RabbitMqValidation when it is performed, so that many queues on one
+    broker are inspected over a single connection.
+
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def store(self, context, queue_name, message_count, fresh_for=60):
+        """Record the message count of a queue for the next `fresh_for`
+        seconds.
+
+        """
+        with self._lock:
+            self._counts[(_broker_key(context), queue_name)] = (
+                message_count, time.time() + fresh_for)
+
+    def message_count(self, context, queue_name):
+        """Return the recorded message count of a queue, or None if there
+        isn't a fresh one.
+
+        """
+        with self._lock:
+            count = self._counts.get((_broker_key(context), queue_name))
+        if count is None or count[1] < time.time():
+            return None
+        return count[0]
+
+    def clear(self):
+        """Forget every recorded message count."""
+        with self._lock:
+            self._counts.clear()
+
+    def __repr__(self):
+        return "RabbitMqQueueDepths: {} queues".format(len(self._counts))
+
+
+DEFAULT_CONNECTION_POOL = RabbitMqConnectionPool()
+DEFAULT_QUEUE_DEPTHS = RabbitMqQueueDepths()
+
+
 class RabbitMqValidation(Validation):
     """A Validation that can be held against a RabbitMQ server"""
+
+    #shared between validations, and kept out of their pickled state
+    connection_pool = DEFAULT_CONNECTION_POOL
+    queue_depths = DEFAULT_QUEUE_DEPTHS
+
     def __init__(self, rabbitmq_context, name, queue_name, max_queue_size,
                  priority=Priority.NORMAL, timeout=None, num_attempts=4,
                  seconds_between_attempts=2, group=None,
@@ -65,40 +220,125 @@ class RabbitMqValidation(Validation):
         self.seconds_between_attempts = seconds_between_attempts
         self.ignore_connection_failure = ignore_connection_failure
 
+    @classmethod
+    def for_queues(cls, rabbitmq_context, name, queue_sizes, **kwargs):
+        """Create a RabbitMqValidation for each of many queues.
+
+        Each queue is reported as its own result, but when the validations
+        are run together their queues are inspected over a single
+        connection to the broker (see :py:meth:`prefetch`).
+
+        :param rabbitmq_context: The context of the broker the queues are on.
+        :param name: The name to include in each validation's name.
+        :param queue_sizes: A dict, or sequence of pairs, mapping the name of
+          each queue to the most messages it may have.
+
+        Any other keyword arguments are passed on to every validation.
+
+        """
+        if isinstance(queue_sizes, dict):
+            queue_sizes = sorted(queue_sizes.items())
+        return [cls(rabbitmq_context, name, queue_name, max_queue_size,
+                    **kwargs)
+                for queue_name, max_queue_size in queue_sizes]
+
+    @classmethod
+    def prefetch(cls, validations):
+        """Inspect the queues of many validations over one connection per
+        broker.
+
+        The message count of every queue is put in each validation's
+        `queue_depths`, where performing the validation will find it.
+        Queues that can't be inspected, and brokers that can't be reached,
+        are logged and left for their validations to inspect (and report
+        on) themselves.
+
+        """
+        brokers = collections.OrderedDict()
+        for validation in validations:
+            key = (_broker_key(validation.rabbitmq_context),
+                   validation.connection_pool, validation.queue_depths)
+            batch = brokers.setdefault(
+                key, (validation.rabbitmq_context, validation.timeout, []))[2]
+            if validation.queue_name not in batch:
+                batch.append(validation.queue_name)
+
+        for (_, pool, depths), (context, timeout, queues) in brokers.items():
+            try:
+                (conn, chan) = pool.acquire(context, timeout)
+            except Exception as ex:
+                logger.warn("Could not connect to RabbitMQ host {0} to "
+                            "prefetch queues: {1}".format(context.host, ex))
+                continue
+            broken = False
+            try:
+                for queue_name in queues:
+                    try:
+                        queue = chan.queue_declare(queue_name, passive=True)
+                    except AMQPError as ex:
+                        logger.debug("Could not inspect queue %s: %s",
+                                     queue_name, ex)
+                        #the broker closes the channel when a passive
+                        #declare fails
+                        if not chan.is_open:
+                            chan = conn.channel()
+                        continue
+                    depths.store(context, queue_name,
+                                 queue.method.message_count)
+            except Exception as ex:
+                broken = True
+                logger.warn("Could not prefetch queues from RabbitMQ host "
+                            "{0}: {1}".format(context.host, ex))
+            finally:
+                pool.release(context, conn, chan, broken)
+
     def perform(self, group_failures):
         """Perform the validation.  If the validation fails, call self.fail
         passing it the reason for the failure.
 
+        """
+        message_count = self.queue_depths.message_count(
+            self.rabbitmq_context, self.queue_name)
+        if message_count is None:
+            message_count = self._get_message_count()
+            if message_count is None:
+                #if we're here we're intentionally ignoring the failure
+                return
+
+        if message_count > self.max_queue_size:
+            self.fail("Too many messages in queue ({0} messages)."
+                      .format(message_count))
+
+    def _get_message_count(self):
+        """Inspect the queue, returning its message count (or None if the
+        broker couldn't be reached and we're ignoring that)
+
         """
         try:
             (conn, chan) = self._connect()
         except AMQPError as ex:
-            #if we're here we're intentionally ignoring the failure
-            return
+            return None
 
+        broken = False
         try:
             queue = chan.queue_declare(self.queue_name, passive=True)
-            message_count = queue.method.message_count
-
-            if message_count > self.max_queue_size:
-                self.fail("Too many messages in queue ({0} messages)."
-                          .format(message_count))
+            return queue.method.message_count
 
         except AMQPError as ex:
+            broken = True
             self.fail("RabbitMQ exception throw from host: {0}.  {1}"
                       .format(self.rabbitmq_context.host, repr(ex)))
 
         finally:
-            if conn:
-                conn.close()
+            self.connection_pool.release(self.rabbitmq_context, conn, chan,
+                                         broken)
 
     def _connect(self):
         """connect to the RabbitMQ server"""
         for attempt in range(1, self.num_attempts + 1):
             try:
-                conn = self.rabbitmq_context.get_connection(self.timeout)
-                chan = conn.channel()
-                return (conn, chan)
+                return self.connection_pool.acquire(self.rabbitmq_context,
+                                                    self.timeout)
             except AMQPError as ex:
                 if attempt >= self.num_attempts:
                     if self.ignore_connection_failure:
@@ -0,0 +1,364 @@
+"""Validation for RabbitMQ queues, through the management HTTP API.
+
+Rather than asking the broker about one queue at a time over AMQP (see
+:py:mod:`~alarmageddon.validations.rabbitmq`), the statistics of every
+queue are read from the management API's `/api/queues` in one request per
+broker. The response is parsed as it streams in, and only the few
+statistics validations use are kept, indexed by vhost and queue name.
+
+"""
+
+import codecs
+import collections
+import json
+import operator
+import threading
+import time
+
+import requests
+
+from alarmageddon.validations.validation import Validation, Priority, \
+    describe_expectations
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+#the only parts of each queue's statistics that are kept
+_COLUMNS = "name,vhost,messages,consumers,message_stats"
+
+_SEPARATORS = " \t\r\n,"
+
+#how many seconds reading the queues may take, if no timeout was given
+DEFAULT_TIMEOUT = 30
+
+
+class QueueStats(object):
+    """The statistics of a single queue, as of when they were fetched."""
+
+    __slots__ = ("messages", "consumers", "publish_rate", "deliver_rate")
+
+    def __init__(self, messages=0, consumers=0, publish_rate=0.0,
+                 deliver_rate=0.0):
+        self.messages = messages
+        self.consumers = consumers
+        self.publish_rate = publish_rate
+        self.deliver_rate = deliver_rate
+
+    @classmethod
+    def from_json(cls, queue):
+        """Build statistics from a queue object of `/api/queues`."""
+        stats = queue.get("message_stats") or {}
+        return cls(messages=queue.get("messages") or 0,
+                   consumers=queue.get("consumers") or 0,
+                   publish_rate=_rate(stats, "publish_details"),
+                   deliver_rate=_rate(stats, "deliver_get_details"))
+
+    def __repr__(self):
+        return ("QueueStats: {} messages, {} consumers, {}/s published, " +
+                "{}/s delivered").format(self.messages, self.consumers,
+                                         self.publish_rate, self.deliver_rate)
+
+
+def _rate(stats, details):
+    return (stats.get(details) or {}).get("rate") or 0.0
+
+
+def iter_json_array(chunks):
+    """Iterate over the elements of a JSON array as its text arrives.
+
+    Each element is decoded as soon as all of it has arrived, so only one
+    element (plus whatever part of the next has arrived) is held in memory
+    at a time, rather than the whole document.
+
+    :param chunks: An iterable of strings that together make up the JSON
+      text of an array.
+
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    started = False
+    exhausted = False
+
+    while True:
+        while pos < len(buf) and buf[pos] in _SEPARATORS:
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                #the rest of the element hasn't arrived yet
+                end = None
+            #an element running to the end of what has arrived (e.g. a
+            #number) may not be finished
+            if end is not None and (end < len(buf) or exhausted):
+                yield element
+                pos = end
+                continue
+        if exhausted:
+            raise ValueError("The JSON array was incomplete")
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+class RabbitMqManagementContext(object):
+    """Information needed to read the RabbitMQ management API
+
+    :param url: The base URL of the management API (e.g.
+      "http://rabbit.example.com:15672").
+    :param user_name: The user to log in to the API as.
+    :param password: The user's password.
+    :param timeout: The number of seconds requests to the API may take. If
+      None, the smallest timeout of the validations that need the queues is
+      used, or :py:data:`DEFAULT_TIMEOUT` if none of them has one.
+
+    """
+
+    def __init__(self, url, user_name, password, timeout=None):
+        self.url = url.rstrip("/")
+        self.user_name = user_name
+        self.password = password
+        self.timeout = timeout
+
+    def fetch_queues(self, timeout=None):
+        """Read the statistics of every queue on the broker.
+
+        Returns a dict mapping (vhost, queue name) pairs to
+        :py:class:`QueueStats`.
+
+        :param timeout: The number of seconds the request may take, if the
+          context doesn't have a timeout of its own.
+
+        """
+        if self.timeout is not None:
+            timeout = self.timeout
+        elif timeout is None:
+            timeout = DEFAULT_TIMEOUT
+        resp = requests.get("{0}/api/queues".format(self.url),
+                            params={"columns": _COLUMNS},
+                            auth=(self.user_name, self.password),
+                            timeout=timeout, stream=True)
+        try:
+            resp.raise_for_status()
+            decoder = codecs.getincrementaldecoder(
+                resp.encoding or "utf-8")()
+            chunks = (decoder.decode(chunk)
+                      for chunk in resp.iter_content(64 * 1024))
+            queues = {}
+            for queue in iter_json_array(chunks):
+                queues[(queue.get("vhost"), queue.get("name"))] = \
+                    QueueStats.from_json(queue)
+            return queues
+        finally:
+            resp.close()
+
+    def __repr__(self):
+        return "RabbitMqManagementContext: {}".format(self.url)
+
+
+class RabbitMqSnapshots(object):
+    """Keeps the latest snapshot of every queue on each broker.
+
+    A snapshot is fetched at most once per broker every `max_age` seconds,
+    and shared by every validation of that broker's queues.
+
+    :param max_age: How many seconds a snapshot is used for.
+
+    """
+
+    def __init__(self, max_age=30):
+        self.max_age = max_age
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+
+    def queues(self, context, timeout=None):
+        """Return the queue statistics of the context's broker, fetching
+        them if there isn't a recent enough snapshot.
+
+        :param timeout: Passed on to
+          :py:meth:`RabbitMqManagementContext.fetch_queues`.
+
+        """
+        key = (context.url, context.user_name)
+        snapshot = self._fresh(key)
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+        #held while fetching, so that validations of the same broker running
+        #at the same time wait for one fetch rather than all fetching the
+        #same snapshot, without holding up those of other brokers
+        with fetch_lock:
+            snapshot = self._fresh(key)
+            if snapshot is None:
+                logger.debug("Fetching queues from %s", context.url)
+                snapshot = context.fetch_queues(timeout)
+                with self._lock:
+                    self._snapshots[key] = (snapshot, time.time())
+            return snapshot
+
+    def clear(self):
+        """Forget every snapshot."""
+        with self._lock:
+            self._snapshots.clear()
+
+    def _fresh(self, key):
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot is None or time.time() - snapshot[1] > self.max_age:
+            return None
+        return snapshot[0]
+
+    def __repr__(self):
+        return "RabbitMqSnapshots: {} brokers".format(len(self._snapshots))
+
+
+DEFAULT_SNAPSHOTS = RabbitMqSnapshots()
+
+
+class _QueueExpectation(object):
+    """An expectation of one of a queue's statistics"""
+
+    def __init__(self, statistic, description, is_bad, bound):
+        self.statistic = statistic
+        self.description = description
+        self.is_bad = is_bad
+        self.bound = bound
+
+    def validate(self, validation, stats):
+        value = getattr(stats, self.statistic)
+        if self.is_bad(value, self.bound):
+            validation.fail("{0} was {1}, expected {2} {3}".format(
+                self.statistic.replace("_", " ").capitalize(), value,
+                self.description, self.bound))
+
+    def __repr__(self):
+        return "{}: {} {} {}".format(type(self).__name__, self.statistic,
+                                     self.description, self.bound)
+
+
+class RabbitMqQueueValidation(Validation):
+    """A Validation of a RabbitMQ queue's statistics, as reported by the
+    management API
+
+    All the queues of a broker are read in a single request, which is
+    shared by every RabbitMqQueueValidation of that broker.
+
+    :param context: The :py:class:`RabbitMqManagementContext` of the broker.
+    :param name: The name of this validation.
+    :param queue_name: The name of the queue to validate.
+    :param vhost: The virtual host the queue is in.
+
+    """
+
+    #shared between validations, and kept out of their pickled state
+    snapshots = DEFAULT_SNAPSHOTS
+
+    def __init__(self, context, name, queue_name, vhost="/",
+                 priority=Priority.NORMAL, timeout=None, group=None):
+        Validation.__init__(self,
+            "queue '{0}' on RabbitMQ {1} ({2})".format(
+                queue_name, context.url, name),
+            priority=priority, timeout=timeout, group=group)
+        self.context = context
+        self.queue_name = queue_name
+        self.vhost = vhost
+        self._expectations = []
+
+    @classmethod
+    def prefetch(cls, validations):
+        """Read the snapshot of every broker the validations check, once.
+
+        A broker that can't be read is logged and skipped; its validations
+        try again, and report the failure, when they are performed.
+
+        """
+        brokers = collections.OrderedDict()
+        for validation in validations:
+            key = (validation.context.url, validation.context.user_name,
+                   validation.snapshots)
+            context, timeouts = brokers.setdefault(
+                key, (validation.context, []))
+            if validation.timeout is not None:
+                timeouts.append(validation.timeout)
+
+        for (url, _, snapshots), (context, timeouts) in brokers.items():
+            try:
+                snapshots.queues(context, min(timeouts) if timeouts else None)
+            except Exception as ex:
+                logger.warn("Could not prefetch queues from RabbitMQ {0}: {1}"
+                            .format(url, ex))
+
+    def perform(self, group_failures):
+        """Perform the validation and propagate any failures to reporters"""
+        try:
+            queues = self.snapshots.queues(self.context, self.timeout)
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            self.fail("Could not read queues from RabbitMQ {0}: {1}"
+                      .format(self.context.url, repr(ex)))
+
+        stats = queues.get((self.vhost, self.queue_name))
+        if stats is None:
+            self.fail("Queue '{0}' was not found in vhost '{1}'"
+                      .format(self.queue_name, self.vhost))
+
+        for expectation in self._expectations:
+            expectation.validate(self, stats)
+
+    def _identity(self):
+        return Validation._identity(self) + [self.context.url, self.vhost,
+                                             self.queue_name] + \
+            describe_expectations(self._expectations)
+
+    def expect_messages_less_than(self, max_messages):
+        """The queue should have fewer than `max_messages` messages in it"""
+        self._expectations.append(_QueueExpectation(
+            "messages", "less than", operator.ge,
+            max_messages))
+        self._identity_changed()
+        return self
+
+    def expect_consumers_at_least(self, min_consumers):
+        """The queue should have at least `min_consumers` consumers"""
+        self._expectations.append(_QueueExpectation(
+            "consumers", "at least", operator.lt,
+            min_consumers))
+        self._identity_changed()
+        return self
+
+    def expect_publish_rate_less_than(self, max_rate):
+        """Messages should be published to the queue at less than
+        `max_rate` messages per second
+
+        """
+        self._expectations.append(_QueueExpectation(
+            "publish_rate", "less than", operator.ge,
+            max_rate))
+        self._identity_changed()
+        return self
+
+    def expect_deliver_rate_at_least(self, min_rate):
+        """Messages should be delivered from the queue at `min_rate` or more
+        messages per second
+
+        """
+        self._expectations.append(_QueueExpectation(
+            "deliver_rate", "at least", operator.lt,
+            min_rate))
+        self._identity_changed()
+        return self
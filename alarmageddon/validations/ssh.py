@@ -9,11 +9,17 @@ import sys
 import os
 import time
 import re
+import atexit
+import threading
+import collections
+import contextlib
 import pytest
 import warnings
 import paramiko
 from fabric import Connection
-from alarmageddon.validations.validation import Validation, Priority
+from alarmageddon.validations.validation import Validation, Priority, \
+    describe_expectations
+from alarmageddon.validations.exceptions import ValidationFailure
 
 import logging
 
@@ -49,14 +55,254 @@ class SshContext(object):
         return "{}: {} {}".format(type(self).__name__, self.user, self.key_file)
 
 
+class SshConnectionPool(object):
+    """Open SSH connections shared by SshValidations.
+
+    Connections are keyed by host, user and key file, so every SshValidation
+    that runs against the same host (as the same user) reuses one SSH
+    connection instead of performing a new handshake. A connection is lent
+    to one user at a time; concurrent users of the same host get a
+    connection each.
+
+    Connections are checked before they are lent out: connections whose
+    transport has died or that have been idle for longer than `max_idle`
+    seconds are closed and replaced. Connections that raise anything other
+    than a :py:class:`~.exceptions.ValidationFailure` while borrowed are
+    assumed to be broken and are closed rather than returned to the pool.
+
+    The pool is never pickled along with validations, and a pool used from
+    a different process than the one that opened its connections starts
+    over, since SSH transports can't be shared between processes. So
+    connections are only reused between validations run by the "async"
+    engine; under the "process" engine, the output of shared commands is
+    run ahead of time instead (see :py:meth:`SshValidation.prefetch`).
+
+    :param max_idle: How many seconds a connection may sit unused in the
+      pool before it is closed.
+
+    """
+    def __init__(self, max_idle=300):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def borrow(self, host, ssh_context):
+        """Lend out a connection to host for the duration of a with block.
+
+        :param host: The host to connect to.
+        :param ssh_context: The :py:class:`SshContext` to connect with.
+
+        """
+        key = (host, ssh_context.user, ssh_context.key_file)
+        connection = self._acquire(key)
+        try:
+            yield connection
+        except ValidationFailure:
+            #the command ran, so the connection itself is fine
+            self._release(key, connection)
+            raise
+        except BaseException:
+            self._evict(connection)
+            raise
+        else:
+            self._release(key, connection)
+
+    def close(self):
+        """Close every connection in the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(list)
+        for connections in idle.values():
+            for connection, _ in connections:
+                self._evict(connection)
+
+    def _acquire(self, key):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = collections.defaultdict(list)
+                self._pid = os.getpid()
+            idle = self._idle[key]
+            while idle:
+                connection, released = idle.pop()
+                if self._is_healthy(connection, released):
+                    return connection
+                self._evict(connection)
+        host, user, key_file = key
+        return Connection(host=host, user=user,
+                          connect_kwargs={"key_filename": key_file})
+
+    def _release(self, key, connection):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._idle[key].append((connection, time.time()))
+
+    def _is_healthy(self, connection, released):
+        """Return True if a pooled connection can be lent out again."""
+        if time.time() - released > self.max_idle:
+            return False
+        # Connections are opened lazily, so one that was never opened has
+        # no transport yet and is fine to use.
+        return connection.transport is None or connection.is_connected
+
+    def _evict(self, connection):
+        try:
+            connection.close()
+        except Exception as ex:
+            logger.debug("Error closing SSH connection to {}: {}".format(
+                connection.host, ex))
+
+    def __repr__(self):
+        return "{}: {} hosts".format(type(self).__name__, len(self._idle))
+
+
+# The connection pool shared by all SshValidations.
+DEFAULT_CONNECTION_POOL = SshConnectionPool()
+atexit.register(DEFAULT_CONNECTION_POOL.close)
+
+
+#only ever held by a process that has just forked
+_FORK_LOCK = threading.Lock()
+
+
+class _CachedCommand(object):
+    """The (possibly still pending) output of a command run on a host."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.finished = None
+        self.output = None
+        self.error = None
+
+
+class SshCommandCache(object):
+    """Shares the output of read-only commands between validations.
+
+    Several validations often run the same command (e.g. `uptime` or
+    `nodetool status`) against the same host and only differ in what they
+    expect of its output. The cache runs each distinct command once per host
+    and hands the output to every validation that asks for it within
+    `max_age` seconds. A validation that asks for a command that is already
+    running on a host waits for that run rather than starting another one.
+
+    Only commands without side effects should be run through the cache.
+    Failed commands are not cached. Output that was cached before a process
+    forked is shared with the child (which is how output prefetched by
+    :py:meth:`SshValidation.prefetch` reaches the workers of the "process"
+    engine), but output cached after that isn't shared between processes.
+
+    :param max_age: How many seconds a command's output is reused for.
+
+    """
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._pid = os.getpid()
+
+    def run(self, connection, command, use_sudo=False, **kwargs):
+        """Return the output of command on the connection's host, running it
+        only if no recent output is available.
+
+        Extra keyword arguments are passed on to the connection's `run`
+        (or `sudo`) method.
+
+        """
+        key = (connection.host, connection.user, command, use_sudo)
+        if self._pid != os.getpid():
+            self._forked()
+        with self._lock:
+            cached = self._commands.get(key)
+            owner = cached is None or self._is_stale(cached)
+            if owner:
+                cached = _CachedCommand()
+                self._commands[key] = cached
+
+        if owner:
+            try:
+                if use_sudo:
+                    cached.output = connection.sudo(command, **kwargs)
+                else:
+                    cached.output = connection.run(command, **kwargs)
+            except Exception as ex:
+                cached.error = ex
+                with self._lock:
+                    if self._commands.get(key) is cached:
+                        del self._commands[key]
+            finally:
+                cached.finished = time.time()
+                cached.done.set()
+        else:
+            cached.done.wait()
+
+        if cached.error is not None:
+            raise cached.error
+        return cached.output
+
+    def clear(self):
+        """Forget all cached output."""
+        with self._lock:
+            self._commands = {}
+
+    def _forked(self):
+        """Adopt the cache of the parent process after a fork.
+
+        Only output that had finished is kept: a command that was still
+        running belongs to a thread that doesn't exist in this process. The
+        lock is replaced too, in case another thread held it at the fork.
+
+        """
+        with _FORK_LOCK:
+            if self._pid != os.getpid():
+                self._lock = threading.Lock()
+                self._commands = dict(
+                    (key, cached) for key, cached in self._commands.items()
+                    if cached.done.is_set())
+                self._pid = os.getpid()
+
+    def _is_stale(self, cached):
+        return (cached.done.is_set() and
+                time.time() - cached.finished > self.max_age)
+
+    def __repr__(self):
+        return "{}: {} commands".format(type(self).__name__, len(self._commands))
+
+
+# The command cache shared by all SshValidations.
+DEFAULT_COMMAND_CACHE = SshCommandCache()
+
+#the fraction of a validation's timeout that each host gets by default
+HOST_TIMEOUT_FRACTION = 0.9
+
+
 class SshValidation(Validation):
     """A Validation that is performed using SSH (more specifically, fabric)"""
 
+    # Class attributes rather than instance attributes so that they are
+    # never pickled along with the validation.
+    connection_pool = DEFAULT_CONNECTION_POOL
+    command_cache = DEFAULT_COMMAND_CACHE
+
+    #how many seconds prefetch waits for shared commands; validations run
+    #whatever is still missing themselves
+    prefetch_timeout = 60
+
     def __init__(self, ssh_context, name,
                  priority=Priority.NORMAL, timeout=None,
                  group=None, connection_retries=0,
-                 hosts=None):
-        """Creates an SshValidation object"""
+                 hosts=None, host_concurrency=10, host_timeout=None):
+        """Creates an SshValidation object
+
+        host_concurrency - the maximum number of hosts the validation is
+        performed against at the same time.
+
+        host_timeout - if the validation takes longer than this many seconds
+        on a host, that host is reported as a failure and the validation
+        stops waiting for it. If None, it defaults to a little less than
+        `timeout`, so that the hosts that did answer are still reported
+        before the whole validation times out. If both are None, hosts are
+        waited on indefinitely.
+
+        """
         Validation.__init__(self, name, priority, timeout, group=group)
         self.context = ssh_context
         if hosts is not None:
@@ -65,48 +311,203 @@ class SshValidation(Validation):
             self.hosts = []
         self.expectations = []
         self.retries = connection_retries
+        self.host_concurrency = host_concurrency
+        if host_timeout is None and timeout is not None:
+            host_timeout = timeout * HOST_TIMEOUT_FRACTION
+        self.host_timeout = host_timeout
         self._exit_code_expectation = _ExitCodeEquals(self, 0)
 
+    def _identity(self):
+        return Validation._identity(self) + [self.context.user,
+                                             sorted(self.hosts)] + \
+            describe_expectations(self.expectations +
+                                  [self._exit_code_expectation])
+
+    @classmethod
+    def prefetch(cls, validations):
+        """Run each distinct shared command once per host, before the
+        validations are handed to workers.
+
+        Shared commands are those that :py:meth:`shared_commands` returns.
+        Their output is kept in the command cache, which the workers of the
+        "process" engine inherit, so that each worker doesn't run the
+        command (and open an SSH connection) again. Commands are run on up
+        to the largest `host_concurrency` of the validations at a time.
+
+        """
+        commands = collections.OrderedDict()
+        for validation in validations:
+            for command, use_sudo in validation.shared_commands():
+                for host in validation.hosts:
+                    key = (host, validation.context.user,
+                           validation.context.key_file, command, use_sudo,
+                           validation.command_cache)
+                    commands.setdefault(key, validation)
+        if not commands:
+            return
+
+        slots = threading.Semaphore(
+            max(max(v.host_concurrency for v in validations), 1))
+
+        def run(validation, host, command, use_sudo):
+            with slots:
+                try:
+                    with validation.connection_pool.borrow(
+                            host, validation.context) as connection:
+                        validation.command_cache.run(
+                            connection, command, use_sudo=use_sudo,
+                            timeout=validation.timeout, warn=True)
+                except Exception as ex:
+                    logger.warn("Prefetching '{0}' on {1} failed: {2}"
+                                .format(command, host, ex))
+
+        threads = []
+        for key, validation in commands.items():
+            host, _, _, command, use_sudo, _ = key
+            thread = threading.Thread(
+                target=run, args=(validation, host, command, use_sudo))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        deadline = time.time() + cls.prefetch_timeout
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+        unfinished = sum(1 for thread in threads if thread.is_alive())
+        if unfinished:
+            logger.warn("{0} shared SSH commands did not finish within {1}s"
+                        .format(unfinished, cls.prefetch_timeout))
+
+    def shared_commands(self):
+        """Return the (command, use_sudo) pairs this validation runs on each
+        host through the command cache, which :py:meth:`prefetch` can run
+        ahead of time.
+
+        """
+        return []
+
     def add_hosts(self, hosts):
         """Add additional hosts to run validations against"""
 
         warnings.warn("Add hosts in the constructor rather than through this" +
                       " method", FutureWarning)
         self.hosts.extend(hosts)
+        self._identity_changed()
         return self
 
     def perform(self, group_failures):
-        """Perform validation against all of this object's hosts"""
+        """Perform validation against all of this object's hosts.
+
+        Hosts are checked concurrently (up to `host_concurrency` at a time)
+        and every host is checked even if some of them fail. All of the
+        hosts' failures are then reported together.
+
+        """
         if not self.hosts:
             self.fail("no hosts specified.")
 
-        ssh_kwargs = {"key_filename": self.context.key_file}
+        if self.host_concurrency <= 1 and self.host_timeout is None:
+            outcomes = [self._perform_on_host_safely(host)
+                        for host in self.hosts]
+        else:
+            outcomes = self._fan_out(self.hosts)
+
+        failures = [failure for failure in outcomes if failure is not None]
+        if failures:
+            self.fail("\n".join(failures))
+
+    def _fan_out(self, hosts, perform_on_host=None):
+        """Perform the validation on each host from a bounded set of threads.
 
-        #now we can add our default expectation
-        self.expectations.append(self._exit_code_expectation)
+        Returns a list containing, for each host, its failure message or
+        None if the validation passed on that host.
 
-        for host in self.hosts:
-            with Connection(host=host, user=self.context.user, connect_kwargs=ssh_kwargs) as connection:
-                for i in range(self.retries + 1):
-                    try:
-                        self.perform_on_host(connection)
+        :param perform_on_host: What to do on each host, in place of
+          :py:meth:`perform_on_host`.
+
+        """
+        condition = threading.Condition()
+        slots = threading.Semaphore(max(self.host_concurrency, 1))
+        started = {}
+        outcomes = {}
+
+        def run(index, host):
+            slots.acquire()
+            with condition:
+                started[index] = time.time()
+                #wake the main loop so it starts timing this host
+                condition.notify_all()
+            failure = self._perform_on_host_safely(host, perform_on_host)
+            with condition:
+                #if we already gave up on this host, its slot was released
+                #when we did
+                if index not in outcomes:
+                    outcomes[index] = failure
+                    slots.release()
+                    condition.notify_all()
+
+        for index, host in enumerate(hosts):
+            thread = threading.Thread(target=run, args=(index, host))
+            thread.daemon = True
+            thread.start()
+
+        with condition:
+            while len(outcomes) < len(hosts):
+                wait = None
+                if self.host_timeout is not None:
+                    now = time.time()
+                    for index, start in list(started.items()):
+                        if index in outcomes:
+                            continue
+                        remaining = start + self.host_timeout - now
+                        if remaining <= 0:
+                            outcomes[index] = "[{0}] Did not finish within {1}s"\
+                                .format(hosts[index], self.host_timeout)
+                            slots.release()
+                        elif wait is None or remaining < wait:
+                            wait = remaining
+                    if len(outcomes) == len(hosts):
                         break
-                    except paramiko.SSHException as ex:
-                        # TODO: Paramiko doesn't surface a separate sort of exception
-                        # for timeouts like fabric1 did. This probably needs more logic
-                        # to not catch issues that could allow for retrying
-
-                        # we connected, so don't retry
-                        self.fail_on_host(
-                            host,
-                            "SSH Command timed out: {0}".format(str(ex)))
-                    except Exception as ex:
-                        if i >= self.retries:
-                            self.fail_on_host(
-                                host,
-                                "SSH Command Exception: {0}"
-                                .format(str(ex)))
-                            time.sleep(2)
+                condition.wait(wait)
+
+        return [outcomes[index] for index in range(len(hosts))]
+
+    def _perform_on_host_safely(self, host, perform_on_host=None):
+        """Perform the validation on a host, returning the failure message
+        or None if the validation passed.
+
+        """
+        try:
+            self._perform_on_host_with_retries(host, perform_on_host)
+        except ValidationFailure as ex:
+            return str(ex.cause)
+        except (Exception, pytest.fail.Exception) as ex:
+            return "[{0}] {1}".format(host, ex)
+        return None
+
+    def _perform_on_host_with_retries(self, host, perform_on_host=None):
+        perform_on_host = perform_on_host or self.perform_on_host
+        for i in range(self.retries + 1):
+            try:
+                with self.connection_pool.borrow(host, self.context) as connection:
+                    perform_on_host(connection)
+                break
+            except paramiko.SSHException as ex:
+                # TODO: Paramiko doesn't surface a separate sort of exception
+                # for timeouts like fabric1 did. This probably needs more logic
+                # to not catch issues that could allow for retrying
+
+                # we connected, so don't retry
+                self.fail_on_host(
+                    host,
+                    "SSH Command timed out: {0}".format(str(ex)))
+            except Exception as ex:
+                if i >= self.retries:
+                    self.fail_on_host(
+                        host,
+                        "SSH Command Exception: {0}"
+                        .format(str(ex)))
+                time.sleep(2)
 
     def fail_on_host(self, host, reason):
         """signal failure the test on a particular host"""
@@ -124,6 +525,7 @@ class SshValidation(Validation):
         """
         if isinstance(expectation, SshCommandExpectation):
             self.expectations.append(expectation)
+            self._identity_changed()
             return self
         else:
             raise ValueError("attempt to add expectation that does not" +
@@ -135,6 +537,7 @@ class SshValidation(Validation):
 
         """
         self._exit_code_expectation = _ExitCodeEquals(self, exit_code)
+        self._identity_changed()
         return self
 
     def expect_output_contains(self, text):
@@ -158,7 +561,16 @@ class SshCommandValidation(SshValidation):
     """
     def __init__(self, ssh_context, name, command, working_directory=None,
                  environment=None, priority=Priority.NORMAL, use_sudo=False,
-                 timeout=None, connection_retries=0, group=None, hosts=None):
+                 timeout=None, connection_retries=0, group=None, hosts=None,
+                 host_concurrency=10, host_timeout=None, share_output=False):
+        """Creates an SshCommandValidation object
+
+        share_output - if True, the command's output is shared with other
+        validations that run the same command on the same host, so the
+        command is only run once. Only use this for commands without side
+        effects.
+
+        """
         SshValidation.__init__(self,
             ssh_context,
             name,
@@ -166,20 +578,36 @@ class SshCommandValidation(SshValidation):
             timeout=timeout,
             connection_retries=connection_retries,
             group=group,
-            hosts=hosts)
+            hosts=hosts,
+            host_concurrency=host_concurrency,
+            host_timeout=host_timeout)
 
         self.command = command
         self.working_directory = working_directory  # Not supported yet
         self.environment = environment or {}        # Not supported yet
         self.use_sudo = use_sudo
+        self.share_output = share_output
         self.expectations = []
 
+    def _identity(self):
+        return SshValidation._identity(self) + [self.command, self.use_sudo]
+
+    def shared_commands(self):
+        if self.share_output:
+            return [(self.command, self.use_sudo)]
+        return []
+
     def perform_on_host(self, connection):
         """Runs the SSH Command on a host and checks to see if all expectations
         are met.
 
         """
-        if self.use_sudo:
+        if self.share_output:
+            output = self.command_cache.run(connection, self.command,
+                                            use_sudo=self.use_sudo,
+                                            err_stream=sys.stdout,
+                                            timeout=self.timeout, warn=True)
+        elif self.use_sudo:
             output = connection.sudo(self.command, err_stream=sys.stdout,
                                      timeout=self.timeout, warn=True)
         else:
@@ -189,6 +617,9 @@ class SshCommandValidation(SshValidation):
         exit_code = output.return_code
         for expectation in self.expectations:
             expectation.validate(self, connection.host, output.stdout, exit_code)
+        #checked separately, so that performing doesn't change expectations
+        self._exit_code_expectation.validate(self, connection.host,
+                                             output.stdout, exit_code)
 
 
 class UpstartServiceValidation(SshCommandValidation):
@@ -217,11 +648,19 @@ class LoadAverageValidation(SshValidation):
     """
 
     def __init__(self, ssh_context, priority=Priority.NORMAL, timeout=None,
-                 group=None, hosts=None):
-        """Creates an SshLoadAverageValidation object"""
+                 group=None, hosts=None, share_output=False):
+        """Creates an SshLoadAverageValidation object
+
+        share_output - if True, the output of uptime is shared with other
+        validations that run it on the same host (see
+        :py:class:`SshCommandValidation`), so the load averages checked may
+        be up to the command cache's `max_age` seconds old.
+
+        """
         SshValidation.__init__(self, ssh_context, "load average",
                                priority=priority, timeout=None, group=group,
                                hosts=hosts)
+        self.share_output = share_output
         # If a limit is None, then there is no limit.
         self.limits = {
             1: {'min': None, 'max': None},
@@ -229,34 +668,50 @@ class LoadAverageValidation(SshValidation):
             15: {'min': None, 'max': None}
         }
 
+    def _identity(self):
+        return SshValidation._identity(self) + [sorted(
+            (minutes, sorted(limits.items()))
+            for minutes, limits in self.limits.items())]
+
+    def shared_commands(self):
+        if self.share_output:
+            return [("uptime", False)]
+        return []
+
     def expect_min_1_minute_load(self, min_load):
         """expect a minimum 1 minute load"""
         self.limits[1]['min'] = min_load
+        self._identity_changed()
         return self
 
     def expect_min_5_minute_load(self, min_load):
         """expect a minimum 5 minute load"""
         self.limits[5]['min'] = min_load
+        self._identity_changed()
         return self
 
     def expect_min_15_minute_load(self, min_load):
         """expect a minimum 15 minute load"""
         self.limits[15]['min'] = min_load
+        self._identity_changed()
         return self
 
     def expect_max_1_minute_load(self, max_load):
         """expect a maximum 1 minute load"""
         self.limits[1]['max'] = max_load
+        self._identity_changed()
         return self
 
     def expect_max_5_minute_load(self, max_load):
         """expect a maximum 5 minute load"""
         self.limits[5]['max'] = max_load
+        self._identity_changed()
         return self
 
     def expect_max_15_minute_load(self, max_load):
         """expect a maximum 15 minute load"""
         self.limits[15]['max'] = max_load
+        self._identity_changed()
         return self
 
     def perform_on_host(self, connection):
@@ -264,7 +719,8 @@ class LoadAverageValidation(SshValidation):
         are met.
 
         """
-        (load_1, load_5, load_15) = SshCommands.get_uptime(connection)
+        cache = self.command_cache if self.share_output else None
+        (load_1, load_5, load_15) = SshCommands.get_uptime(connection, cache)
 
         self.check(connection.host, 1, load_1)
         self.check(connection.host, 5, load_5)
@@ -424,14 +880,25 @@ class SshCommands(object):
         pass
 
     @staticmethod
-    def get_cpu_count(connection):
-        """return the number of processors on the server"""
-        return int(connection.run("grep processor /proc/cpuinfo | wc -l"), warn=True)
+    def get_cpu_count(connection, cache=None):
+        """return the number of processors on the server
+
+        If a :py:class:`SshCommandCache` is given, recent output from it is
+        used rather than running the command again.
+
+        """
+        return int(_run(connection, "grep processor /proc/cpuinfo | wc -l",
+                        cache))
 
     @staticmethod
-    def get_uptime(connection):
-        """return the system uptime"""
-        output = connection.run("uptime", warn=True)
+    def get_uptime(connection, cache=None):
+        """return the system uptime
+
+        If a :py:class:`SshCommandCache` is given, recent output from it is
+        used rather than running the command again.
+
+        """
+        output = _run(connection, "uptime", cache)
         match = UPTIME_REGEX.search(output)
         if match:
             return (float(match.group(1)),
@@ -440,3 +907,9 @@ class SshCommands(object):
         else:
             pytest.fail("Could not get uptime.  Command output was: {0}"
                         .format(output))
+
+
+def _run(connection, command, cache=None):
+    if cache is None:
+        return connection.run(command, warn=True)
+    return cache.run(connection, command, warn=True)
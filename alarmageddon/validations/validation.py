@@ -1,9 +1,28 @@
 """Classes used by all kinds of Validations."""
 
+import hashlib
+
 from .exceptions import EnrichmentFailure, ValidationFailure
 GLOBAL_NAMESPACE = "GLOBAL"
 
 
+def describe_expectations(expectations):
+    """Describe expectations by their type and parameters, for use in a
+    validation's identity.
+
+    References from an expectation back to its validation are left out.
+
+    """
+    descriptions = []
+    for expectation in expectations:
+        params = sorted((name, repr(value))
+                        for name, value in vars(expectation).items()
+                        if not isinstance(value, Validation))
+        descriptions.append("{0}{1}".format(type(expectation).__name__,
+                                            params))
+    return descriptions
+
+
 class Priority(object):
     """Priority levels that indicate how severe a validation failure is.
 
@@ -91,6 +110,14 @@ class Validation(object):
         #most validations have no reason to change this
         self.order = 0
 
+        #how many seconds the :py:class:`~alarmageddon.scheduler.Scheduler`
+        #waits between starting runs of this validation. If None, the
+        #scheduler's default interval is used.
+        self.interval = None
+
+        #cached by fingerprint, and cleared whenever the identity changes
+        self._fingerprint = None
+
     def perform(self, group_failures):
         """Perform the validation.
 
@@ -103,6 +130,26 @@ class Validation(object):
         """
         pass
 
+    @classmethod
+    def prefetch(cls, validations):
+        """Fetch, all at once, data that several validations will need.
+
+        Called before a set of validations is performed, with every
+        validation of this type in the set, so that a type of validation
+        that can get the data for many validations more cheaply together
+        than apart (e.g. in a single request) gets the chance to. This runs
+        in the main Alarmageddon process, before the validations are handed
+        to workers.
+
+        Prefetching is only an optimization: a validation must still work if
+        this hasn't been called, or has failed.
+
+        :param validations: The validations of this type that are about to
+          be performed.
+
+        """
+        pass
+
     def fail(self, reason):
         """Log the validation as a failure.
 
@@ -134,6 +181,47 @@ class Validation(object):
                         Priority.string(self.priority),
                         self.timeout)
 
+    def fingerprint(self):
+        """Return a stable identifier for this validation.
+
+        The fingerprint is the same for every run of the same validation, so
+        it can be used to recognize results of this validation across runs
+        (e.g. by PagerDuty, to avoid paging twice for the same problem).
+        It is computed from the validation's type and :py:meth:`_identity`
+        the first time it is asked for, and computed again only after
+        :py:meth:`_identity_changed` is called, so methods that add
+        expectations or otherwise change the identity must call it.
+
+        """
+        fingerprint = getattr(self, "_fingerprint", None)
+        if fingerprint is None:
+            identity = "\n".join(
+                ["{0}.{1}".format(type(self).__module__,
+                                  type(self).__name__)] +
+                ["{0}".format(part) for part in self._identity()])
+            fingerprint = hashlib.md5(identity.encode("utf-8")).hexdigest()
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def _identity_changed(self):
+        """Forget the cached fingerprint, after the identity has changed."""
+        self._fingerprint = None
+
+    def _identity(self):
+        """Return the parameters that define this validation.
+
+        Two validations of the same type with the same identity are
+        considered to be the same validation. Subclasses with parameters
+        that distinguish them beyond their name should extend this. Only
+        include parameters that are fixed once the validation is set up -
+        not results, timings or anything else that changes when the
+        validation is performed. Expectations and limits should be included
+        (see :py:func:`describe_expectations`), so that different checks of
+        the same thing are told apart.
+
+        """
+        return [self.name, self.group]
+
     def timer_name(self):
         """Return the name of the timer that corresponds to this validation.
 
@@ -237,6 +325,12 @@ class GroupValidation(Validation):
         self.order = order
         self.checked_group = checked_group
 
+    def _identity(self):
+        return Validation._identity(self) + [self.checked_group,
+                                             self.low_threshold,
+                                             self.normal_threshold,
+                                             self.critical_threshold]
+
     def _clean_thresholds(self):
         """Ensure that the thresholds are consistent.
 
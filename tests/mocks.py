@@ -67,6 +67,24 @@ class MockPublisher:
             self.successes += 1
 
 
+class StreamingPublisher(MockPublisher):
+    streams_results = True
+
+    def __init__(self):
+        MockPublisher.__init__(self)
+        self.batches = 0
+        self.first_result_at = None
+
+    def send_batch(self, results):
+        self.batches += 1
+        MockPublisher.send_batch(self, results)
+
+    def send(self, result):
+        if self.first_result_at is None:
+            self.first_result_at = time.time()
+        MockPublisher.send(self, result)
+
+
 class MockReporter(alarmageddon.reporter.Reporter):
     def __init__(self):
         alarmageddon.reporter.Reporter.__init__(self, [])
@@ -0,0 +1,29 @@
+from alarmageddon.publishing.history import HistoryPublisher
+from alarmageddon.result import Failure
+from alarmageddon.result import Success
+from alarmageddon.validations.validation import Validation, Priority
+import pytest
+
+
+def test_requires_directory():
+    with pytest.raises(ValueError):
+        HistoryPublisher(None)
+
+
+def test_repr(tmpdir):
+    pub = HistoryPublisher(str(tmpdir))
+    pub.__repr__()
+
+
+def test_records_successes_and_failures(tmpdir):
+    pub = HistoryPublisher(str(tmpdir))
+    v = Validation("valid", priority=Priority.CRITICAL)
+    pub.send_batch([Success("valid", v), Failure("valid", v, "broken")])
+    assert [r.failed for r in pub.store.scan()] == [False, True]
+
+
+def test_respects_priority_threshold(tmpdir):
+    pub = HistoryPublisher(str(tmpdir), priority_threshold=Priority.CRITICAL)
+    v = Validation("low", priority=Priority.LOW)
+    pub.send(Failure("low", v, "broken"))
+    assert list(pub.store.scan()) == []
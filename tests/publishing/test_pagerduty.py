@@ -178,3 +178,25 @@ def test_environment_name_is_present():
                 "unable to frobnicate bits!"))
 
     assert message.startswith("Failure in %s:" % environment)
+
+
+def test_generate_id_differs_by_ssh_host(tmpdir):
+    pub = PagerDutyPublisher("url", "token")
+    ssh_ctx = ssh.SshContext("ubuntu", ssh_key_file(tmpdir))
+
+    v = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])
+    v2 = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["b"])
+    v3 = ssh.SshCommandValidation(ssh_ctx, "name", "other", hosts=["a"])
+
+    ids = set(pub._generate_id(Failure("bar", valid, "broken"))
+              for valid in (v, v2, v3))
+    assert len(ids) == 3
+
+
+def test_generate_id_ignores_enrichment():
+    pub = PagerDutyPublisher("url", "token")
+    v = Validation("low", priority=Priority.CRITICAL)
+    v2 = Validation("low", priority=Priority.CRITICAL)
+    v2.enrich(pub, {"extra": "data"})
+    assert (pub._generate_id(Failure("bar", v, "broken")) ==
+            pub._generate_id(Failure("bar", v2, "broken")))
@@ -38,3 +38,16 @@ def test_should_publish_low(result):
     pub = publisher.Publisher(priority_threshold=Priority.LOW)
     should = pub._should_publish(result)
     assert should is True
+
+
+def test_only_per_result_publishers_stream_results():
+    from alarmageddon.publishing import emailer, graphite, hipchat, history, \
+        http, junit, pagerduty, slack, teams
+    assert not publisher.Publisher.streams_results
+    for streaming in [emailer.SimpleEmailPublisher, emailer.EmailPublisher,
+                      graphite.GraphitePublisher, history.HistoryPublisher,
+                      http.HttpPublisher, pagerduty.PagerDutyPublisher]:
+        assert streaming.streams_results
+    for batching in [hipchat.HipChatPublisher, junit.JUnitPublisher,
+                     slack.SlackPublisher, teams.TeamsPublisher]:
+        assert not batching.streams_results
@@ -0,0 +1,65 @@
+from alarmageddon.publishing.state import StateChangePublisher
+from alarmageddon.publishing.slack import SlackPublisher
+from alarmageddon.result import Failure
+from alarmageddon.result import Success
+from alarmageddon.validations.validation import Validation, Priority
+from mocks import MockPublisher
+import pytest
+
+
+class BatchPublisher(MockPublisher):
+    def __init__(self):
+        MockPublisher.__init__(self)
+        self.batches = []
+
+    def send_batch(self, results):
+        self.batches.append(results)
+
+
+def test_requires_publisher():
+    with pytest.raises(ValueError):
+        StateChangePublisher(None)
+
+
+def test_repr():
+    pub = StateChangePublisher(SlackPublisher("url", "env"))
+    pub.__repr__()
+
+
+def test_takes_on_wrapped_publisher_settings():
+    slack = SlackPublisher("url", "env", priority_threshold=Priority.CRITICAL)
+    pub = StateChangePublisher(slack)
+    assert pub.name() == "Slack"
+    assert pub.priority_threshold == Priority.CRITICAL
+    assert not pub.streams_results
+    v = Validation("low", priority=Priority.LOW)
+    assert not pub.will_publish(Failure("low", v, "broken"))
+
+
+def test_send_only_passes_on_changes():
+    wrapped = MockPublisher()
+    wrapped.name = lambda: "mock"
+    wrapped.priority_threshold = None
+    wrapped.environment = None
+    wrapped.streams_results = True
+    pub = StateChangePublisher(wrapped)
+    v = Validation("valid")
+    for _ in range(5):
+        pub.send(Failure("valid", v, "broken"))
+    pub.send(Success("valid", v))
+    assert wrapped.failures == 1
+    assert wrapped.successes == 1
+
+
+def test_send_batch_passes_on_changes_together():
+    wrapped = BatchPublisher()
+    wrapped.name = lambda: "mock"
+    wrapped.priority_threshold = None
+    wrapped.environment = None
+    pub = StateChangePublisher(wrapped)
+    a = Validation("a")
+    b = Validation("b")
+    batch = [Failure("a", a, "broken"), Failure("b", b, "broken")]
+    pub.send_batch(batch)
+    pub.send_batch(batch)
+    assert wrapped.batches == [batch]
@@ -0,0 +1,153 @@
+from alarmageddon.validations.validation import Validation, GroupValidation
+import alarmageddon.run as run
+import asyncio
+import pytest
+import time
+from mocks import *
+
+
+def fail(x):
+    raise RuntimeError
+
+
+def slow_success(x):
+    time.sleep(1)
+
+
+class AsyncSuccess(Validation):
+    async def perform(self, group_failures):
+        await asyncio.sleep(0.5)
+
+
+class AsyncFailure(Validation):
+    async def perform(self, group_failures):
+        self.fail("async failure")
+
+
+class AsyncNeverFinish(Validation):
+    def __init__(self, name):
+        Validation.__init__(self, name)
+        self.cancelled = False
+
+    async def perform(self, group_failures):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+
+def construct_failing_validation(name, group=None):
+    valid = Validation(name, group=group)
+    valid.perform = fail
+    return valid
+
+
+def test_run_tests_rejects_unknown_engine():
+    with pytest.raises(ValueError):
+        run.run_tests([Validation("success")], engine="carrier pigeon",
+                      print_banner=False)
+
+
+def test_async_engine_runs_synchronous_validations(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validations = [Validation("success"),
+                   construct_failing_validation("failed")]
+    run._run_validations(validations, reporter, 4, engine="async")
+    assert publishers[0].successes == 1
+    assert publishers[0].failures == 1
+
+
+def test_async_engine_awaits_coroutine_validations(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validations = [AsyncSuccess("success"), AsyncFailure("failed")]
+    run._run_validations(validations, reporter, 4, engine="async")
+    assert publishers[0].successes == 1
+    assert publishers[0].failures == 1
+    failure = [r for r in reporter._reports if r.is_failure()][0]
+    assert "async failure" in failure.description()
+
+
+def test_async_engine_runs_validations_concurrently(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validations = [AsyncSuccess("success") for _ in range(20)]
+    for _ in range(4):
+        validation = Validation("threaded success")
+        validation.perform = slow_success
+        validations.append(validation)
+    start = time.time()
+    run._run_validations(validations, reporter, 30, engine="async")
+    assert time.time() - start < 3
+    assert publishers[0].successes == 24
+
+
+def test_async_engine_cancels_slow_validations(env):
+    timeout = 1
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validation = AsyncNeverFinish("never finishes")
+    run._run_validations([validation], reporter, 1, timeout, engine="async")
+    assert reporter._reports[0].is_failure()
+    assert reporter._reports[0].time == timeout
+    assert validation.cancelled
+
+
+def test_async_engine_respects_groups(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validations = [Validation("success", group="a"),
+                   GroupValidation("group a", "a", low_threshold=2),
+                   construct_failing_validation("failed", group="a"),
+                   construct_failing_validation("failed", group="a")]
+    run._run_validations(validations, reporter, 4, engine="async")
+    assert publishers[0].successes == 1
+    assert publishers[0].failures == 3
+
+
+def test_async_engine_does_not_hold_up_validations_behind_a_hang(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    hang = Validation("hang")
+    hang.runs = 0
+
+    def hanging(group_failures):
+        hang.runs += 1
+        time.sleep(6)
+
+    hang.perform = hanging
+    fast = [Validation("fast{}".format(i)) for i in range(3)]
+    start = time.time()
+    run._run_validations([hang] + fast, reporter, 1, 1, engine="async")
+    assert time.time() - start < 4
+    failures = [r.test_name() for r in reporter._reports if r.is_failure()]
+    assert failures == ["hang"]
+    assert publishers[0].successes == 3
+    #not retried while the first attempt was still running
+    assert hang.runs == 1
+
+
+def test_async_engine_two_hangs_with_two_workers(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    hangs = []
+    for i in range(2):
+        hang = Validation("hang{}".format(i))
+        hang.perform = lambda group_failures: time.sleep(6)
+        hangs.append(hang)
+    fast = [Validation("fast{}".format(i)) for i in range(2)]
+    run._run_validations(hangs + fast, reporter, 2, 1, engine="async")
+    failures = sorted(r.test_name() for r in reporter._reports
+                      if r.is_failure())
+    assert failures == ["hang0", "hang1"]
+    assert publishers[0].successes == 2
@@ -0,0 +1,143 @@
+from alarmageddon.history import HistoryStore, RECORD_SIZE, description_hash
+from alarmageddon.result import Failure
+from alarmageddon.result import Success
+from alarmageddon.validations.validation import Validation, Priority
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = HistoryStore(str(tmpdir.join("history")))
+    yield store
+    store.close()
+
+
+def test_rejects_tiny_segments(tmpdir):
+    with pytest.raises(ValueError):
+        HistoryStore(str(tmpdir), segment_bytes=1)
+
+
+def test_records_round_trip(store):
+    v = Validation("valid", priority=Priority.CRITICAL)
+    store.append(Failure("valid", v, "it broke", time=1.5), timestamp=100)
+    store.append(Success("valid", v), timestamp=101)
+    records = list(store.scan())
+    assert len(records) == 2
+    failure, success = records
+    assert failure.timestamp == 100
+    assert failure.validation_id == v.fingerprint()
+    assert failure.name == "valid"
+    assert failure.priority == Priority.CRITICAL
+    assert failure.failed
+    assert failure.duration == 1.5
+    assert failure.description_hash == description_hash("it broke")
+    assert not success.failed
+    assert success.duration is None
+
+
+def test_records_are_fixed_size(store):
+    v = Validation("valid")
+    for i in range(10):
+        store.append(Failure("valid", v, "x" * 1000), timestamp=i)
+    segment = os.path.join(store.directory, "segment-0000000000.bin")
+    assert os.path.getsize(segment) == 10 * RECORD_SIZE
+
+
+def test_scan_range(store):
+    v = Validation("valid")
+    for i in range(100):
+        store.append(Success("valid", v), timestamp=i)
+    records = list(store.scan(start=10, end=19))
+    assert [r.timestamp for r in records] == list(range(10, 20))
+
+
+def test_scan_by_validation(store):
+    a = Validation("a")
+    b = Validation("b")
+    for i in range(10):
+        store.append(Success("a", a), timestamp=i)
+        store.append(Success("b", b), timestamp=i)
+    assert len(list(store.scan(validation_id=a.fingerprint()))) == 10
+    assert list(store.scan(validation_id="unknown")) == []
+
+
+def test_timestamps_never_go_backwards(store):
+    v = Validation("valid")
+    store.append(Success("valid", v), timestamp=10)
+    store.append(Success("valid", v), timestamp=5)
+    assert [r.timestamp for r in store.scan()] == [10, 10]
+
+
+def test_rotates_segments(tmpdir):
+    store = HistoryStore(str(tmpdir), segment_bytes=RECORD_SIZE * 10,
+                         max_segments=3)
+    v = Validation("valid")
+    for i in range(45):
+        store.append(Success("valid", v), timestamp=i)
+    segments = [name for name in os.listdir(str(tmpdir))
+                if name.startswith("segment-")]
+    assert len(segments) == 3
+    records = list(store.scan())
+    assert [r.timestamp for r in records] == list(range(20, 45))
+    assert [r.timestamp for r in store.scan(start=25, end=32)] == \
+        list(range(25, 33))
+    store.close()
+
+
+def test_reopens_existing_history(tmpdir):
+    v = Validation("valid")
+    store = HistoryStore(str(tmpdir))
+    store.append(Success("valid", v), timestamp=1)
+    store.close()
+    store = HistoryStore(str(tmpdir))
+    store.append(Failure("valid", v, "broken"), timestamp=2)
+    records = list(store.scan())
+    assert [r.failed for r in records] == [False, True]
+    assert all(r.name == "valid" for r in records)
+    store.close()
+
+
+def test_ignores_partially_written_records(tmpdir):
+    v = Validation("valid")
+    store = HistoryStore(str(tmpdir))
+    store.append(Success("valid", v), timestamp=1)
+    store.close()
+    with open(os.path.join(str(tmpdir), "segment-0000000000.bin"), "ab") as f:
+        f.write(b"\1\2\3")
+    store = HistoryStore(str(tmpdir))
+    assert len(list(store.scan())) == 1
+    store.append(Success("valid", v), timestamp=2)
+    assert [r.timestamp for r in store.scan()] == [1, 2]
+    store.close()
+
+
+def test_drops_partially_written_names(tmpdir):
+    store = HistoryStore(str(tmpdir))
+    for name in "ab":
+        store.append(Success(name, Validation(name)), timestamp=1)
+    store.close()
+    #a crash while the next name was being written
+    with open(os.path.join(str(tmpdir), "names.jsonl"), "ab") as f:
+        f.write(b'[2, "c')
+    store = HistoryStore(str(tmpdir))
+    store.append(Success("d", Validation("d")), timestamp=2)
+    store.close()
+    store = HistoryStore(str(tmpdir))
+    store.append(Success("e", Validation("e")), timestamp=3)
+    assert [r.name for r in store.scan()] == ["a", "b", "d", "e"]
+    store.close()
+
+
+def test_reads_names_without_indexes(tmpdir):
+    v = Validation("valid")
+    store = HistoryStore(str(tmpdir))
+    store.append(Success("valid", v), timestamp=1)
+    store.close()
+    with open(os.path.join(str(tmpdir), "names.jsonl"), "w") as f:
+        f.write(json.dumps([v.fingerprint(), "valid"]) + "\n")
+    store = HistoryStore(str(tmpdir))
+    store.append(Success("other", Validation("other")), timestamp=2)
+    assert [r.name for r in store.scan()] == ["valid", "other"]
+    store.close()
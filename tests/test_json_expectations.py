@@ -3,15 +3,18 @@ import _pytest
 from alarmageddon.validations.exceptions import ValidationFailure
 from alarmageddon.validations.json_expectations import ExpectedJsonPredicate,\
     ExpectedJsonEquality, ExpectedJsonValueLessThan,\
-    ExpectedJsonValueGreaterThan, _JsonQuery
+    ExpectedJsonValueGreaterThan, _JsonQuery, find_all
 from alarmageddon.validations.http import HttpValidation
 
 
 class MockResponse:
     def __init__(self, json):
         self.j = json
+        self.parses = 0
+        self.status_code = 200
 
     def json(self):
+        self.parses += 1
         return self.j
 
 
@@ -121,3 +124,57 @@ def test_validate_bad_json():
     exp = ExpectedJsonEquality("path.to.value", 4)
     with pytest.raises(ValidationFailure):
         exp.validate(validation, resp)
+
+
+def test_find_all():
+    json = {"abc": "123", "another": {"nested": "entry", "other": 4},
+            "alpha": {"array": [1, 2, 3, 4]}}
+    found = find_all(json, ["another.nested", "another.other",
+                            "alpha.array[2]", "alpha.array[*]", "alpha",
+                            "missing.path", "abc.def", "alpha.array[9]"])
+    assert found == {"another.nested": "entry",
+                     "another.other": 4,
+                     "alpha.array[2]": 3,
+                     "alpha.array[*]": [1, 2, 3, 4],
+                     "alpha": {"array": [1, 2, 3, 4]},
+                     "missing.path": None,
+                     "abc.def": None,
+                     "alpha.array[9]": None}
+
+
+def test_json_expectations_share_one_parse():
+    resp = MockResponse({"path": {"to": {"value": 1, "other": 5}}})
+    validation = HttpValidation.get("url")\
+        .expect_json_property_value("path.to.value", 1)\
+        .expect_json_property_value_less_than("path.to.other", 6)\
+        .expect_json_property_value_greater_than("path.to.other", 4)
+    validation._check_expectations(resp)
+    assert resp.parses == 1
+
+
+def test_json_expectations_fail_in_order():
+    resp = MockResponse({"path": {"to": {"value": 1, "other": 5}}})
+    validation = HttpValidation.get("url")\
+        .expect_json_property_value("path.to.value", 1)\
+        .expect_json_property_value_less_than("path.to.other", 2)\
+        .expect_json_property_value("path.to.missing", 3)
+    with pytest.raises(ValidationFailure) as excinfo:
+        validation._check_expectations(resp)
+    assert "less than" in str(excinfo.value)
+
+
+class ExpectedJsonLength(ExpectedJsonEquality):
+    """Checks the length of the whole document, rather than a property"""
+    def validate(self, validation, response):
+        if len(response.json()) != self.value:
+            validation.fail("wrong length")
+
+
+def test_overridden_validate_is_called():
+    resp = MockResponse({"path": {"to": {"value": 1}}})
+    validation = HttpValidation.get("url")\
+        .expect_json_property_value("path.to.value", 1)\
+        .add_expectation(ExpectedJsonLength("ignored", 2))
+    with pytest.raises(ValidationFailure) as excinfo:
+        validation._check_expectations(resp)
+    assert "wrong length" in str(excinfo.value)
@@ -1,4 +1,5 @@
 from mocks import *
+import time
 from alarmageddon.result import Success, Failure
 from alarmageddon.reporter import ReportingFailure
 from alarmageddon.publishing.exceptions import PublishFailure
@@ -8,6 +9,9 @@ class FailingPublisher:
     def send_batch(self, results):
         raise PublishFailure("publisher","NOT_HIDDEN")
 
+    def send(self, result):
+        raise PublishFailure("publisher","NOT_HIDDEN")
+
 
 def test_repr(env):
     reporter = env["reporter"]
@@ -84,3 +88,116 @@ def test_reporter_shows_publish_error_info(env):
         reporter.report()
     except ReportingFailure as e:
         assert "NOT_HIDDEN" in str(e) 
+
+
+class SlowPublisher(MockPublisher):
+    def __init__(self, delay):
+        MockPublisher.__init__(self)
+        self.delay = delay
+
+    def send_batch(self, results):
+        time.sleep(self.delay)
+        MockPublisher.send_batch(self, results)
+
+
+class BrokenPublisher:
+    def send_batch(self, results):
+        raise RuntimeError("broken")
+
+
+def test_reporter_publishes_concurrently(env):
+    reporter = env["reporter"]
+    publishers = [SlowPublisher(1) for i in range(5)]
+    reporter.publishers = publishers
+    reporter.collect(Success("success", Validation("valid")))
+    start = time.time()
+    reporter.report()
+    assert time.time() - start < 3
+    for pub in publishers:
+        assert pub.successes == 1
+
+
+def test_reporter_records_publish_times(env):
+    reporter = env["reporter"]
+    slow = SlowPublisher(0.5)
+    fast = MockPublisher()
+    reporter.publishers = [slow, fast]
+    reporter.collect(Success("success", Validation("valid")))
+    reporter.report()
+    assert reporter.publish_times[slow] >= 0.5
+    assert reporter.publish_times[fast] < 0.5
+
+
+def test_reporter_fails_publishers_that_exceed_timeout(env):
+    reporter = alarmageddon.reporter.Reporter([], publish_timeout=0.5)
+    slow = SlowPublisher(3)
+    fast = MockPublisher()
+    reporter.publishers = [slow, fast]
+    reporter.collect(Success("success", Validation("valid")))
+    start = time.time()
+    with pytest.raises(ReportingFailure) as excinfo:
+        reporter.report()
+    assert time.time() - start < 2
+    assert len(excinfo.value.failures) == 1
+    assert excinfo.value.failures[0].publisher() is slow
+    assert fast.successes == 1
+
+
+def test_reporter_raises_unexpected_errors_after_publishing(env):
+    reporter = env["reporter"]
+    publishers = [BrokenPublisher(), MockPublisher()]
+    reporter.publishers = publishers
+    reporter.collect(Success("success", Validation("valid")))
+    with pytest.raises(RuntimeError):
+        reporter.report()
+    assert publishers[1].successes == 1
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_streaming_reporter_sends_results_when_collected():
+    streaming = StreamingPublisher()
+    batch = MockPublisher()
+    reporter = alarmageddon.reporter.Reporter([streaming, batch], stream=True)
+    reporter.collect(Failure("failure", Validation("valid"), "failed"))
+    assert wait_for(lambda: streaming.failures == 1)
+    assert batch.failures == 0
+    reporter.report()
+    assert streaming.failures == 1
+    assert streaming.batches == 0
+    assert batch.failures == 1
+
+
+def test_streaming_reporter_does_not_stream_batch_only_publishers():
+    streaming = StreamingPublisher()
+    streaming.streams_results = False
+    reporter = alarmageddon.reporter.Reporter([streaming], stream=True)
+    reporter.collect(Success("success", Validation("valid")))
+    time.sleep(0.1)
+    assert streaming.successes == 0
+    reporter.report()
+    assert streaming.batches == 1
+    assert streaming.successes == 1
+
+
+def test_streaming_reporter_with_no_results():
+    streaming = StreamingPublisher()
+    reporter = alarmageddon.reporter.Reporter([streaming], stream=True)
+    reporter.report()
+    assert streaming.batches == 0
+
+
+def test_streaming_reporter_reports_stream_failures():
+    publisher = FailingPublisher()
+    publisher.streams_results = True
+    reporter = alarmageddon.reporter.Reporter([publisher], stream=True)
+    reporter.collect(Success("success", Validation("valid")))
+    reporter.collect(Success("success", Validation("valid")))
+    with pytest.raises(ReportingFailure) as excinfo:
+        reporter.report()
+    assert len(excinfo.value.failures) == 2
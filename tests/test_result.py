@@ -1,3 +1,5 @@
+import gc
+import weakref
 from alarmageddon.result import Failure, Success
 from alarmageddon.validations.validation import Validation, Priority
 
@@ -39,3 +41,77 @@ def test_result_repr_works():
     v = Validation("low", priority=Priority.LOW)
     s = ValidResult("name", v, description="desc")
     s.__repr__()
+
+
+def test_results_have_no_instance_dict():
+    v = Validation("low", priority=Priority.LOW)
+    assert not hasattr(Failure("name", v, "desc"), "__dict__")
+    assert not hasattr(Success("name", v), "__dict__")
+
+
+def test_result_carries_stable_validation_id():
+    first = Failure("name", Validation("low", priority=Priority.LOW), "desc")
+    second = Success("name", Validation("low", priority=Priority.NORMAL))
+    other = Success("name", Validation("high", priority=Priority.LOW))
+    assert first.validation_id == second.validation_id
+    assert first.validation_id != other.validation_id
+
+
+def test_result_string_is_built_once():
+    v = Validation("low", priority=Priority.LOW)
+    s = ValidResult("name", v, description="desc")
+    assert str(s) is str(s)
+
+
+def test_result_string_reflects_changed_priority():
+    v = Validation("low", priority=Priority.LOW)
+    f = Failure("name", v, "desc")
+    str(f)
+    f.priority = Priority.CRITICAL
+    assert "Priority: {}".format(Priority.CRITICAL) in str(f)
+
+
+class TimedValidation(Validation):
+    def __init__(self, name):
+        Validation.__init__(self, name)
+        self.timer_calls = 0
+
+    def timer_name(self):
+        self.timer_calls += 1
+        return "timer"
+
+
+def test_timer_name_is_computed_lazily():
+    v = TimedValidation("timed")
+    s = Success("name", v)
+    assert v.timer_calls == 0
+    assert s.timer_name == "timer"
+    assert s.timer_name == "timer"
+    assert v.timer_calls == 1
+
+
+def test_result_looks_up_its_validation():
+    v = Validation("low", priority=Priority.LOW, group="group")
+    f = Failure("name", v, "desc")
+    assert f.validation is v
+    assert f.group == "group"
+
+
+def test_results_of_validations_sharing_an_id_keep_their_own():
+    low = Validation("same", priority=Priority.LOW)
+    critical = Validation("same", priority=Priority.CRITICAL)
+    low_result = Failure("name", low, "desc")
+    critical_result = Failure("name", critical, "desc")
+    assert low_result.validation is low
+    assert critical_result.validation is critical
+
+
+def test_result_does_not_keep_its_validation_alive():
+    v = Validation("gone", priority=Priority.LOW)
+    s = Success("name", v)
+    ref = weakref.ref(v)
+    del v
+    gc.collect()
+    assert ref() is None
+    assert s.validation is None
+    assert s.timer_name is None
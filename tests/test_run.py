@@ -5,6 +5,7 @@ from alarmageddon.publishing.publisher import Publisher
 import alarmageddon.run as run
 import pytest
 import time
+import os
 from mocks import *
 
 
@@ -44,6 +45,10 @@ def test_run_works_with_config():
                   config_path="path", environment_name="stg")
 
 
+def test_run_tests_defaults_to_process_engine():
+    assert run._default_engine([Validation("valid")]) == "process"
+
+
 def test_run_errors_without_valiations():
     with pytest.raises(ValueError):
         run.run_tests([], config="config")
@@ -201,3 +206,113 @@ def test_run_validations_fails_on_slow_success(env, processes):
     validation.timeout = 1
     run._run_validations([validation], reporter, processes)
     assert reporter._reports[0].is_failure()
+
+def test_run_validations_runs_order_tier_concurrently(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validations = []
+    for i in range(4):
+        validation = Validation("success")
+        validation.perform = slow_success
+        validations.append(validation)
+    start = time.time()
+    run._run_validations(validations, reporter, 4)
+    assert time.time() - start < 6
+    assert publishers[0].successes == 4
+
+def test_run_validations_retries_each_timeout_independently(env):
+    timeout = 1
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    slow = NeverFinish("never finishes")
+    fast = Validation("success")
+    run._run_validations([slow, fast], reporter, 2, timeout, 2)
+    results = dict((r.test_name(), r) for r in reporter._reports)
+    assert results["never finishes"].is_failure()
+    assert results["never finishes"].time == timeout
+    assert not results["success"].is_failure()
+
+def die(x):
+    os._exit(3)
+
+
+def test_run_validations_reports_workers_that_die(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validation = Validation("dies")
+    validation.perform = die
+    run._run_validations([validation], reporter, 1)
+    assert reporter._reports[0].is_failure()
+    assert "exit code 3" in reporter._reports[0].description()
+
+
+def test_run_validations_keeps_priority_set_while_performing(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validations = [construct_failing_validation("failed", group="a"),
+                   GroupValidation("group a", "a", low_threshold=1,
+                                   critical_threshold=1)]
+    run._run_validations(validations, reporter, 1)
+    group_result = [r for r in reporter._reports
+                    if r.test_name() == "group a"][0]
+    assert group_result.is_failure()
+    assert group_result.priority == Priority.CRITICAL
+    assert group_result.validation is validations[1]
+
+
+def fail_with_large_description(x):
+    raise RuntimeError("x" * 1000000)
+
+
+def test_run_validations_sends_large_descriptions(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    validation = Validation("large")
+    validation.perform = fail_with_large_description
+    run._run_validations([validation], reporter, 1, 5)
+    assert len(reporter._reports[0].description()) == 1000000
+
+
+@pytest.mark.parametrize("engine", run.ENGINES)
+def test_run_validations_streams_results_as_they_finish(engine):
+    publisher = StreamingPublisher()
+    reporter = alarmageddon.reporter.Reporter([publisher], stream=True)
+    slow = Validation("slow")
+    slow.perform = slow_success
+    fast = Validation("fast")
+    start = time.time()
+    run._run_validations([slow, fast], reporter, 2, engine=engine)
+    assert publisher.first_result_at - start < 1.5
+    assert publisher.successes == 2
+
+
+class PrefetchingValidation(Validation):
+    prefetched = []
+
+    @classmethod
+    def prefetch(cls, validations):
+        cls.prefetched.append([v.name for v in validations])
+
+
+class FailingPrefetchValidation(Validation):
+    @classmethod
+    def prefetch(cls, validations):
+        raise RuntimeError("prefetch failed")
+
+
+def test_run_validations_prefetches_each_order_set(env):
+    reporter = env["reporter"]
+    publishers = [MockPublisher()]
+    reporter.publishers = publishers
+    PrefetchingValidation.prefetched = []
+    validations = [PrefetchingValidation("a"), PrefetchingValidation("b"),
+                   Validation("c"), FailingPrefetchValidation("d")]
+    validations[1].order = 1
+    run._run_validations(validations, reporter, 2)
+    assert PrefetchingValidation.prefetched == [["a"], ["b"]]
+    assert publishers[0].successes == 4
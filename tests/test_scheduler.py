@@ -0,0 +1,213 @@
+from alarmageddon.validations.validation import\
+    Validation, GroupValidation, Priority
+from alarmageddon.scheduler import Scheduler, AdaptiveIntervals
+from alarmageddon.result import Success, Failure
+import threading
+import pytest
+import time
+from mocks import *
+
+
+class CountingValidation(Validation):
+    def __init__(self, name, interval=None, group=None, sleep=0, fail=False):
+        Validation.__init__(self, name, group=group)
+        self.interval = interval
+        self.runs = 0
+        self.sleep = sleep
+        self.should_fail = fail
+
+    def perform(self, group_failures):
+        self.runs += 1
+        time.sleep(self.sleep)
+        if self.should_fail:
+            self.fail("failed")
+
+
+def test_scheduler_requires_validations():
+    with pytest.raises(ValueError):
+        Scheduler([])
+
+
+def test_scheduler_rejects_validations_sharing_a_fingerprint():
+    with pytest.raises(ValueError):
+        Scheduler([CountingValidation("same"), CountingValidation("same")])
+
+
+def test_scheduler_repeats_validations_on_their_interval():
+    fast = CountingValidation("fast", interval=0.1)
+    slow = CountingValidation("slow", interval=10)
+    Scheduler([fast, slow]).run(duration=1)
+    assert 8 <= fast.runs <= 12
+    assert slow.runs == 1
+
+
+def test_scheduler_uses_default_interval():
+    validation = CountingValidation("default")
+    Scheduler([validation], default_interval=0.2).run(duration=1)
+    assert 4 <= validation.runs <= 6
+
+
+def test_scheduler_streams_and_flushes_results():
+    streaming = StreamingPublisher()
+    batch = MockPublisher()
+    validation = CountingValidation("validation", interval=0.1, fail=True)
+    scheduler = Scheduler([validation], [streaming, batch],
+                          flush_interval=0.5)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.3)
+    assert streaming.failures >= 2
+    assert batch.failures == 0
+    time.sleep(0.4)
+    assert batch.failures >= 4
+    scheduler.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert batch.failures == streaming.failures
+
+
+def test_scheduler_reports_validations_that_exceed_timeout():
+    publisher = StreamingPublisher()
+    validation = CountingValidation("slow", interval=0.1, sleep=1)
+    Scheduler([validation], [publisher], timeout=0.2).run(duration=0.5)
+    assert publisher.failures == 1
+    assert publisher.successes == 0
+    assert validation.runs == 1
+
+
+def test_scheduler_replaces_workers_stuck_on_timed_out_validations():
+    release = threading.Event()
+    hung = [CountingValidation(str(i), interval=10) for i in range(2)]
+    for validation in hung:
+        validation.perform = lambda group_failures: release.wait(5)
+    healthy = CountingValidation("healthy", interval=0.1)
+    #the hung validations are listed first, so they take both workers
+    scheduler = Scheduler(hung + [healthy], workers=2, timeout=0.2)
+    try:
+        scheduler.run(duration=1)
+    finally:
+        release.set()
+    assert healthy.runs >= 5
+
+
+def test_scheduler_prefetches_validations_due_together():
+    batches = []
+
+    class Prefetched(CountingValidation):
+        @classmethod
+        def prefetch(cls, validations):
+            batches.append(sorted(v.name for v in validations))
+
+    validations = [Prefetched(str(i), interval=10) for i in range(3)]
+    Scheduler(validations, workers=3).run(duration=0.3)
+    assert batches == [["0", "1", "2"]]
+    assert all(v.runs == 1 for v in validations)
+
+
+class HangingPublisher(MockPublisher):
+    def __init__(self):
+        MockPublisher.__init__(self)
+        self.release = threading.Event()
+
+    def send_batch(self, results):
+        self.release.wait(5)
+        MockPublisher.send_batch(self, results)
+
+
+def test_scheduler_keeps_running_while_publishing():
+    publisher = HangingPublisher()
+    validation = CountingValidation("validation", interval=0.1)
+    scheduler = Scheduler([validation], [publisher], flush_interval=0.1)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(1)
+    assert validation.runs >= 8
+    scheduler.stop()
+    publisher.release.set()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert publisher.successes == validation.runs
+
+
+def test_scheduler_group_validation_sees_latest_failures():
+    publisher = StreamingPublisher()
+    failing = CountingValidation("failing", interval=0.1, group="a",
+                                 fail=True)
+    group = GroupValidation("group a", "a", low_threshold=1)
+    group.interval = 0.1
+    Scheduler([failing, group], [publisher]).run(duration=0.55)
+    assert failing.runs >= 4
+    #the group validation fails once it has seen a failure
+    assert publisher.failures > failing.runs
+
+
+def test_scheduler_runs_validations_concurrently():
+    validations = [CountingValidation(str(i), interval=10, sleep=0.5)
+                   for i in range(4)]
+    start = time.time()
+    Scheduler(validations, workers=4).run(duration=0.8)
+    assert time.time() - start < 1.5
+    assert all(v.runs == 1 for v in validations)
+
+
+def observe(adaptive, validation, *outcomes):
+    for failed in outcomes:
+        if failed:
+            adaptive.observe(Failure(validation.name, validation, "failed"))
+        else:
+            adaptive.observe(Success(validation.name, validation))
+
+
+def test_adaptive_intervals_back_off_while_passing():
+    adaptive = AdaptiveIntervals(backoff=2, backoff_after=2)
+    validation = Validation("valid")
+    observe(adaptive, validation, False, False)
+    assert adaptive.interval(validation, 20) == 20
+    observe(adaptive, validation, False)
+    assert adaptive.interval(validation, 20) == 40
+    observe(adaptive, validation, *([False] * 100))
+    assert adaptive.interval(validation, 20) == 300
+
+
+def test_adaptive_intervals_recheck_failures_quickly():
+    adaptive = AdaptiveIntervals()
+    validation = Validation("valid", priority=Priority.CRITICAL)
+    observe(adaptive, validation, *([False] * 10))
+    assert adaptive.interval(validation, 30) == 60
+    observe(adaptive, validation, True)
+    assert adaptive.interval(validation, 30) == 5
+    #rechecked quickly once more to confirm that it recovered
+    observe(adaptive, validation, False)
+    assert adaptive.interval(validation, 30) == 5
+    observe(adaptive, validation, False)
+    assert adaptive.interval(validation, 30) == 30
+
+
+def test_adaptive_intervals_use_priority_bands():
+    adaptive = AdaptiveIntervals(bands={Priority.LOW: (100, 200)})
+    validation = Validation("valid", priority=Priority.LOW)
+    observe(adaptive, validation, False)
+    assert adaptive.interval(validation, 10) == 100
+    assert adaptive.bands[Priority.CRITICAL] == (5, 60)
+
+
+def test_adaptive_intervals_reject_shrinking_backoff():
+    with pytest.raises(ValueError):
+        AdaptiveIntervals(backoff=0.5)
+
+
+def test_scheduler_rechecks_failures_with_adaptive_intervals():
+    failing = CountingValidation("failing", interval=10, fail=True)
+    adaptive = AdaptiveIntervals(bands={Priority.NORMAL: (0.1, 10)})
+    Scheduler([failing], adaptive=adaptive).run(duration=1)
+    assert failing.runs >= 8
+
+
+def test_scheduler_jitters_first_starts():
+    validations = [CountingValidation(str(i), interval=10) for i in range(20)]
+    starts = []
+    for validation in validations:
+        validation.perform = lambda group_failures: starts.append(time.time())
+    Scheduler(validations, workers=20, jitter=0.05).run(duration=0.7)
+    assert len(starts) == 20
+    assert max(starts) - min(starts) > 0.1
@@ -0,0 +1,78 @@
+from alarmageddon.state import StateTracker
+from alarmageddon.history import HistoryStore
+from alarmageddon.result import Failure
+from alarmageddon.result import Success
+from alarmageddon.validations.validation import Validation
+import pytest
+
+
+def result(validation, failed):
+    if failed:
+        return Failure(validation.name, validation, "broken")
+    return Success(validation.name, validation)
+
+
+def publishes(tracker, validation, *outcomes):
+    return [tracker.should_publish(result(validation, failed), now=now)
+            for now, failed in outcomes]
+
+
+def test_rejects_low_flap_threshold():
+    with pytest.raises(ValueError):
+        StateTracker(flap_threshold=1)
+
+
+def test_only_publishes_changes():
+    tracker = StateTracker()
+    v = Validation("valid")
+    assert publishes(tracker, v, (0, False), (1, True), (2, True),
+                     (3, False), (4, False)) == \
+        [False, True, False, True, False]
+
+
+def test_tells_validations_apart():
+    tracker = StateTracker()
+    a = Validation("a")
+    b = Validation("b")
+    assert publishes(tracker, a, (0, True)) == [True]
+    assert publishes(tracker, b, (0, True)) == [True]
+    #the same validation, constructed again
+    assert publishes(tracker, Validation("a"), (1, True)) == [False]
+
+
+def test_sends_digests_of_ongoing_failures():
+    tracker = StateTracker(digest_interval=10)
+    v = Validation("valid")
+    assert publishes(tracker, v, (0, True), (5, True), (10, True),
+                     (15, True), (21, True), (22, False)) == \
+        [True, False, True, False, True, True]
+
+
+def test_suppresses_flapping_validations():
+    tracker = StateTracker(flap_window=100, flap_threshold=3)
+    v = Validation("valid")
+    assert publishes(tracker, v, (0, True), (1, False), (2, True),
+                     (3, False)) == [True, True, False, False]
+    assert tracker.is_flapping(v.fingerprint(), now=3)
+    #still flapping, then settles as failing once the changes age out
+    assert publishes(tracker, v, (4, True), (50, True), (150, True)) == \
+        [False, False, True]
+    assert not tracker.is_flapping(v.fingerprint(), now=150)
+
+
+def test_settled_state_is_not_republished():
+    tracker = StateTracker(flap_window=100, flap_threshold=3)
+    v = Validation("valid")
+    publishes(tracker, v, (0, True), (1, False), (2, True), (3, False))
+    #last published state was passing, and it settled as passing
+    assert publishes(tracker, v, (200, False)) == [False]
+
+
+def test_learns_state_from_history(tmpdir):
+    store = HistoryStore(str(tmpdir))
+    v = Validation("valid")
+    store.append(result(v, True))
+    tracker = StateTracker(history=store)
+    assert publishes(tracker, v, (None, True)) == [False]
+    assert publishes(tracker, v, (None, False)) == [True]
+    store.close()
@@ -7,12 +7,18 @@ from alarmageddon.validations.cassandra import State
 
 from alarmageddon.validations.exceptions import ValidationFailure
 import pytest
+import time
 from validation_mocks import get_mock_key_file, get_mock_ssh_text
 from fabric import Connection
 
 _CLUSTER_NAME='finance dept'
 
 
+@pytest.fixture(autouse=True)
+def clear_command_cache():
+    ssh.DEFAULT_COMMAND_CACHE.clear()
+
+
 HEALTHY_OUTPUT = """xss =  -ea -javaagent:/usr/share/cassandra/lib/jamm-0.2.5.jar -XX:+UseThreadPriorities -XX:ThreadPriorityPolicy=42 -Xms10240m -Xmx10240m -Xmn2048m -XX:+HeapDumpOnOutOfMemoryError -Xss256k
 Note: Ownership information does not include topology; for complete information, specify a keyspace
 Datacenter: us-east
@@ -455,3 +461,190 @@ def test_str(monkeypatch, tmpdir):
 
     str(cassandra.CassandraStatusValidation(ssh_ctx, hosts=["127.0.0.1"],
                                             cluster_name=_CLUSTER_NAME))
+
+
+SEPARATED_DATACENTERS_OUTPUT = """Datacenter: use1b
+=================
+Status=Up/Down
+|/ State=Normal/Leaving/Joining/Moving
+--  Address        Load       Tokens  Owns   Host ID                               Rack
+UN  10.168.252.216 244.65 MB  256     14.9%  0586776f-b4c2-4edc-8b67-afd02489a308  use1b-r
+UN  10.168.252.68  248.72 MB  256     18.8%  234c7abe-26e2-4d85-9e2f-7cf6b8f0bb33  use1b-r
+
+Datacenter: use1c
+=================
+Status=Up/Down
+|/ State=Normal/Leaving/Joining/Moving
+--  Address        Load       Tokens  Owns   Host ID                               Rack
+UN  10.168.253.83  249.26 MB  256     17.7%  570597ff-9ac0-41e5-9ee2-2e1fa27d75e6  use1c-r
+DN  10.168.253.50  244.58 MB  256     16.2%  f441bd1a-1227-488c-9e06-7f4ae476787b  use1c-r
+
+Note: Non-system keyspaces don't have the same replication settings, effective ownership information is meaningless
+"""
+
+
+def test_can_parse_separated_datacenters():
+    parser = cassandra.NodetoolStatusParser()
+    nodes = parser.parse(SEPARATED_DATACENTERS_OUTPUT)
+    assert [node.datacenter for node in nodes] == \
+        ["use1b", "use1b", "use1c", "use1c"]
+    assert nodes[3].ip_address == "10.168.253.50"
+    assert nodes[3].status == Status.DOWN
+    assert nodes[3].rack == "use1c-r"
+
+
+def test_iter_nodes_streams_nodes():
+    parser = cassandra.NodetoolStatusParser()
+    nodes = parser.iter_nodes(MULTI_DATACENTER_OUTPUT)
+    first = next(nodes)
+    assert first.ip_address == "10.168.252.216"
+    assert first.datacenter == "use1b"
+    assert first.owns == 14.9
+    assert len(list(nodes)) == 5
+
+
+def test_can_parse_windows_line_endings():
+    parser = cassandra.NodetoolStatusParser()
+    nodes = parser.parse(HEALTHY_OUTPUT.replace("\n", "\r\n"))
+    assert len(nodes) == 5
+    assert nodes[0].rack == "1c"
+
+
+def test_node_str_without_tokens():
+    parser = cassandra.NodetoolStatusParser()
+    node = parser.parse(OUTPUT_MISSING_TOKENS)[0]
+    assert "Tokens: None" in str(node)
+
+
+def test_cassandra_checks_every_datacenter(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    monkeypatch.setattr(Connection, "run",
+                        lambda self, x, warn: get_mock_ssh_text(
+                            SEPARATED_DATACENTERS_OUTPUT, 0))
+
+    with pytest.raises(ValidationFailure) as excinfo:
+        (cassandra.CassandraStatusValidation(ssh_ctx, hosts=["127.0.0.1"],
+                                             number_nodes=4,
+                                             cluster_name=_CLUSTER_NAME)
+         .perform({}))
+    assert "10.168.253.50" in str(excinfo.value)
+
+
+def mock_ring_views(monkeypatch, views):
+    commands = []
+
+    def run(self, command, warn):
+        commands.append(self.host)
+        if views[self.host] is None:
+            raise Exception("Could not connect")
+        return get_mock_ssh_text(views[self.host], 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    return commands
+
+
+def test_quorum_queries_only_a_quorum_of_hosts(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    hosts = ["127.0.0.{}".format(i) for i in range(1, 6)]
+    commands = mock_ring_views(monkeypatch,
+                               dict((host, HEALTHY_OUTPUT) for host in hosts))
+    (cassandra.CassandraStatusValidation(ssh_ctx, hosts=hosts, quorum=2,
+                                         cluster_name=_CLUSTER_NAME)
+     .perform({}))
+    assert sorted(commands) == hosts[:2]
+
+
+def test_quorum_skips_unreachable_hosts(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    commands = mock_ring_views(monkeypatch, {"127.0.0.1": None,
+                                             "127.0.0.2": HEALTHY_OUTPUT,
+                                             "127.0.0.3": HEALTHY_OUTPUT})
+    (cassandra.CassandraStatusValidation(
+        ssh_ctx, hosts=["127.0.0.1", "127.0.0.2", "127.0.0.3"], quorum=2,
+        cluster_name=_CLUSTER_NAME)
+     .perform({}))
+    assert sorted(commands) == ["127.0.0.1", "127.0.0.2", "127.0.0.3"]
+
+
+def test_quorum_fails_without_enough_views(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    mock_ring_views(monkeypatch, {"127.0.0.1": None,
+                                  "127.0.0.2": HEALTHY_OUTPUT})
+    with pytest.raises(ValidationFailure) as excinfo:
+        (cassandra.CassandraStatusValidation(
+            ssh_ctx, hosts=["127.0.0.1", "127.0.0.2"], quorum=2,
+            cluster_name=_CLUSTER_NAME)
+         .perform({}))
+    assert "Only 1 of 2 hosts" in str(excinfo.value)
+    assert "Could not connect" in str(excinfo.value)
+
+
+def test_quorum_detects_disagreement(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    down = HEALTHY_OUTPUT.replace("UN  10.168.4.72", "DN  10.168.4.72")
+    mock_ring_views(monkeypatch, {"127.0.0.1": HEALTHY_OUTPUT,
+                                  "127.0.0.2": down})
+    with pytest.raises(ValidationFailure) as excinfo:
+        (cassandra.CassandraStatusValidation(
+            ssh_ctx, hosts=["127.0.0.1", "127.0.0.2"], quorum=2,
+            cluster_name=_CLUSTER_NAME)
+         .perform({}))
+    message = str(excinfo.value)
+    assert "disagree about node" in message
+    assert "127.0.0.1 sees Up/Normal, 127.0.0.2 sees Down/Normal" in message
+
+
+def test_quorum_reports_each_problem_once(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    hosts = ["127.0.0.1", "127.0.0.2", "127.0.0.3"]
+    mock_ring_views(monkeypatch,
+                    dict((host, UNBALANCED_RING_OUTPUT) for host in hosts))
+    with pytest.raises(ValidationFailure) as excinfo:
+        (cassandra.CassandraStatusValidation(ssh_ctx, hosts=hosts, quorum=3,
+                                             cluster_name=_CLUSTER_NAME)
+         .perform({}))
+    assert str(excinfo.value).count("10.168.7.208") == 1
+
+
+def test_quorum_must_be_positive(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    with pytest.raises(ValueError):
+        cassandra.CassandraStatusValidation(ssh_ctx, hosts=["127.0.0.1"],
+                                            quorum=0)
+
+
+def test_quorum_hosts_are_asked_concurrently(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+
+    def run(self, command, warn):
+        time.sleep(1)
+        return get_mock_ssh_text(HEALTHY_OUTPUT, 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    hosts = ["127.0.0.1", "127.0.0.2", "127.0.0.3"]
+    start = time.time()
+    (cassandra.CassandraStatusValidation(ssh_ctx, hosts=hosts, quorum=3,
+                                         cluster_name=_CLUSTER_NAME)
+     .perform({}))
+    assert time.time() - start < 2.5
+
+
+def test_quorum_retries_hosts(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    attempts = []
+
+    def flaky_run(self, command, warn):
+        attempts.append(self.host)
+        if len(attempts) == 1:
+            raise Exception("Connection reset")
+        return get_mock_ssh_text(HEALTHY_OUTPUT, 0)
+
+    sleeps = []
+    monkeypatch.setattr(Connection, "run", flaky_run)
+    monkeypatch.setattr(ssh.time, "sleep", sleeps.append)
+    validation = cassandra.CassandraStatusValidation(
+        ssh_ctx, hosts=["127.0.0.1"], quorum=1, cluster_name=_CLUSTER_NAME)
+    validation.retries = 1
+    validation.perform({})
+    assert attempts == ["127.0.0.1", "127.0.0.1"]
+    assert sleeps == [2]
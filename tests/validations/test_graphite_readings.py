@@ -0,0 +1,62 @@
+import pytest
+import alarmageddon.validations.graphite_readings as graphite_readings
+from alarmageddon.validations.graphite_readings import Readings
+
+
+@pytest.fixture(params=["numpy", "python"], autouse=True)
+def implementation(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(graphite_readings, "numpy", None)
+    return request.param
+
+
+def test_behaves_like_a_list():
+    readings = Readings([1, None, 3.5])
+    assert len(readings) == 3
+    assert list(readings) == [1.0, None, 3.5]
+    assert readings[1] is None
+    assert readings[-1] == 3.5
+    assert readings[1:] == [None, 3.5]
+    assert readings == [1, None, 3.5]
+    assert readings != [1, 2, 3.5]
+
+
+def test_parse():
+    readings = Readings.parse("None,10,None,30.5")
+    assert readings == [None, 10, None, 30.5]
+    assert Readings.parse("") == []
+
+
+def test_parse_rejects_garbage():
+    with pytest.raises(ValueError):
+        Readings.parse("1,two,3")
+
+
+def test_count():
+    assert Readings([None, 1, None, 2]).count() == 2
+    assert Readings([None]).count() == 0
+
+
+def test_bounds():
+    readings = Readings([None, 10, 20, 30, None])
+    assert readings.at_least(20) == [20, 30]
+    assert readings.at_most(20) == [10, 20]
+    assert readings.at_least(100) == []
+
+
+def test_mean():
+    assert Readings([None, 10, 20, None]).mean() == 15
+    assert Readings([None, None]).mean() is None
+
+
+def test_percentile():
+    readings = Readings([None] + list(range(1, 101)))
+    assert readings.percentile(0) == 1
+    assert readings.percentile(50) == 50.5
+    assert readings.percentile(100) == 100
+    assert abs(readings.percentile(95) - 95.05) < 1e-9
+    assert Readings([None]).percentile(50) is None
+    with pytest.raises(ValueError):
+        readings.percentile(101)
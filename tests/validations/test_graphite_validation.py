@@ -1,7 +1,14 @@
 import pytest
 from alarmageddon.validations.exceptions import ValidationFailure
 from alarmageddon.validations.graphite import GraphiteContext,\
-    GraphiteValidation
+    GraphiteValidation, GraphiteReadingsCache, DEFAULT_READINGS_CACHE
+from alarmageddon.validations.graphite_expectations import _percentile
+from alarmageddon.validations.graphite_readings import Readings
+
+
+@pytest.fixture(autouse=True)
+def clear_readings_cache():
+    DEFAULT_READINGS_CACHE.clear()
 
 
 def establishServer(httpserver, counts):
@@ -112,3 +119,256 @@ def test_average_in_range(httpserver):
                        "ParticipationIndex.404-Not-Found-count.count") \
         .expect_average_in_range(0, 500) \
         .perform({})
+
+
+class FakeGraphite(object):
+    """Serves readings of one reading per 10s, one per second of time."""
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.now = 0
+        self.requests = []
+
+    def fetch(self, since):
+        self.requests.append(since)
+        start = 0 if since is None else since
+        start = max(start, self.now - 3600)
+        start -= start % 10
+        return start, 10, self.readings[start // 10:self.now // 10]
+
+
+def test_cache_fetches_only_new_readings():
+    graphite = FakeGraphite(list(range(1000)))
+    cache = GraphiteReadingsCache(overlap=2)
+    graphite.now = 3600
+    assert cache.readings("host", "metric", 3600, graphite.fetch) == \
+        list(range(360))
+    graphite.now = 3660
+    assert cache.readings("host", "metric", 3600, graphite.fetch) == \
+        list(range(6, 366))
+    assert graphite.requests == [None, 3580]
+
+
+def test_cache_shares_metrics_between_time_ranges():
+    graphite = FakeGraphite(list(range(1000)))
+    cache = GraphiteReadingsCache()
+    graphite.now = 3600
+    cache.readings("host", "metric", 3600, graphite.fetch)
+    assert cache.readings("host", "metric", 60, graphite.fetch) == \
+        list(range(354, 360))
+    assert cache.readings("other host", "metric", 60, graphite.fetch)
+    assert graphite.requests[2] is None
+
+
+def test_cache_refetches_longer_time_range():
+    graphite = FakeGraphite(list(range(1000)))
+    cache = GraphiteReadingsCache()
+    graphite.now = 3600
+    cache.readings("host", "metric", 60, graphite.fetch)
+    assert len(cache.readings("host", "metric", 3600, graphite.fetch)) == 360
+    assert graphite.requests == [None, None]
+
+
+def test_cache_refetches_when_step_changes():
+    graphite = FakeGraphite(list(range(1000)))
+    cache = GraphiteReadingsCache()
+    graphite.now = 3600
+    cache.readings("host", "metric", 3600, graphite.fetch)
+    graphite.fetch = lambda since: (since or 0, 60, [1, 2, 3])
+    assert cache.readings("host", "metric", 3600, graphite.fetch) == [1, 2, 3]
+
+
+def test_validation_uses_cache(httpserver):
+    establishServer(httpserver, "None,10,None,30,45,None,None")
+    ctx = GraphiteContext(httpserver.url)
+    v = GraphiteValidation(ctx, "ParticipationIndex Internal Server Errors",
+                           "ParticipationIndex.404-Not-Found-count.count") \
+        .expect_less_than(1000)
+    v.perform({})
+    v.perform({})
+    assert "from=-3600" in httpserver.requests[0].url
+    assert "from=1397748520" in httpserver.requests[1].url
+    assert v._get_readings() == [None, 10, None, 30, 45, None, None]
+
+
+def test_unexpected_header(httpserver):
+    httpserver.serve_content(code=200,
+                             headers={"content-type": "text/plain"},
+                             content="metric,a,b,c|1,2")
+    ctx = GraphiteContext(httpserver.url)
+    with pytest.raises(ValidationFailure):
+        GraphiteValidation(ctx, "name", "metric").perform({})
+
+
+def test_context_rejects_bad_batch_size():
+    with pytest.raises(ValueError):
+        GraphiteContext("host", batch_size=0)
+
+
+def test_prefetch_batches_metrics(httpserver):
+    httpserver.serve_content(code=200,
+                             headers={"content-type": "text/plain"},
+                             content="a,100,130,10|1,2,3\n"
+                                     "b,100,130,10|4,5,6\n"
+                                     "c,100,130,10|7,8,9\n")
+    ctx = GraphiteContext(httpserver.url, batch_size=2)
+    validations = [GraphiteValidation(ctx, name, name).expect_less_than(100)
+                   for name in ("a", "b", "c", "a")]
+    GraphiteValidation.prefetch(validations)
+    assert len(httpserver.requests) == 2
+    assert "target=a&target=b&" in httpserver.requests[0].url
+    assert "target=c&" in httpserver.requests[1].url
+
+    assert validations[0]._get_readings() == [1, 2, 3]
+    assert validations[1]._get_readings() == [4, 5, 6]
+    assert validations[2]._get_readings() == [7, 8, 9]
+    assert len(httpserver.requests) == 2
+
+
+def test_prefetch_requires_batch_size(httpserver):
+    establishServer(httpserver, "1,2,3")
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation.prefetch([GraphiteValidation(ctx, "a", "a")])
+    assert len(httpserver.requests) == 0
+
+
+def test_prefetch_ignores_failed_requests(httpserver):
+    httpserver.serve_content(code=500, content="")
+    ctx = GraphiteContext(httpserver.url, batch_size=10)
+    validation = GraphiteValidation(ctx, "a", "a")
+    GraphiteValidation.prefetch([validation])
+    establishServer(httpserver, "1,2,3")
+    assert validation._get_readings() == [1, 2, 3]
+
+
+def test_readings_are_array_backed(httpserver):
+    establishServer(httpserver, "None,10,None,30,45,None,None")
+    ctx = GraphiteContext(httpserver.url)
+    readings = GraphiteValidation(ctx, "name", "metric")._get_readings()
+    assert readings.array().typecode == "d"
+    assert readings.count() == 3
+
+
+def test_failure_message_lists_worst_readings(httpserver):
+    establishServer(httpserver, "None,10,None,30,45,45,None")
+    ctx = GraphiteContext(httpserver.url)
+    with pytest.raises(ValidationFailure) as excinfo:
+        GraphiteValidation(ctx, "name", "metric") \
+            .expect_less_than(20) \
+            .perform({})
+    assert ("there were 3 readings that exceeded allowed parameters.  " +
+            "For example: 45.0, 30.0") in str(excinfo.value)
+
+
+def test_average_of_missing_readings_fails(httpserver):
+    establishServer(httpserver, "None,None")
+    ctx = GraphiteContext(httpserver.url)
+    with pytest.raises(ValidationFailure):
+        GraphiteValidation(ctx, "name", "metric") \
+            .expect_average_less_than(20) \
+            .perform({})
+
+
+def test_percentile_is_exact():
+    values = [(i * 7919) % 1000 for i in range(1000)]
+    for percent in (50, 95, 99):
+        assert _percentile(values, percent) == \
+            Readings(values).percentile(percent)
+    #a few outliers in a small window shouldn't skew the percentile
+    assert abs(_percentile([1] * 57 + [100] * 3, 95) - 5.95) < 1e-9
+
+
+def test_percentile_skips_missing_readings():
+    assert _percentile([None, 4, 1, 3], 50) == 3
+    assert _percentile([None], 50) is None
+
+
+def test_detect_high_percentile(httpserver):
+    establishServer(httpserver, ",".join(["1"] * 90 + ["100"] * 10))
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation(ctx, "name", "metric") \
+        .expect_percentile_less_than(50, 10) \
+        .perform({})
+    with pytest.raises(ValidationFailure) as excinfo:
+        GraphiteValidation(ctx, "name", "metric") \
+            .expect_percentile_less_than(95, 10) \
+            .perform({})
+    assert "the 95th percentile reading was" in str(excinfo.value)
+
+
+def test_detect_low_percentile(httpserver):
+    establishServer(httpserver, ",".join(["1"] * 10 + ["100"] * 90))
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation(ctx, "name", "metric") \
+        .expect_percentile_greater_than(50, 10) \
+        .perform({})
+    with pytest.raises(ValidationFailure):
+        GraphiteValidation(ctx, "name", "metric") \
+            .expect_percentile_greater_than(5, 10) \
+            .perform({})
+
+
+def test_percentile_must_be_valid():
+    with pytest.raises(ValueError):
+        GraphiteValidation(GraphiteContext("host"), "name", "metric") \
+            .expect_percentile_less_than(101, 10)
+
+
+def test_detect_fast_rate_of_change(httpserver):
+    #ten readings over an hour, so they are six minutes apart
+    establishServer(httpserver, "0,0,0,0,0,360,360,360,360,360")
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation(ctx, "name", "metric") \
+        .expect_max_rate_of_change(2) \
+        .perform({})
+    with pytest.raises(ValidationFailure):
+        GraphiteValidation(ctx, "name", "metric") \
+            .expect_max_rate_of_change(1) \
+            .perform({})
+
+
+def test_rate_of_change_spans_missing_readings(httpserver):
+    establishServer(httpserver, "0,None,None,None,None,360,360,360,360,360")
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation(ctx, "name", "metric") \
+        .expect_max_rate_of_change(0.5) \
+        .perform({})
+
+
+def test_detect_missing_readings(httpserver):
+    establishServer(httpserver, "1,None,None,4,5,6,7,8,9,10")
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation(ctx, "name", "metric") \
+        .expect_missing_readings_less_than(0.3) \
+        .perform({})
+    with pytest.raises(ValidationFailure) as excinfo:
+        GraphiteValidation(ctx, "name", "metric") \
+            .expect_missing_readings_less_than(0.2) \
+            .perform({})
+    assert "2 of 10 readings were missing" in str(excinfo.value)
+
+
+def test_detect_deviation_from_baseline(httpserver):
+    steady = ["10", "11", "9", "10", "12", "8", "10", "11", "9", "10"] * 3
+    establishServer(httpserver, ",".join(steady))
+    ctx = GraphiteContext(httpserver.url)
+    GraphiteValidation(ctx, "name", "metric") \
+        .expect_within_baseline() \
+        .perform({})
+
+    establishServer(httpserver, ",".join(steady + ["50"] + steady))
+    with pytest.raises(ValidationFailure) as excinfo:
+        GraphiteValidation(ctx, "name", "metric2") \
+            .expect_within_baseline() \
+            .perform({})
+    assert "there were 1 readings more than 3" in str(excinfo.value)
+    assert "For example: 50.0" in str(excinfo.value)
+
+
+def test_fingerprint_depends_on_thresholds():
+    ctx = GraphiteContext("host")
+    low = GraphiteValidation(ctx, "name", "metric").expect_less_than(10)
+    high = GraphiteValidation(ctx, "name", "metric").expect_less_than(20)
+    assert low.fingerprint() != high.fingerprint()
+    assert low.fingerprint() == GraphiteValidation(
+        ctx, "name", "metric").expect_less_than(10).fingerprint()
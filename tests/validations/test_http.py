@@ -1,10 +1,13 @@
 "Unit Tests for HttpValidation"""
-from alarmageddon.validations.http import HttpValidation
+from alarmageddon.validations.http import HttpValidation, HttpSessionPool
 from alarmageddon.validations.exceptions import ValidationFailure
 import pytest
 import requests
 from requests.exceptions import ReadTimeout
 import json
+import pickle
+import threading
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from mocks import MockRequestsCall
 
 
@@ -216,7 +219,7 @@ def test_get_json_key_fails(httpserver):
 
 def slowserver_monkeypatch(monkeypatch, response_time):
     mock = MockRequestsCall(response_time=response_time)
-    monkeypatch.setattr(requests, "request", mock.request)
+    monkeypatch.setattr(requests.Session, "request", mock.request)
     return mock
 
 
@@ -325,3 +328,141 @@ def test_nested_json_value_wrong_type(httpserver):
         (HttpValidation.get(httpserver.url)
         .expect_json_property_value('hits.total', '0')
         .perform({}))
+
+
+def test_session_pool_shares_sessions_per_host():
+    pool = HttpSessionPool()
+    first = pool.session("http://example.com/a")
+    assert pool.session("http://EXAMPLE.com:80/b?c=d") is first
+    assert pool.session("https://example.com/a") is not first
+    assert pool.session("http://example.com:8080/a") is not first
+    assert pool.session("http://example.com/a", verify=False) is not first
+    pool.close()
+
+
+def test_session_pool_can_block_at_maxsize():
+    pool = HttpSessionPool(pool_maxsize=2, pool_block=True)
+    adapter = pool.session("http://example.com/a").get_adapter(
+        "http://example.com/a")
+    assert adapter.poolmanager.connection_pool_kw["block"] is True
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 2
+    pool.close()
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def keepalive_server():
+    server = HTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_pool_reuses_connections(keepalive_server):
+    pool = HttpSessionPool()
+    first = HttpValidation.get(keepalive_server, session_pool=pool)
+    second = HttpValidation.get(keepalive_server + "/other", session_pool=pool)
+    first.perform({})
+    second.perform({})
+    assert first.get_connect_time() > 0
+    assert second.get_connect_time() == 0
+    pool.close()
+
+
+def test_session_pool_does_not_keep_cookies(httpserver):
+    httpserver.serve_content(code=200, content="ok",
+                             headers={"Set-Cookie": "session=abc"})
+    pool = HttpSessionPool()
+    HttpValidation.get(httpserver.url, session_pool=pool).perform({})
+    assert len(pool.session(httpserver.url).cookies) == 0
+    pool.close()
+
+
+def test_elapsed_time_excludes_connect_time(monkeypatch):
+    mock = slowserver_monkeypatch(monkeypatch, 4)
+    pool = HttpSessionPool()
+    monkeypatch.setattr(pool, "request",
+                        lambda *args, **kwargs: (mock.request(
+                            "GET", mock.host, None, None, None, None), 1.5))
+    val = HttpValidation.get(mock.host, session_pool=pool)
+    val.perform({})
+    assert val.get_connect_time() == 1.5
+    assert 2.3 < val.get_elapsed_time() < 2.7
+
+
+def test_duplicate_with_hosts_shares_session_pool():
+    pool = HttpSessionPool()
+    validation = HttpValidation.get("http://hostname:8080", session_pool=pool)
+    new = validation.duplicate_with_hosts(["firstname", "secondname"])
+    assert all(v.session_pool is pool for v in new)
+
+
+def test_pickle_round_trip(httpserver):
+    httpserver.serve_content(code=200, content='{}')
+    validation = HttpValidation.get(httpserver.url).expect_contains_text("{")
+    validation.perform({})
+    copy = pickle.loads(pickle.dumps(validation))
+    assert copy.fingerprint() == validation.fingerprint()
+    assert copy.session_pool is HttpValidation.session_pool
+    copy.perform({})
+
+
+def test_pickle_round_trip_with_own_session_pool(httpserver):
+    httpserver.serve_content(code=200, content='{}')
+    validation = HttpValidation.get(httpserver.url,
+                                    session_pool=HttpSessionPool())
+    validation.perform({})
+    copy = pickle.loads(pickle.dumps(validation))
+    assert isinstance(copy.session_pool, HttpSessionPool)
+    copy.perform({})
+
+
+def test_perform_does_not_change_expectations(httpserver):
+    httpserver.serve_content(code=200, content='{}')
+    validation = HttpValidation.get(httpserver.url).expect_contains_text("{")
+    fingerprint = validation.fingerprint()
+    for _ in range(3):
+        validation.perform({})
+    assert len(validation._expectations) == 1
+    assert validation.fingerprint() == fingerprint
+    assert (HttpValidation.get(httpserver.url).expect_contains_text("{")
+            .fingerprint() == fingerprint)
+
+
+def test_fingerprint_depends_on_request():
+    get = HttpValidation.get("http://example.com")
+    assert get.fingerprint() != HttpValidation.post("http://example.com").fingerprint()
+    assert get.fingerprint() != HttpValidation.get(
+        "http://example.com", headers={"a": "b"}).fingerprint()
+
+
+def test_fingerprint_depends_on_expectations():
+    first = HttpValidation.get("http://x/health")\
+        .expect_json_property_value("status", "ok")
+    second = HttpValidation.get("http://x/health")\
+        .expect_json_property_value("db", "ok")
+    assert first.fingerprint() != second.fingerprint()
+    assert first.fingerprint() == HttpValidation.get("http://x/health")\
+        .expect_json_property_value("status", "ok").fingerprint()
+
+
+def test_fingerprint_follows_later_expectations():
+    validation = HttpValidation.get("http://x/health")
+    fingerprint = validation.fingerprint()
+    validation.expect_status_codes([200, 204])
+    assert validation.fingerprint() != fingerprint
@@ -2,11 +2,19 @@ import alarmageddon.validations.ssh as ssh
 import alarmageddon.validations.kafka as kafka
 from alarmageddon.validations.exceptions import ValidationFailure
 import pytest
+import threading
+import time
 from validation_mocks import get_mock_key_file, get_mock_ssh_text
 from fabric import Connection
 
 _CLUSTER_NAME='widget streams'
 
+
+@pytest.fixture(autouse=True)
+def clear_metadata_cache():
+    kafka.DEFAULT_METADATA_CACHE.clear()
+
+
 def test_kafka_success(monkeypatch, tmpdir):
     ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
     text = "topic: topic1\tpartition: 0\tleader: 140\treplicas: 140,187,96,99,132\tisr: 140,187,96,99,132\r\ntopic: topic1\tpartition: 1\tleader: 187\treplicas: 187,96,99,132,140\tisr: 132,96,187,140,99\r\ntopic: topic1\tpartition: 2\tleader: 96\treplicas: 96,99,132,140,187\tisr: 96,99,132,140,187\r\ntopic: topic1\tpartition: 3\tleader: 99\treplicas: 99,132,140,187,96\tisr: 99,132,140,187,96\r\ntopic: topic1\tpartition: 4\tleader: 132\treplicas: 132,140,187,96,99\tisr: 132,140,187,96,99\r\ntopic: topic2\tpartition: 0\tleader: 187\treplicas: 187,96,99,132,140\tisr: 132,96,187,140,99\r\ntopic: topic2\tpartition: 1\tleader: 96\treplicas: 96,99,132,140,187\tisr: 132,96,187,140,99\r\ntopic: topic2\tpartition: 2\tleader: 99\treplicas: 99,132,140,187,96\tisr: 132,96,187,140,99\r\ntopic: topic2\tpartition: 3\tleader: 132\treplicas: 132,140,187,96,99\tisr: 132,96,187,140,99\r\ntopic: topic2\tpartition: 4\tleader: 140\treplicas: 140,187,96,99,132\tisr: 132,96,187,140,99"
@@ -122,3 +130,82 @@ def test_str(monkeypatch, tmpdir):
                                     hosts=["127.0.0.1"],
                                     cluster_name=_CLUSTER_NAME)
     str(v)
+
+
+def test_iter_topic_leaders():
+    text = "topic: topic1\tpartition: 0\tleader: 140\treplicas: 140,187\tisr: 140,187\r\ntopic: topic2\tpartition: 0\tleader: 187\treplicas: 187,140\tisr: 187,140"
+    assert list(kafka.iter_topic_leaders(text)) == [
+        ("topic: topic1", "leader: 140"), ("topic: topic2", "leader: 187")]
+
+
+def test_duplicate_leaders_are_reported_once():
+    pairs = [("a", 1), ("a", 2), ("a", 1), ("b", 1), ("a", 1), ("b", 1)]
+    assert kafka.duplicate_leaders(iter(pairs)) == [("a", 1), ("b", 1)]
+
+
+def test_kafka_metadata_is_fetched_once_per_cluster(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    text = "topic: topic1\tpartition: 0\tleader: 140\treplicas: 140,187\tisr: 140,187\r\ntopic: topic1\tpartition: 1\tleader: 140\treplicas: 140,187\tisr: 140,187"
+    commands = []
+
+    def run(self, command, warn):
+        commands.append(command)
+        return get_mock_ssh_text(text, 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    with pytest.raises(ValidationFailure) as excinfo:
+        (kafka.KafkaStatusValidation(ssh_ctx,
+                                     zookeeper_nodes="1.2.3.4:2181",
+                                     hosts=["127.0.0.1", "127.0.0.2",
+                                            "127.0.0.3"],
+                                     cluster_name=_CLUSTER_NAME)
+         .perform({}))
+    assert len(commands) == 1
+    assert str(excinfo.value).count("topic: topic1 has leader: 140") == 3
+
+
+def test_kafka_failed_fetches_are_not_cached(monkeypatch, tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    outputs = ["-bash: kafka-list-topic.sh: No such file or directory",
+               "topic: topic1\tpartition: 0\tleader: 140\treplicas: 140\tisr: 140"]
+    monkeypatch.setattr(Connection, "run",
+                        lambda self, x, warn: get_mock_ssh_text(outputs.pop(0), 0))
+    validation = kafka.KafkaStatusValidation(ssh_ctx,
+                                             zookeeper_nodes="1.2.3.4:2181",
+                                             hosts=["127.0.0.1"],
+                                             cluster_name=_CLUSTER_NAME)
+    with pytest.raises(ValidationFailure):
+        validation.perform({})
+    validation.perform({})
+
+
+def test_metadata_cache_waiters_fetch_after_a_failure():
+    cache = kafka.KafkaMetadataCache()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing_fetch():
+        started.set()
+        release.wait()
+        raise ValueError("host is down")
+
+    def owner():
+        try:
+            cache.get("cluster", failing_fetch)
+        except ValueError as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=owner)
+    thread.start()
+    started.wait()
+    results = []
+    waiter = threading.Thread(
+        target=lambda: results.append(cache.get("cluster", lambda: "ok")))
+    waiter.start()
+    time.sleep(0.1)
+    release.set()
+    thread.join()
+    waiter.join()
+    assert len(errors) == 1
+    assert results == ["ok"]
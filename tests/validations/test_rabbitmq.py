@@ -1,6 +1,8 @@
 from alarmageddon.validations.rabbitmq import RabbitMqContext,\
-    RabbitMqValidation
+    RabbitMqValidation, RabbitMqConnectionPool, DEFAULT_QUEUE_DEPTHS, \
+    DEFAULT_CONNECTION_POOL
 from alarmageddon.validations.exceptions import ValidationFailure
+from pika.exceptions import AMQPError
 import pytest
 
 
@@ -22,10 +24,61 @@ class MockChannel:
         return MockQueue(self.count)
 
 
+class MockBrokerChannel:
+    def __init__(self, counts):
+        self.counts = counts
+        self.is_open = True
+
+    def queue_declare(self, name, passive):
+        if name not in self.counts:
+            self.is_open = False
+            raise AMQPError("NOT_FOUND - no queue '{}'".format(name))
+        return MockQueue(self.counts[name])
+
+    def close(self):
+        self.is_open = False
+
+
+class MockConnection:
+    def __init__(self, counts):
+        self.counts = counts
+        self.is_open = True
+        self.channels = 0
+
+    def channel(self):
+        self.channels += 1
+        return MockBrokerChannel(self.counts)
+
+    def close(self):
+        self.is_open = False
+
+
+class MockBroker:
+    def __init__(self, counts):
+        self.counts = counts
+        self.connections = []
+
+    def get_connection(self, timeout=None):
+        conn = MockConnection(self.counts)
+        self.connections.append(conn)
+        return conn
+
+
 @pytest.fixture(autouse=True)
 def no_connect(monkeypatch):
     monkeypatch.setattr(RabbitMqValidation, "_connect",
                         lambda self: (None, MockChannel(200)))
+    DEFAULT_QUEUE_DEPTHS.clear()
+    DEFAULT_CONNECTION_POOL.clear()
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = MockBroker({"a": 10, "b": 200, "c": 0})
+    monkeypatch.setattr(RabbitMqContext, "get_connection",
+                        lambda self, timeout=None:
+                        broker.get_connection(timeout))
+    return broker
 
 def test_repr():
     context = RabbitMqContext("host", 88, "name", "password")
@@ -49,3 +102,85 @@ def test_expected_queue_size_correctly_fails():
     with pytest.raises(ValidationFailure):
         (RabbitMqValidation(context, "name", "queue", 100)
          .perform({}))
+
+
+def test_pool_reuses_connections(broker):
+    context = RabbitMqContext("host", 88, "name", "password")
+    pool = RabbitMqConnectionPool()
+    (conn, chan) = pool.acquire(context)
+    pool.release(context, conn, chan)
+    (again, chan) = pool.acquire(context)
+    assert again is conn
+    assert conn.channels == 2
+    assert len(broker.connections) == 1
+
+
+def test_pool_discards_broken_connections(broker):
+    context = RabbitMqContext("host", 88, "name", "password")
+    pool = RabbitMqConnectionPool()
+    (conn, chan) = pool.acquire(context)
+    pool.release(context, conn, chan, broken=True)
+    assert not conn.is_open
+    (again, chan) = pool.acquire(context)
+    assert again is not conn
+
+
+def test_pool_keeps_connections_per_broker(broker):
+    pool = RabbitMqConnectionPool()
+    first = RabbitMqContext("host", 88, "name", "password")
+    second = RabbitMqContext("other", 88, "name", "password")
+    (conn, chan) = pool.acquire(first)
+    pool.release(first, conn, chan)
+    (other, chan) = pool.acquire(second)
+    assert other is not conn
+
+
+def test_for_queues_creates_a_validation_per_queue():
+    context = RabbitMqContext("host", 88, "name", "password")
+    validations = RabbitMqValidation.for_queues(
+        context, "name", {"b": 100, "a": 500}, timeout=5)
+    assert [v.queue_name for v in validations] == ["a", "b"]
+    assert [v.max_queue_size for v in validations] == [500, 100]
+    assert all(v.timeout == 5 for v in validations)
+
+
+def test_prefetch_inspects_queues_over_one_connection(broker):
+    context = RabbitMqContext("host", 88, "name", "password")
+    validations = RabbitMqValidation.for_queues(
+        context, "name", [("a", 100), ("b", 100), ("c", 100)])
+    RabbitMqValidation.prefetch(validations)
+    assert len(broker.connections) == 1
+
+    validations[0].perform({})
+    validations[2].perform({})
+    with pytest.raises(ValidationFailure) as excinfo:
+        validations[1].perform({})
+    assert "200 messages" in str(excinfo.value)
+
+
+def test_prefetch_skips_missing_queues(broker):
+    context = RabbitMqContext("host", 88, "name", "password")
+    validations = RabbitMqValidation.for_queues(
+        context, "name", [("a", 100), ("missing", 100), ("b", 500)])
+    RabbitMqValidation.prefetch(validations)
+    assert len(broker.connections) == 1
+    assert DEFAULT_QUEUE_DEPTHS.message_count(context, "a") == 10
+    assert DEFAULT_QUEUE_DEPTHS.message_count(context, "missing") is None
+    assert DEFAULT_QUEUE_DEPTHS.message_count(context, "b") == 200
+
+
+def test_prefetch_skips_unreachable_brokers(monkeypatch):
+    broker = MockBroker({"a": 10})
+
+    def get_connection(self, timeout=None):
+        if self.host == "down":
+            raise AMQPError("connection refused")
+        return broker.get_connection(timeout)
+
+    monkeypatch.setattr(RabbitMqContext, "get_connection", get_connection)
+    down = RabbitMqContext("down", 88, "name", "password")
+    up = RabbitMqContext("up", 88, "name", "password")
+    RabbitMqValidation.prefetch([RabbitMqValidation(down, "name", "a", 100),
+                                 RabbitMqValidation(up, "name", "a", 100)])
+    assert DEFAULT_QUEUE_DEPTHS.message_count(down, "a") is None
+    assert DEFAULT_QUEUE_DEPTHS.message_count(up, "a") == 10
@@ -0,0 +1,202 @@
+from alarmageddon.validations.rabbitmq_management import\
+    RabbitMqManagementContext, RabbitMqQueueValidation, RabbitMqSnapshots,\
+    DEFAULT_SNAPSHOTS, DEFAULT_TIMEOUT, iter_json_array
+from alarmageddon.validations.exceptions import ValidationFailure
+import json
+import threading
+import time
+import pytest
+import requests
+
+
+QUEUES = [
+    {"name": "orders", "vhost": "/", "messages": 120, "consumers": 2,
+     "message_stats": {"publish_details": {"rate": 4.5},
+                       "deliver_get_details": {"rate": 4.0}}},
+    {"name": "orders", "vhost": "staging", "messages": 0, "consumers": 0},
+    {"name": "emails", "vhost": "/", "messages": 5000, "consumers": 1,
+     "message_stats": {"publish_details": {"rate": 0.0}}},
+]
+
+
+@pytest.fixture(autouse=True)
+def clear_snapshots():
+    DEFAULT_SNAPSHOTS.clear()
+
+
+def serve_queues(httpserver, queues=QUEUES):
+    httpserver.serve_content(code=200,
+                             headers={"content-type": "application/json"},
+                             content=json.dumps(queues))
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_iter_json_array_across_chunks():
+    text = json.dumps(QUEUES + [1234, "a, ]", [5, 6]])
+    for size in (1, 3, 7, len(text)):
+        assert list(iter_json_array(chunked(text, size))) == \
+            QUEUES + [1234, "a, ]", [5, 6]]
+
+
+def test_iter_json_array_of_nothing():
+    assert list(iter_json_array([" [ ", " ] "])) == []
+
+
+def test_iter_json_array_rejects_bad_documents():
+    with pytest.raises(ValueError):
+        list(iter_json_array(['{"a": 1}']))
+    with pytest.raises(ValueError):
+        list(iter_json_array(['[{"a": 1}, {"b"']))
+
+
+def test_fetch_queues_indexes_by_vhost_and_name(httpserver):
+    serve_queues(httpserver)
+    queues = RabbitMqManagementContext(httpserver.url, "guest", "guest")\
+        .fetch_queues()
+    assert sorted(queues) == [("/", "emails"), ("/", "orders"),
+                              ("staging", "orders")]
+    orders = queues[("/", "orders")]
+    assert orders.messages == 120
+    assert orders.consumers == 2
+    assert orders.publish_rate == 4.5
+    assert orders.deliver_rate == 4.0
+    assert queues[("staging", "orders")].publish_rate == 0.0
+    assert httpserver.requests[0].args["columns"]
+
+
+def test_repr():
+    context = RabbitMqManagementContext("http://host:15672", "guest", "guest")
+    repr(RabbitMqQueueValidation(context, "name", "orders"))
+    str(RabbitMqQueueValidation(context, "name", "orders"))
+
+
+def test_validations_share_one_snapshot(httpserver):
+    serve_queues(httpserver)
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    validations = [
+        RabbitMqQueueValidation(context, "name", "orders")
+        .expect_messages_less_than(1000)
+        .expect_consumers_at_least(1),
+        RabbitMqQueueValidation(context, "name", "orders", vhost="staging")
+        .expect_messages_less_than(1),
+        RabbitMqQueueValidation(context, "name", "emails")
+        .expect_publish_rate_less_than(1)]
+    RabbitMqQueueValidation.prefetch(validations)
+    for validation in validations:
+        validation.perform({})
+    assert len(httpserver.requests) == 1
+
+
+def test_detect_too_many_messages(httpserver):
+    serve_queues(httpserver)
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    with pytest.raises(ValidationFailure) as excinfo:
+        RabbitMqQueueValidation(context, "name", "emails")\
+            .expect_messages_less_than(1000)\
+            .perform({})
+    assert "Messages was 5000, expected less than 1000" in str(excinfo.value)
+
+
+def test_detect_too_few_consumers(httpserver):
+    serve_queues(httpserver)
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    with pytest.raises(ValidationFailure):
+        RabbitMqQueueValidation(context, "name", "orders", vhost="staging")\
+            .expect_consumers_at_least(1)\
+            .perform({})
+
+
+def test_detect_slow_delivery(httpserver):
+    serve_queues(httpserver)
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    with pytest.raises(ValidationFailure):
+        RabbitMqQueueValidation(context, "name", "emails")\
+            .expect_deliver_rate_at_least(1)\
+            .perform({})
+
+
+def test_missing_queue_fails(httpserver):
+    serve_queues(httpserver)
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    with pytest.raises(ValidationFailure) as excinfo:
+        RabbitMqQueueValidation(context, "name", "orders", vhost="prod")\
+            .perform({})
+    assert "was not found in vhost 'prod'" in str(excinfo.value)
+
+
+def test_unreachable_api_fails(httpserver):
+    httpserver.serve_content(code=500, content="")
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    with pytest.raises(ValidationFailure):
+        RabbitMqQueueValidation(context, "name", "orders").perform({})
+
+
+def test_snapshots_expire(httpserver):
+    serve_queues(httpserver)
+    context = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    snapshots = RabbitMqSnapshots(max_age=0)
+    snapshots.queues(context)
+    snapshots.queues(context)
+    assert len(httpserver.requests) == 2
+
+
+def test_prefetch_skips_unreachable_brokers(httpserver):
+    serve_queues(httpserver)
+    down = RabbitMqManagementContext("http://127.0.0.1:1", "guest", "guest")
+    up = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    RabbitMqQueueValidation.prefetch([
+        RabbitMqQueueValidation(down, "name", "orders"),
+        RabbitMqQueueValidation(up, "name", "orders")])
+    assert len(httpserver.requests) == 1
+
+
+def test_fetch_timeout(monkeypatch):
+    timeouts = []
+
+    def get(url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        raise requests.exceptions.ConnectionError("down")
+
+    monkeypatch.setattr(requests, "get", get)
+    context = RabbitMqManagementContext("http://host:15672", "guest", "guest")
+    RabbitMqQueueValidation.prefetch([
+        RabbitMqQueueValidation(context, "name", "orders", timeout=9),
+        RabbitMqQueueValidation(context, "name", "emails", timeout=4),
+        RabbitMqQueueValidation(context, "name", "other")])
+    with pytest.raises(ValidationFailure):
+        RabbitMqQueueValidation(context, "name", "orders").perform({})
+    RabbitMqQueueValidation.prefetch([
+        RabbitMqQueueValidation(
+            RabbitMqManagementContext("http://host:15672", "guest", "guest",
+                                      timeout=2), "name", "orders",
+            timeout=9)])
+    assert timeouts == [4, DEFAULT_TIMEOUT, 2]
+
+
+def test_slow_broker_does_not_hold_up_others(httpserver):
+    serve_queues(httpserver)
+    fast = RabbitMqManagementContext(httpserver.url, "guest", "guest")
+    slow = RabbitMqManagementContext("http://slow:15672", "guest", "guest")
+    fetching = threading.Event()
+    release = threading.Event()
+
+    def fetch_slowly(timeout=None):
+        fetching.set()
+        release.wait(5)
+        return {}
+
+    slow.fetch_queues = fetch_slowly
+    snapshots = RabbitMqSnapshots()
+    thread = threading.Thread(target=snapshots.queues, args=(slow,))
+    thread.start()
+    try:
+        fetching.wait(5)
+        start = time.time()
+        snapshots.queues(fast)
+        assert time.time() - start < 2
+    finally:
+        release.set()
+        thread.join()
@@ -1,14 +1,22 @@
+import alarmageddon.run
 import alarmageddon.validations.ssh as ssh
 from alarmageddon.validations.exceptions import ValidationFailure
 import pytest
 import _pytest
 import os
+import time
+import threading
 from validation_mocks import get_mock_key_file, get_mock_ssh_text
 from fabric import Connection
 
 hosts = ["a fake host"]
 
 
+@pytest.fixture(autouse=True)
+def clear_command_cache():
+    ssh.DEFAULT_COMMAND_CACHE.clear()
+
+
 def test_ssh_works(monkeypatch, tmpdir):
     t = "18:01:46 up 62 days, 18:27,  1 user,  load average: 0.09, 0.04, 0.05"
     monkeypatch.setattr(Connection, "run",
@@ -336,3 +344,411 @@ def test_str(monkeypatch, tmpdir):
     ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
 
     str(ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=hosts))
+
+
+def test_validations_share_pooled_connections(monkeypatch, tmpdir):
+    t = "18:01:46 up 62 days, 18:27,  1 user,  load average: 0.09, 0.04, 0.05"
+    used = []
+
+    def run(self, x, err_stream=None, timeout=None, warn=False):
+        used.append(self)
+        return get_mock_ssh_text(t, 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    pool = ssh.SshConnectionPool()
+    monkeypatch.setattr(ssh.SshValidation, "connection_pool", pool)
+
+    ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=hosts).perform({})
+    ssh.LoadAverageValidation(ssh_ctx, hosts=hosts).perform({})
+    ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                             hosts=["another host"]).perform({})
+    assert used[0] is used[1]
+    assert used[0] is not used[2]
+    assert used[0].user == "ubuntu"
+
+
+def test_pool_lends_connection_to_one_borrower_at_a_time(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    pool = ssh.SshConnectionPool()
+    with pool.borrow("host", ssh_ctx) as first:
+        with pool.borrow("host", ssh_ctx) as second:
+            assert first is not second
+    with pool.borrow("host", ssh_ctx) as third:
+        assert third is first
+
+
+class MockTransport(object):
+    def __init__(self, active):
+        self.active = active
+
+    def close(self):
+        pass
+
+
+def test_pool_evicts_dead_transports(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    pool = ssh.SshConnectionPool()
+    with pool.borrow("host", ssh_ctx) as first:
+        first.transport = MockTransport(False)
+    with pool.borrow("host", ssh_ctx) as second:
+        assert second is not first
+
+
+def test_pool_evicts_idle_connections(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    pool = ssh.SshConnectionPool(max_idle=-1)
+    with pool.borrow("host", ssh_ctx) as first:
+        pass
+    with pool.borrow("host", ssh_ctx) as second:
+        assert second is not first
+
+
+def test_pool_evicts_connections_that_raise(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    pool = ssh.SshConnectionPool()
+    with pytest.raises(EOFError):
+        with pool.borrow("host", ssh_ctx) as first:
+            raise EOFError()
+    with pytest.raises(ValidationFailure):
+        with pool.borrow("host", ssh_ctx) as second:
+            assert second is not first
+            raise ValidationFailure("expectation not met")
+    with pool.borrow("host", ssh_ctx) as third:
+        assert third is second
+
+
+def test_hosts_are_checked_concurrently(monkeypatch, tmpdir):
+    def slow_run(self, x, err_stream, timeout, warn):
+        time.sleep(1)
+        return get_mock_ssh_text("output", 0)
+
+    monkeypatch.setattr(Connection, "run", slow_run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    many_hosts = ["host{}".format(i) for i in range(6)]
+
+    start = time.time()
+    (ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=many_hosts,
+                              host_concurrency=6)
+     .perform({}))
+    assert time.time() - start < 3
+
+
+def test_failures_are_reported_for_every_host(monkeypatch, tmpdir):
+    monkeypatch.setattr(Connection, "run",
+                        lambda self, x, err_stream, timeout, warn:
+                        get_mock_ssh_text(self.host, 0))
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+
+    with pytest.raises(ValidationFailure) as excinfo:
+        (ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                  hosts=["good", "bad1", "bad2"])
+         .expect_output_does_not_contain("bad")
+         .perform({}))
+    message = str(excinfo.value)
+    assert "[bad1]" in message
+    assert "[bad2]" in message
+    assert "[good]" not in message
+
+
+def test_slow_host_only_fails_itself(monkeypatch, tmpdir):
+    def run(self, x, err_stream, timeout, warn):
+        if self.host == "slow":
+            time.sleep(5)
+        return get_mock_ssh_text("output", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+
+    start = time.time()
+    with pytest.raises(ValidationFailure) as excinfo:
+        (ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                  hosts=["fast", "slow"], host_timeout=1)
+         .perform({}))
+    assert time.time() - start < 3
+    message = str(excinfo.value)
+    assert "[slow] Did not finish within 1s" in message
+    assert "[fast]" not in message
+
+
+def test_queued_hosts_time_out_once_they_start(monkeypatch, tmpdir):
+    def run(self, x, err_stream, timeout, warn):
+        time.sleep(8)
+        return get_mock_ssh_text("output", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+
+    start = time.time()
+    with pytest.raises(ValidationFailure) as excinfo:
+        (ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                  hosts=["one", "two", "three"],
+                                  host_concurrency=1, host_timeout=1)
+         .perform({}))
+    assert time.time() - start < 5
+    message = str(excinfo.value)
+    for host in ["one", "two", "three"]:
+        assert "[{0}] Did not finish within 1s".format(host) in message
+
+
+def test_shared_uptime_runs_once_per_host(monkeypatch, tmpdir):
+    t = "18:01:46 up 62 days, 18:27,  1 user,  load average: 0.09, 0.04, 0.05"
+    calls = []
+
+    def run(self, x, warn):
+        calls.append((self.host, x))
+        return get_mock_ssh_text(t, 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+
+    (ssh.LoadAverageValidation(ssh_ctx, hosts=["a", "b"], share_output=True)
+     .expect_max_1_minute_load(40)
+     .perform({}))
+    with pytest.raises(ValidationFailure):
+        (ssh.LoadAverageValidation(ssh_ctx, hosts=["a", "b"],
+                                   share_output=True)
+         .expect_max_1_minute_load(0.01)
+         .perform({}))
+    assert sorted(calls) == [("a", "uptime"), ("b", "uptime")]
+
+
+def test_uptime_is_not_shared_by_default(monkeypatch, tmpdir):
+    t = "18:01:46 up 62 days, 18:27,  1 user,  load average: 0.09, 0.04, 0.05"
+    calls = []
+
+    def run(self, x, warn):
+        calls.append((self.host, x))
+        return get_mock_ssh_text(t, 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.LoadAverageValidation(ssh_ctx, hosts=["a"])\
+        .expect_max_1_minute_load(40)
+    assert validation.shared_commands() == []
+    validation.perform({})
+    validation.perform({})
+    assert calls == [("a", "uptime"), ("a", "uptime")]
+
+
+def test_shared_output_is_checked_by_each_validation(monkeypatch, tmpdir):
+    calls = []
+
+    def run(self, x, err_stream, timeout, warn):
+        calls.append(x)
+        return get_mock_ssh_text("all is well", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+
+    (ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=hosts,
+                              share_output=True)
+     .expect_output_contains("well")
+     .perform({}))
+    with pytest.raises(ValidationFailure):
+        (ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=hosts,
+                                  share_output=True)
+         .expect_output_contains("unwell")
+         .perform({}))
+    (ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=hosts)
+     .perform({}))
+    assert calls == ["cmd", "cmd"]
+
+
+def test_command_cache_expires_output(monkeypatch, tmpdir):
+    calls = []
+
+    def run(self, x, warn):
+        calls.append(x)
+        return get_mock_ssh_text("output", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    cache = ssh.SshCommandCache(max_age=-1)
+    connection = Connection("host", user="ubuntu")
+    cache.run(connection, "cmd", warn=True)
+    cache.run(connection, "cmd", warn=True)
+    assert calls == ["cmd", "cmd"]
+
+
+def test_command_cache_does_not_cache_errors(monkeypatch, tmpdir):
+    calls = []
+
+    def run(self, x, warn):
+        calls.append(x)
+        if len(calls) == 1:
+            raise EOFError()
+        return get_mock_ssh_text("output", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    cache = ssh.SshCommandCache()
+    connection = Connection("host", user="ubuntu")
+    with pytest.raises(EOFError):
+        cache.run(connection, "cmd", warn=True)
+    assert cache.run(connection, "cmd", warn=True) == "output"
+    assert cache.run(connection, "cmd", warn=True) == "output"
+    assert len(calls) == 2
+
+
+def test_command_cache_coalesces_concurrent_runs(monkeypatch, tmpdir):
+    calls = []
+
+    def run(self, x, warn):
+        calls.append(x)
+        time.sleep(0.5)
+        return get_mock_ssh_text("output", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    cache = ssh.SshCommandCache()
+    connection = Connection("host", user="ubuntu")
+    outputs = []
+    threads = [threading.Thread(
+        target=lambda: outputs.append(cache.run(connection, "cmd", warn=True)))
+        for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["cmd"]
+    assert outputs == ["output"] * 5
+
+
+def test_load_average_fingerprint_depends_on_limits(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    low = ssh.LoadAverageValidation(ssh_ctx, hosts=["a"])\
+        .expect_max_1_minute_load(1)
+    high = ssh.LoadAverageValidation(ssh_ctx, hosts=["a"])\
+        .expect_max_1_minute_load(10)
+    assert low.fingerprint() != high.fingerprint()
+
+
+def test_ssh_fingerprint_follows_added_hosts(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])
+    fingerprint = validation.fingerprint()
+    with pytest.warns(FutureWarning):
+        validation.add_hosts(["b"])
+    assert validation.fingerprint() != fingerprint
+
+
+def test_ssh_fingerprint_depends_on_expectations(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    first = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])
+    fingerprint = first.fingerprint()
+    first.expect_output_contains("ok")
+    assert first.fingerprint() != fingerprint
+    second = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])\
+        .expect_output_contains("ok")
+    assert first.fingerprint() == second.fingerprint()
+
+
+def test_perform_does_not_change_expectations(monkeypatch, tmpdir):
+    monkeypatch.setattr(Connection, "run",
+                        lambda self, x, err_stream, timeout, warn:
+                        get_mock_ssh_text("ok", 0))
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                          hosts=["a"])\
+        .expect_output_contains("ok")
+    fingerprint = validation.fingerprint()
+    validation.perform({})
+    validation.perform({})
+    assert len(validation.expectations) == 1
+    assert validation.fingerprint() == fingerprint
+
+
+def test_exit_code_is_checked_on_every_perform(monkeypatch, tmpdir):
+    monkeypatch.setattr(Connection, "run",
+                        lambda self, x, err_stream, timeout, warn:
+                        get_mock_ssh_text("ok", 1))
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                          hosts=["a"])
+    for _ in range(2):
+        with pytest.raises(ValidationFailure):
+            validation.perform({})
+
+
+def test_ssh_fingerprint_depends_on_exit_code(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    zero = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])
+    one = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])\
+        .expect_exit_code(1)
+    assert zero.fingerprint() != one.fingerprint()
+
+
+def test_prefetch_runs_shared_commands_once_per_host(monkeypatch, tmpdir):
+    t = "18:01:46 up 62 days, 18:27,  1 user,  load average: 0.09, 0.04, 0.05"
+    calls = []
+
+    def run(self, command, **kwargs):
+        calls.append((self.host, command))
+        return get_mock_ssh_text(t, 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validations = [
+        ssh.LoadAverageValidation(ssh_ctx, hosts=["a", "b"], share_output=True)
+        .expect_max_1_minute_load(1),
+        ssh.LoadAverageValidation(ssh_ctx, hosts=["a", "b"], share_output=True)
+        .expect_max_5_minute_load(1),
+        ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"],
+                                 share_output=True),
+        ssh.SshCommandValidation(ssh_ctx, "name", "unshared", hosts=["a"])]
+    ssh.LoadAverageValidation.prefetch(validations[:2])
+    ssh.SshCommandValidation.prefetch(validations[2:])
+    assert sorted(calls) == [("a", "cmd"), ("a", "uptime"), ("b", "uptime")]
+
+    for validation in validations[:3]:
+        validation.perform({})
+    assert len(calls) == 3
+
+
+def test_prefetched_output_is_shared_with_forked_workers(monkeypatch,
+                                                          tmpdir):
+    calls = []
+
+    def run(self, command, **kwargs):
+        calls.append(command)
+        return get_mock_ssh_text("ok", 0)
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                          hosts=["a"], share_output=True)
+    ssh.SshCommandValidation.prefetch([validation])
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            validation.perform({})
+        finally:
+            os._exit(len(calls))
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 1
+
+
+def test_prefetch_logs_failures(monkeypatch, tmpdir):
+    def run(self, command, **kwargs):
+        raise EOFError("connection lost")
+
+    monkeypatch.setattr(Connection, "run", run)
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                          hosts=["a", "b"], share_output=True)
+    ssh.SshCommandValidation.prefetch([validation])
+
+
+def test_run_tests_defaults_to_async_engine_for_ssh(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd", hosts=["a"])
+    assert alarmageddon.run._default_engine([validation]) == "async"
+
+
+def test_host_timeout_defaults_to_less_than_timeout(tmpdir):
+    ssh_ctx = ssh.SshContext("ubuntu", get_mock_key_file(tmpdir))
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                          timeout=10, hosts=["a"])
+    assert 0 < validation.host_timeout < 10
+    validation = ssh.SshCommandValidation(ssh_ctx, "name", "cmd",
+                                          hosts=["a"])
+    assert validation.host_timeout is None
@@ -169,3 +169,39 @@ def test_get_enrichment_forced_namespace():
     valid.enrich(pub, pub_values, force_namespace=True)
     valid.enrich(page, page_values, force_namespace=True)
     assert valid.get_enriched(page, force_namespace=True) == {1: 5, "what": "who"}
+
+
+def test_fingerprint_is_stable():
+    v = Validation("name", group="a")
+    assert v.fingerprint() == Validation("name", group="a").fingerprint()
+    v.priority = Priority.CRITICAL
+    assert v.fingerprint() == Validation("name", group="a").fingerprint()
+
+
+def test_fingerprint_depends_on_identity():
+    v = Validation("name")
+    assert v.fingerprint() != Validation("other").fingerprint()
+    assert v.fingerprint() != Validation("name", group="a").fingerprint()
+    assert v.fingerprint() != GroupValidation("name", "a").fingerprint()
+    assert (GroupValidation("name", "a").fingerprint() !=
+            GroupValidation("name", "b").fingerprint())
+    assert (GroupValidation("name", "a", normal_threshold=1).fingerprint() !=
+            GroupValidation("name", "a", normal_threshold=2).fingerprint())
+
+
+def test_fingerprint_is_cached_until_identity_changes():
+    class Counting(Validation):
+        calls = 0
+
+        def _identity(self):
+            Counting.calls += 1
+            return Validation._identity(self)
+
+    v = Counting("name")
+    fingerprint = v.fingerprint()
+    assert v.fingerprint() == fingerprint
+    assert Counting.calls == 1
+    v.name = "other"
+    v._identity_changed()
+    assert v.fingerprint() != fingerprint
+    assert Counting.calls == 2